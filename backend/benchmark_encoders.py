@@ -0,0 +1,152 @@
+"""
+Encoder profile benchmark.
+Builds synthetic clips with ffmpeg lavfi (testsrc2 + sine, several aspect ratios
+and durations), runs the real Shorts encode for every profile in
+media.ENCODE_PROFILES and reports encode time, CPU time, output size and the
+resulting upload time, plus uploads per CPU-hour to pick the best profile.
+
+Usage (from backend/, with the same .env as the worker):
+    python benchmark_encoders.py
+    python benchmark_encoders.py --profiles fast,balanced --durations 30,60 --upload-mbps 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List
+from deps import settings
+from media import ENCODE_PROFILES, run_command
+from pipeline import build_encode_cmd
+from telemetry import ffmpeg_cpu_seconds
+
+
+# name -> (width, height): typical sources of a Shorts channel
+ASPECTS = {
+    'landscape': (1920, 1080),
+    'portrait': (1080, 1920),
+    'square': (1080, 1080),
+}
+
+
+async def make_clip(path: str, width: int, height: int, duration: int, pattern: str) -> None:
+    """Synthetic H.264/AAC source clip (high quality, so the encode dominates)."""
+    cmd = [
+        settings.ffmpeg_bin, '-v', 'error',
+        '-f', 'lavfi', '-i', f'{pattern}=size={width}x{height}:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '192k',
+        '-shortest', '-y', path,
+    ]
+    result = await run_command(cmd, timeout=600)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not build clip {path}: {result.stderr[-300:]}")
+
+
+async def encode_clip(clip: Dict[str, Any], profile: str, output_path: str, upload_mbps: float) -> Dict[str, Any]:
+    started = time.monotonic()
+    result = await run_command(build_encode_cmd(clip['path'], output_path, profile), timeout=1800)
+    wall = time.monotonic() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Encode failed ({profile}, {clip['name']}): {result.stderr[-300:]}")
+    size = os.path.getsize(output_path)
+    os.remove(output_path)
+    return {
+        'profile': profile,
+        'clip': clip['name'],
+        'encode_seconds': round(wall, 2),
+        'cpu_seconds': round(ffmpeg_cpu_seconds(result.stderr) or wall, 2),
+        'output_bytes': size,
+        'upload_seconds': round(size * 8 / (upload_mbps * 1_000_000), 2),
+    }
+
+
+def summarize(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Per-profile totals; uploads per CPU-hour is the number to maximise."""
+    summary = []
+    for profile in dict.fromkeys(row['profile'] for row in rows):
+        runs = [row for row in rows if row['profile'] == profile]
+        cpu = sum(row['cpu_seconds'] for row in runs)
+        encode = sum(row['encode_seconds'] for row in runs)
+        upload = sum(row['upload_seconds'] for row in runs)
+        summary.append({
+            'profile': profile,
+            'clips': len(runs),
+            'avg_encode_seconds': round(encode / len(runs), 2),
+            'avg_cpu_seconds': round(cpu / len(runs), 2),
+            'avg_output_mb': round(sum(row['output_bytes'] for row in runs) / len(runs) / 1_000_000, 2),
+            'avg_upload_seconds': round(upload / len(runs), 2),
+            'uploads_per_cpu_hour': round(3600 * len(runs) / cpu, 1) if cpu else None,
+            # One encoder and one upload in flight: the slower side sets the pace
+            'uploads_per_hour_pipelined': round(3600 * len(runs) / max(encode, upload), 1) if max(encode, upload) else None,
+        })
+    return sorted(summary, key=lambda s: -(s['uploads_per_cpu_hour'] or 0))
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    profiles = [p.strip() for p in args.profiles.split(',') if p.strip()]
+    unknown = [p for p in profiles if p not in ENCODE_PROFILES]
+    if unknown:
+        raise SystemExit(f"Unknown profiles: {', '.join(unknown)} (available: {', '.join(ENCODE_PROFILES)})")
+    aspects = [a.strip() for a in args.aspects.split(',') if a.strip()]
+    if any(a not in ASPECTS for a in aspects):
+        raise SystemExit(f"Unknown aspect in '{args.aspects}' (available: {', '.join(ASPECTS)})")
+    durations = [int(d) for d in args.durations.split(',') if d.strip()]
+
+    workdir = tempfile.mkdtemp(prefix='encoder_bench_', dir=settings.temp_dir)
+    try:
+        clips = []
+        for aspect in aspects:
+            width, height = ASPECTS[aspect]
+            for duration in durations:
+                name = f"{aspect}_{duration}s"
+                path = os.path.join(workdir, f"{name}.mp4")
+                print(f"Building clip {name} ({width}x{height})...")
+                await make_clip(path, width, height, duration, args.pattern)
+                clips.append({'name': name, 'path': path})
+
+        rows = []
+        for profile in profiles:
+            for clip in clips:
+                row = await encode_clip(clip, profile, os.path.join(workdir, 'out.mp4'), args.upload_mbps)
+                print(f"  {profile:<10} {clip['name']:<16} encode {row['encode_seconds']}s, cpu {row['cpu_seconds']}s, "
+                      f"{row['output_bytes'] / 1_000_000:.2f} MB")
+                rows.append(row)
+        return {'runs': rows, 'summary': summarize(rows)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Shorts encoder profiles on synthetic clips.")
+    parser.add_argument('--profiles', default=','.join(ENCODE_PROFILES), help="comma-separated profile names")
+    parser.add_argument('--aspects', default=','.join(ASPECTS), help=f"comma-separated: {', '.join(ASPECTS)}")
+    parser.add_argument('--durations', default='15,45,90', help="clip durations in seconds (encode stops at 60)")
+    parser.add_argument('--pattern', default='testsrc2', help="lavfi video source, e.g. testsrc2, mandelbrot, life")
+    parser.add_argument('--upload-mbps', type=float, default=20.0, help="upload bandwidth used to estimate upload time")
+    parser.add_argument('--json', action='store_true', help="print the full results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    print()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results['summary'])
+
+
+if __name__ == "__main__":
+    main()
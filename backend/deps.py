@@ -2,6 +2,7 @@
 Dependencies: Database connections, encryption, and shared utilities.
 """
 import os
+import socket
 from pathlib import Path
 from typing import Optional
 import asyncpg
@@ -23,7 +24,19 @@ class Settings(BaseSettings):
     ytdlp_extractor_args: str = "youtube:player_client=android"
     ytdlp_retries: int = 5
     ytdlp_sleep_requests: float = 1.0
+    # "binary" spawns yt-dlp per attempt; "python" keeps yt-dlp loaded in worker processes
+    ytdlp_engine: str = "binary"
+    ytdlp_engine_workers: int = 2
+    ytdlp_info_cache_ttl: int = 1800  # stream URLs expire after a few hours
+    # yt-dlp format sort: up to 1080 on the short side, remuxable codecs, lowest bitrate
+    ytdlp_format_sort: str = "res:1080,vcodec:h264,acodec:aac,+br,+size"
+    # Token bucket shared by all workers (Postgres); replaces yt-dlp's fixed sleeps
+    ytdlp_rate_limit_enabled: bool = True
+    ytdlp_rate_limit_burst: float = 3
+    ytdlp_rate_limit_per_minute: float = 6
+    ytdlp_rate_limit_penalty_seconds: int = 120  # pause for everyone after a 429
     ffmpeg_bin: str = "ffmpeg"
+    encode_profile: str = "balanced"  # fast | balanced | small (accounts/themes can override)
     temp_dir: str = "/tmp"
     # Optional authentication for yt-dlp when YouTube requires cookies
     ytdlp_cookies_file: str = ""
@@ -34,12 +47,58 @@ class Settings(BaseSettings):
     ytdlp_use_ipv4: bool = True  # Force IPv4 to avoid some blocks
     worker_poll_interval: int = 60
     worker_batch_size: int = 5
+    # Wake on uploads NOTIFY + next due time; polling (every safety interval) is a fallback
+    worker_wakeups_enabled: bool = True
+    worker_safety_poll_interval: int = 300
+    database_listen_url: str = ""  # session-mode/direct URL for LISTEN (pgbouncer transaction mode can't)
+    # Staged pipeline executor: per-stage concurrency (0 transcode = one per CPU core)
+    pipeline_download_concurrency: int = 4
+    pipeline_transcode_concurrency: int = 0
+    pipeline_upload_concurrency: int = 3
+    # Admission into the executor (0 = no cap): uploads in flight per worker, per account, per quota project
+    dispatch_concurrency: int = 8
+    dispatch_per_account: int = 1
+    dispatch_per_project: int = 3
+    # Pipe yt-dlp straight into ffmpeg for YouTube sources (falls back to a raw file)
+    pipeline_stream_downloads: bool = True
+    # Transcode cache under temp_dir (byte budget + TTL, LRU eviction)
+    transcode_cache_enabled: bool = True
+    transcode_cache_max_bytes: int = 2 * 1024 * 1024 * 1024
+    transcode_cache_ttl_seconds: int = 6 * 3600
+    # Coalesce concurrent runs of the same source + transform (in-process and across replicas)
+    pipeline_single_flight: bool = True
+    pipeline_single_flight_across_replicas: bool = True
+    pipeline_single_flight_wait_seconds: int = 900
+    # Segment-parallel transcoding (auto: used only for long inputs with idle cores)
+    transcode_segment_parallel: bool = True
+    transcode_segment_min_seconds: int = 15
+    transcode_segment_max: int = 4
+    transcode_segment_threads: int = 2
+    # Prefetch: download + transcode uploads this long before scheduled_for
+    prefetch_enabled: bool = True
+    prefetch_lookahead_minutes: int = 120
+    prefetch_batch_size: int = 3
+    prefetch_staging_max_bytes: int = 1024 * 1024 * 1024
     upload_visibility: str = "unlisted"
     max_retries: int = 3
+    upload_lease_seconds: int = 900  # claimed uploads belong to their worker this long
+    upload_lease_heartbeat_seconds: int = 60  # running batches extend their leases this often
     # Supabase Storage (for user-uploaded videos)
     supabase_url: str = ""
     supabase_service_role: str = ""
     supabase_bucket: str = "user-videos"
+    # Pooled storage client: chunked streaming, parallel Range parts for big objects
+    storage_max_connections: int = 16
+    storage_timeout_seconds: int = 60
+    storage_chunk_bytes: int = 1024 * 1024
+    storage_range_part_bytes: int = 16 * 1024 * 1024
+    storage_range_parallelism: int = 4
+    ingest_concurrency: int = 4  # ZIP members uploaded to storage at once
+    # Background jobs (scans, Roblox scheduler, ZIP ingestion) run by the worker
+    jobs_concurrency: int = 3
+    jobs_poll_seconds: float = 2
+    jobs_heartbeat_seconds: int = 30
+    jobs_stale_seconds: int = 300
     # Temporary Google credentials
     temp_client_id: str = ""
     temp_client_secret: str = ""
@@ -50,6 +109,9 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
+# Identifies this process in job claims and leases (uploads, background jobs)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
 # Debug: Print all environment variables
 import os
 print(f"DEBUG: All env vars starting with 'temp':")
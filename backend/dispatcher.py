@@ -0,0 +1,157 @@
+"""
+Fair admission of upload jobs into the staged executor.
+Jobs are released earliest-deadline-first (scheduled_for), but round-robin
+across accounts: the account that has had the fewest jobs started so far goes
+next, so one account's backlog cannot starve the others. A job is admitted only
+while the global and per-account in-flight caps allow it. On admission its quota
+is reserved (the `reserve` callback) on a project that is below the
+per-project cap, so the cap applies to the project actually charged. The job
+holds its slots from download until its upload finishes or fails.
+Dispatch lag (start time minus scheduled_for) is kept as a histogram.
+"""
+import asyncio
+import bisect
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+# Upper bounds (seconds) of the dispatch lag histogram buckets; the last bucket is open-ended.
+# Same boundaries as width_bucket() in models.get_dispatch_lag_histogram.
+LAG_BUCKETS = (1, 5, 15, 60, 300, 900, 3600)
+
+
+def lag_labels() -> List[str]:
+    return [f"<{bound}s" for bound in LAG_BUCKETS] + [f">={LAG_BUCKETS[-1]}s"]
+
+
+def lag_bucket(seconds: float) -> str:
+    return lag_labels()[bisect.bisect_right(LAG_BUCKETS, seconds)]
+
+
+def empty_histogram() -> Dict[str, int]:
+    return {label: 0 for label in lag_labels()}
+
+
+# reserve(item, projects at their cap) -> reserved project key, or None if none has quota
+Reserve = Callable[[Any, List[str]], Awaitable[Optional[str]]]
+
+
+def upload_keys(job: Dict[str, Any]) -> Tuple[str, datetime]:
+    """(account, deadline) of an upload job; retries are due after their backoff."""
+    upload = job['upload']
+    deadline = upload.get('due_at') or upload['scheduled_for']
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    return str(upload['account_id']), deadline
+
+
+class FairDispatcher:
+    """Hands (position, job) entries to the executor as caps allow; see module docstring."""
+
+    def __init__(
+        self,
+        global_limit: int,
+        account_limit: int,
+        project_limit: int,
+        reserve: Optional[Reserve] = None,
+        keys: Callable[[Any], Tuple[str, datetime]] = upload_keys
+    ):
+        self.global_limit = global_limit
+        self.account_limit = account_limit
+        self.project_limit = project_limit
+        self.reserve = reserve
+        self.keys = keys
+        self._pending: Dict[str, List[Tuple[datetime, int, Any]]] = defaultdict(list)
+        self._in_flight: Dict[int, Tuple[str, Optional[str]]] = {}
+        self._by_account: Dict[str, int] = defaultdict(int)
+        self._by_project: Dict[str, int] = defaultdict(int)
+        self._started: Dict[str, int] = defaultdict(int)
+        self._changed = asyncio.Event()
+        self.lag_histogram = empty_histogram()
+        self.max_lag_seconds = 0.0
+
+    def add(self, entries: List[Tuple[int, Any]]) -> None:
+        for position, item in entries:
+            account, deadline = self.keys(item)
+            self._pending[account].append((deadline, position, item))
+        for queue in self._pending.values():
+            queue.sort(key=lambda entry: (entry[0], entry[1]))
+
+    def _admissible(self, account: str) -> bool:
+        return (
+            (not self.global_limit or len(self._in_flight) < self.global_limit)
+            and (not self.account_limit or self._by_account[account] < self.account_limit)
+        )
+
+    def _full_projects(self) -> List[str]:
+        if not self.project_limit:
+            return []
+        return [project for project, count in self._by_project.items() if count >= self.project_limit]
+
+    async def _wait_for_release(self) -> None:
+        self._changed.clear()
+        await self._changed.wait()
+
+    def _pick(self) -> Optional[str]:
+        """Fewest jobs started first (round-robin), then earliest head deadline (EDF)."""
+        candidates = [account for account, queue in self._pending.items() if queue and self._admissible(account)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda account: (self._started[account], self._pending[account][0][0]))
+
+    async def next(self) -> Optional[Tuple[int, Any]]:
+        """
+        The next entry to start, waiting for a slot if needed; None once all are
+        started. When no project below its cap has quota but some are at their
+        cap, waits for one of them to free up. When no project has quota at all,
+        the entry goes out unreserved (the pipeline pauses it).
+        """
+        while True:
+            if not any(self._pending.values()):
+                return None
+            account = self._pick()
+            if account is None:
+                await self._wait_for_release()
+                continue
+            if self.reserve is None:
+                project = None
+                break
+            full = self._full_projects()
+            project = await self.reserve(self._pending[account][0][2], full)
+            if project is not None or not full:
+                break
+            await self._wait_for_release()
+
+        deadline, position, item = self._pending[account].pop(0)
+        self._in_flight[position] = (account, project)
+        self._by_account[account] += 1
+        if project is not None:
+            self._by_project[project] += 1
+        self._started[account] += 1
+
+        lag = max(0.0, (datetime.now(timezone.utc) - deadline).total_seconds())
+        self.lag_histogram[lag_bucket(lag)] += 1
+        self.max_lag_seconds = max(self.max_lag_seconds, lag)
+        if isinstance(item, dict):
+            item['dispatch_lag_seconds'] = lag
+        return position, item
+
+    def release(self, position: int) -> None:
+        """The job at `position` finished (uploaded or failed): free its slots."""
+        slot = self._in_flight.pop(position, None)
+        if slot is None:
+            return
+        account, project = slot
+        self._by_account[account] -= 1
+        if project is not None:
+            self._by_project[project] -= 1
+        self._changed.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limits': {'global': self.global_limit, 'account': self.account_limit, 'project': self.project_limit},
+            'started_by_account': dict(self._started),
+            'dispatch_lag_histogram': dict(self.lag_histogram),
+            'max_dispatch_lag_seconds': round(self.max_lag_seconds, 1),
+        }
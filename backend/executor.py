@@ -0,0 +1,195 @@
+"""
+Bounded multi-stage executor: download → transcode → upload.
+Each stage has its own concurrency cap and a queue in front of it, so a due
+batch keeps the network, the CPU and the upload bandwidth busy at the same time.
+An optional dispatcher (see dispatcher.py) decides which item enters the chain
+next and is told when each item leaves it.
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from deps import settings
+
+
+StageHandler = Callable[[Any], Awaitable[Any]]
+ErrorHandler = Callable[[Any, Exception, str], Awaitable[Any]]
+
+
+class Stage:
+    """A named pipeline stage with a concurrency limit."""
+
+    def __init__(self, name: str, handler: StageHandler, concurrency: int):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, int(concurrency))
+
+
+class StagedExecutor:
+    """
+    Runs items through a chain of stages. The output of one stage is the input
+    of the next; the output of the last stage is the item's result.
+    If a stage raises, the item leaves the chain and `on_error` produces its result.
+    """
+
+    def __init__(self, stages: List[Stage], on_error: ErrorHandler, report_interval: float = 30.0):
+        if not stages:
+            raise ValueError("StagedExecutor needs at least one stage")
+        self.stages = stages
+        self.on_error = on_error
+        self.report_interval = report_interval
+        self._queues: List[asyncio.Queue] = []
+        self._active: Dict[str, int] = {s.name: 0 for s in stages}
+        self._peak_queued: Dict[str, int] = {s.name: 0 for s in stages}
+        self._completed: Dict[str, int] = {s.name: 0 for s in stages}
+        self._errors: Dict[str, int] = {s.name: 0 for s in stages}
+        self._dispatcher = None
+
+    def queue_depths(self) -> Dict[str, Dict[str, int]]:
+        """Current per-stage depth: items waiting in the queue and items in flight."""
+        depths = {}
+        for index, stage in enumerate(self.stages):
+            queued = self._queues[index].qsize() if self._queues else 0
+            depths[stage.name] = {
+                'queued': queued,
+                'active': self._active[stage.name],
+                'limit': stage.concurrency,
+            }
+        return depths
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-stage counters for the last run."""
+        return {
+            stage.name: {
+                'limit': stage.concurrency,
+                'completed': self._completed[stage.name],
+                'errors': self._errors[stage.name],
+                'peak_queued': self._peak_queued[stage.name],
+            }
+            for stage in self.stages
+        }
+
+    def format_depths(self) -> str:
+        """One-line queue depth summary, e.g. 'download=3+2/4 transcode=0+1/8'."""
+        return ' '.join(
+            f"{name}={d['queued']}+{d['active']}/{d['limit']}"
+            for name, d in self.queue_depths().items()
+        )
+
+    async def _report_depths(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(f"[executor] Queue depth (queued+active/limit): {self.format_depths()}")
+
+    async def _put(self, index: int, entry: Any) -> None:
+        queue = self._queues[index]
+        await queue.put(entry)
+        name = self.stages[index].name
+        self._peak_queued[name] = max(self._peak_queued[name], queue.qsize())
+
+    async def _stage_worker(self, index: int, results: List[Any]) -> None:
+        stage = self.stages[index]
+        queue = self._queues[index]
+        is_last = index == len(self.stages) - 1
+        while True:
+            position, item = await queue.get()
+            self._active[stage.name] += 1
+            leaves_chain = True
+            try:
+                try:
+                    output = await stage.handler(item)
+                except Exception as exc:
+                    self._errors[stage.name] += 1
+                    results[position] = await self.on_error(item, exc, stage.name)
+                    continue
+                self._completed[stage.name] += 1
+                if is_last:
+                    results[position] = output
+                else:
+                    leaves_chain = False
+                    await self._put(index + 1, (position, output))
+            except Exception as exc:
+                # on_error itself failed; never let a worker die silently
+                print(f"[executor] Stage '{stage.name}' error handler failed: {exc}")
+            finally:
+                self._active[stage.name] -= 1
+                if leaves_chain and self._dispatcher is not None:
+                    self._dispatcher.release(position)
+                queue.task_done()
+
+    async def _feed(self, items: List[Any]) -> None:
+        """Put items into the first queue, in order or as the dispatcher admits them."""
+        if self._dispatcher is None:
+            for position, item in enumerate(items):
+                await self._put(0, (position, item))
+            return
+        self._dispatcher.add(list(enumerate(items)))
+        while True:
+            entry = await self._dispatcher.next()
+            if entry is None:
+                return
+            await self._put(0, entry)
+
+    async def run(self, items: List[Any], dispatcher: Optional[Any] = None) -> List[Any]:
+        """
+        Push all items through the stages and return their results in input order.
+        With a dispatcher, items enter the chain only when dispatcher.next() hands
+        them out, and dispatcher.release(position) is called once each is done.
+        """
+        results: List[Any] = [None] * len(items)
+        if not items:
+            return results
+
+        # The first queue holds the whole batch; the ones between stages are
+        # bounded so a fast stage cannot pile up work in front of a slow one.
+        self._queues = [asyncio.Queue()]
+        for stage in self.stages[1:]:
+            self._queues.append(asyncio.Queue(maxsize=stage.concurrency * 2))
+
+        workers = [
+            asyncio.create_task(self._stage_worker(index, results))
+            for index, stage in enumerate(self.stages)
+            for _ in range(stage.concurrency)
+        ]
+        reporter = asyncio.create_task(self._report_depths()) if self.report_interval else None
+        self._dispatcher = dispatcher
+        try:
+            await self._feed(items)
+            # Items only move forward, so joining the queues in order drains the chain
+            for queue in self._queues:
+                await queue.join()
+        finally:
+            if reporter:
+                workers.append(reporter)
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._dispatcher = None
+        return results
+
+
+def default_stage_limits() -> Dict[str, int]:
+    """Per-stage concurrency from settings (transcode defaults to the number of cores)."""
+    return {
+        'download': settings.pipeline_download_concurrency,
+        'transcode': settings.pipeline_transcode_concurrency or (os.cpu_count() or 1),
+        'upload': settings.pipeline_upload_concurrency,
+    }
+
+
+def build_executor(
+    download: StageHandler,
+    transcode: StageHandler,
+    upload: StageHandler,
+    on_error: ErrorHandler,
+    limits: Optional[Dict[str, int]] = None
+) -> StagedExecutor:
+    """Build the standard download → transcode → upload executor."""
+    limits = limits or default_stage_limits()
+    return StagedExecutor(
+        [
+            Stage('download', download, limits['download']),
+            Stage('transcode', transcode, limits['transcode']),
+            Stage('upload', upload, limits['upload']),
+        ],
+        on_error=on_error,
+    )
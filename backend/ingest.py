@@ -0,0 +1,114 @@
+"""
+Streaming ingestion of ZIP archives of user videos (/user-videos/upload-batch).
+MP4 members are decompressed chunk by chunk straight into storage uploads, a few
+at a time, without extracting them to temp files. Rows are then upserted in one
+statement and preview URLs signed in one request; media info is probed per video.
+Progress is reported per member through an optional callback.
+"""
+import asyncio
+import os
+import zipfile
+from typing import IO, Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from deps import settings
+import media
+import models
+import storage
+
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def video_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir() and info.filename.lower().endswith('.mp4')
+        and not os.path.basename(info.filename).startswith('._')  # macOS resource forks
+    ]
+
+
+async def member_chunks(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> AsyncIterator[bytes]:
+    """Decompress one member in storage_chunk_bytes pieces, off the event loop."""
+    with archive.open(info) as src:
+        while True:
+            chunk = await asyncio.to_thread(src.read, settings.storage_chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def _report(on_progress: Optional[ProgressCallback], event: Dict[str, Any]) -> None:
+    if on_progress:
+        try:
+            await on_progress(event)
+        except Exception as e:
+            print(f"Warning: ingest progress callback failed: {e}")
+
+
+async def ingest_zip(
+    fileobj: IO[bytes],
+    theme_slug: str = 'custom',
+    on_progress: Optional[ProgressCallback] = None
+) -> Dict[str, Any]:
+    """
+    Upload every MP4 in a seekable ZIP file object and register them as videos.
+    Returns {'items': [{video, preview_url}], 'members': [per-member status]}.
+    Members that fail to upload are reported and skipped.
+    """
+    archive = zipfile.ZipFile(fileobj)
+    infos = video_members(archive)
+    total = len(infos)
+    semaphore = asyncio.Semaphore(max(1, settings.ingest_concurrency))
+    members: List[Dict[str, Any]] = [
+        {'member': info.filename, 'index': i, 'total': total, 'bytes': info.file_size, 'status': 'pending'}
+        for i, info in enumerate(infos)
+    ]
+
+    async def upload_member(info: zipfile.ZipInfo, member: Dict[str, Any]) -> None:
+        async with semaphore:
+            object_path = storage.new_user_object_path()
+            try:
+                await storage.upload_stream(member_chunks(archive, info), object_path, size=info.file_size)
+                member.update(status='uploaded', storage_path=object_path)
+            except Exception as e:
+                member.update(status='failed', error=str(e)[:300])
+            await _report(on_progress, dict(member))
+
+    with archive:
+        await asyncio.gather(*(upload_member(info, member) for info, member in zip(infos, members)))
+
+    uploaded = [member for member in members if member['status'] == 'uploaded']
+    items = await register_user_objects(
+        [member['storage_path'] for member in uploaded],
+        [os.path.basename(member['member']) for member in uploaded],
+        theme_slug
+    )
+    for member, item in zip(uploaded, items):
+        member.update(status='registered', video_id=str(item['video']['id']))
+        await _report(on_progress, dict(member))
+    return {'items': items, 'members': members}
+
+
+async def register_user_objects(object_paths: List[str], titles: List[Optional[str]], theme_slug: str) -> List[Dict[str, Any]]:
+    """Register objects already in the user bucket as videos: one upsert, one signing request."""
+    if not object_paths:
+        return []
+    try:
+        await models.ensure_theme(theme_slug)
+    except Exception:
+        pass
+    source_ids = [f"user:{path}" for path in object_paths]
+    videos = await models.upsert_videos_bulk(source_ids, titles, theme_slug)
+    urls = await storage.create_signed_urls(object_paths, expires_in=3600)
+
+    # Probe once at ingest so the pipeline can plan without re-probing
+    semaphore = asyncio.Semaphore(max(1, settings.ingest_concurrency))
+
+    async def probe(video: Dict[str, Any]) -> None:
+        async with semaphore:
+            await media.ingest_media_info(video['id'], video['source_video_id'])
+
+    await asyncio.gather(*(probe(video) for video in videos))
+    return [
+        {'video': video, 'preview_url': urls.get(video['source_video_id'].split(':', 1)[1])}
+        for video in videos
+    ]
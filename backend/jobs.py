@@ -0,0 +1,165 @@
+"""
+Background jobs for long-running API operations (theme scans, the Roblox
+scheduler, ZIP batch ingestion). The API enqueues a row in background_jobs and
+returns its id right away; the worker claims rows (FOR UPDATE SKIP LOCKED) and
+runs them with a global and a per-kind concurrency limit. Status, progress and
+result are read back with GET /jobs/{id}.
+"""
+import asyncio
+import os
+import tempfile
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+from uuid import UUID
+from deps import settings, WORKER_ID
+import models
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+# kind -> {'handler', 'concurrency', 'max_attempts'}
+JOB_KINDS: Dict[str, Dict[str, Any]] = {}
+
+_current_job: ContextVar[Optional[UUID]] = ContextVar('background_job_id', default=None)
+
+
+def job_kind(kind: str, concurrency: int = 1, max_attempts: int = 3) -> Callable[[Handler], Handler]:
+    """Register a handler: payload dict in, JSON-serializable result dict out."""
+    def decorator(handler: Handler) -> Handler:
+        JOB_KINDS[kind] = {'handler': handler, 'concurrency': concurrency, 'max_attempts': max_attempts}
+        return handler
+    return decorator
+
+
+async def enqueue(kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return await models.enqueue_background_job(kind, payload, max_attempts=JOB_KINDS[kind]['max_attempts'])
+
+
+async def report_progress(**values: Any) -> None:
+    """Merge values into the running job's progress (no-op outside a job)."""
+    job_id = _current_job.get()
+    if job_id is None:
+        return
+    try:
+        await models.update_background_job_progress(job_id, values)
+    except Exception as e:
+        print(f"[job {job_id}] Warning: Could not record progress: {e}")
+
+
+@job_kind('theme_scan', concurrency=1)
+async def run_theme_scan(payload: Dict[str, Any]) -> Dict[str, Any]:
+    import video_feed
+    await report_progress(stage='scanning', theme=payload['theme_slug'])
+    return await video_feed.scan_theme_for_videos(
+        payload['theme_slug'],
+        payload['account_id'],
+        payload.get('search_query')
+    )
+
+
+@job_kind('roblox_scheduler', concurrency=1)
+async def run_roblox_scheduler(payload: Dict[str, Any]) -> Dict[str, Any]:
+    from roblox_scheduler import ensure_daily_roblox_video
+    now = datetime.now(timezone.utc)
+    await ensure_daily_roblox_video(now)
+    return {'timestamp': now.isoformat()}
+
+
+# Re-running a half-ingested archive would duplicate videos, so no retries
+@job_kind('zip_ingest', concurrency=2, max_attempts=1)
+async def run_zip_ingest(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Fetch the staged archive from storage to a temp file and ingest it."""
+    import ingest
+    import storage
+
+    staged = payload['object_path']
+    fd, local_path = tempfile.mkstemp(suffix='.zip', dir=settings.temp_dir)
+    os.close(fd)
+    done = 0
+
+    async def on_progress(event: Dict[str, Any]) -> None:
+        nonlocal done
+        if event['status'] in ('registered', 'failed'):
+            done += 1
+        await report_progress(total=event['total'], done=done, last_member=event['member'], last_status=event['status'])
+
+    try:
+        await report_progress(stage='downloading')
+        await storage.download_to_file(staged, local_path)
+        await report_progress(stage='ingesting')
+        with open(local_path, 'rb') as f:
+            result = await ingest.ingest_zip(f, theme_slug=payload.get('theme_slug') or 'custom', on_progress=on_progress)
+    finally:
+        try:
+            os.remove(local_path)
+        except FileNotFoundError:
+            pass
+    try:
+        await storage.delete_object(staged)
+    except Exception as e:
+        print(f"Warning: Could not delete staged archive {staged}: {e}")
+    return {'items': result['items'], 'count': len(result['items']), 'members': result['members'], 'archive': payload.get('filename')}
+
+
+class JobRunner:
+    """Worker-side loop: claim jobs while there are free slots, heartbeat the running ones."""
+
+    def __init__(self):
+        self.tasks: Dict[UUID, asyncio.Task] = {}
+        self.kinds: Dict[UUID, str] = {}
+
+    def _running(self, kind: str) -> int:
+        return sum(1 for running in self.kinds.values() if running == kind)
+
+    async def claim(self) -> None:
+        stale_after = timedelta(seconds=settings.jobs_stale_seconds)
+        for kind, spec in JOB_KINDS.items():
+            free = min(settings.jobs_concurrency - len(self.tasks), spec['concurrency'] - self._running(kind))
+            if free <= 0:
+                continue
+            for job in await models.claim_background_jobs([kind], free, WORKER_ID, stale_after):
+                self.kinds[job['id']] = kind
+                self.tasks[job['id']] = asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        job_id = job['id']
+        token = _current_job.set(job_id)
+        print(f"[job {job_id}] Starting {job['kind']} (attempt {job['attempts']}/{job['max_attempts']})")
+        try:
+            result = await JOB_KINDS[job['kind']]['handler'](job['payload'])
+            await models.finish_background_job(job_id, 'succeeded', result=result)
+            print(f"[job {job_id}] {job['kind']} succeeded")
+        except asyncio.CancelledError:
+            # Worker shutting down: the stale heartbeat lets another worker take it over
+            raise
+        except Exception as e:
+            print(f"[job {job_id}] {job['kind']} failed: {e}")
+            try:
+                await models.finish_background_job(job_id, 'failed', error=str(e)[:1000])
+            except Exception as db_error:
+                print(f"[job {job_id}] Warning: Could not record failure: {db_error}")
+        finally:
+            _current_job.reset(token)
+            self.tasks.pop(job_id, None)
+            self.kinds.pop(job_id, None)
+
+    async def run(self, should_run: Callable[[], bool]) -> None:
+        last_heartbeat = 0.0
+        loop = asyncio.get_running_loop()
+        while should_run():
+            try:
+                await self.claim()
+                if self.tasks and loop.time() - last_heartbeat >= settings.jobs_heartbeat_seconds:
+                    await models.heartbeat_background_jobs(list(self.tasks), WORKER_ID)
+                    last_heartbeat = loop.time()
+            except Exception as e:
+                print(f"Background job runner error: {e}")
+            await asyncio.sleep(settings.jobs_poll_seconds)
+
+    async def stop(self) -> None:
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
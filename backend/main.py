@@ -6,12 +6,17 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from uuid import UUID
 import models
 import youtube_oauth
 import video_feed
 import quotas
+import media
+import jobs
+import ingest
+import dispatcher
+import storage
 from deps import get_db_pool, close_db_pool, settings
 
 
@@ -43,6 +48,7 @@ async def startup():
 async def shutdown():
     """Close database connection pool on shutdown."""
     await close_db_pool()
+    await storage.close_client()
     print("Database connection pool closed")
 
 
@@ -89,6 +95,16 @@ class UpdateAccountStatusRequest(BaseModel):
     active: bool
 
 
+class EncodeProfileRequest(BaseModel):
+    profile: Optional[str] = None  # None = inherit (account -> theme -> ENCODE_PROFILE)
+
+
+class UserVideoCompleteRequest(BaseModel):
+    storage_path: str
+    title: Optional[str] = None
+    theme_slug: Optional[str] = None
+
+
 class UpdateUploadRequest(BaseModel):
     scheduled_for: Optional[datetime] = None
     title: Optional[str] = None
@@ -199,6 +215,14 @@ async def update_account_status(account_id: str, request: UpdateAccountStatusReq
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.patch("/accounts/{account_id}/encode-profile")
+async def update_account_encode_profile(account_id: str, request: EncodeProfileRequest):
+    """Set or clear the encoder profile used for an account's uploads."""
+    _validate_encode_profile(request.profile)
+    await models.set_account_encode_profile(UUID(account_id), request.profile)
+    return {"success": True, "profile": request.profile}
+
+
 @app.post("/accounts/{account_id}/reauthorize")
 async def reauthorize_account(account_id: str):
     """Start OAuth flow again for an existing account."""
@@ -228,19 +252,45 @@ async def list_themes():
     return {"themes": themes}
 
 
-@app.post("/themes/scan")
+@app.patch("/themes/{slug}/encode-profile")
+async def update_theme_encode_profile(slug: str, request: EncodeProfileRequest):
+    """Set or clear the encoder profile for all accounts of a theme."""
+    _validate_encode_profile(request.profile)
+    await models.set_theme_encode_profile(slug, request.profile)
+    return {"success": True, "profile": request.profile}
+
+
+@app.get("/encode-profiles")
+async def list_encode_profiles():
+    """Available encoder profiles and the global default."""
+    return {
+        "profiles": media.ENCODE_PROFILES,
+        "default": media.resolve_encode_profile(),
+    }
+
+
+def _validate_encode_profile(profile: Optional[str]) -> None:
+    if profile is not None and profile not in media.ENCODE_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown encode profile '{profile}'. Choose one of: {', '.join(media.ENCODE_PROFILES)}"
+        )
+
+
+@app.post("/themes/scan", status_code=202)
 async def scan_theme(request: ScanThemeRequest):
     """
     Scan YouTube for videos matching a theme.
-    Discovers channels and fetches recent Shorts.
+    Discovers channels and fetches recent Shorts. Runs on the worker as a
+    background job; poll GET /jobs/{job_id} for the summary.
     """
     try:
-        result = await video_feed.scan_theme_for_videos(
-            request.theme_slug,
-            request.account_id,
-            request.search_query
-        )
-        return result
+        job = await jobs.enqueue('theme_scan', {
+            'theme_slug': request.theme_slug,
+            'account_id': request.account_id,
+            'search_query': request.search_query,
+        })
+        return {"job_id": job['id'], "status": job['status']}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -262,6 +312,12 @@ async def list_videos(
     }
 
 
+async def _register_user_video(storage_path: str, title: Optional[str], theme_slug: Optional[str] = None) -> dict:
+    """Create the video row for an object already in the user bucket; returns {video, preview_url}."""
+    items = await ingest.register_user_objects([storage_path], [title], theme_slug or 'custom')
+    return items[0]
+
+
 @app.post("/user-videos/upload")
 async def upload_user_video(
     theme_slug: Optional[str] = Form(None),
@@ -270,148 +326,92 @@ async def upload_user_video(
 ):
     """Upload a user-provided video to Supabase Storage and register it as a video."""
     try:
-        import httpx
-        import uuid as _uuid
-
-        if not settings.supabase_url or not settings.supabase_service_role:
+        if not storage.storage_configured():
             raise HTTPException(status_code=500, detail="Supabase not configured")
 
-        ext = ".mp4"
-        storage_id = _uuid.uuid4().hex
-        storage_path = f"user/{storage_id}{ext}"
-
-        storage_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/{settings.supabase_bucket}/{storage_path}"
-        headers = {
-            "Authorization": f"Bearer {settings.supabase_service_role}",
-            "apikey": settings.supabase_service_role,
-            "Content-Type": file.content_type or "video/mp4",
-        }
-        data = await file.read()
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(storage_url, headers=headers, content=data)
-            if resp.status_code not in (200, 201):
-                raise HTTPException(status_code=500, detail=f"Storage upload failed: {resp.status_code} {resp.text}")
-
-        # Ensure theme exists (default to 'custom')
-        use_theme = theme_slug or 'custom'
-        try:
-            from deps import get_db
-            async with get_db() as conn:
-                await conn.execute(
-                    """
-                    INSERT INTO themes (slug, title)
-                    VALUES ($1, $2)
-                    ON CONFLICT (slug) DO NOTHING
-                    """,
-                    use_theme, use_theme.capitalize()
-                )
-        except Exception:
-            pass
-
-        source_id = f"user:{storage_path}"
-        video = await models.upsert_video(
-            source_video_id=source_id,
-            title=title or file.filename,
-            channel_title=None,
-            thumbnail_url=None,
-            views=None,
-            duration_seconds=None,
-            theme_slug=use_theme
-        )
-        # Signed preview URL
-        preview_url = None
+        storage_path = storage.new_user_object_path()
+        # Streamed from the spooled upload in chunks, never held in memory whole
         try:
-            import json
-            import httpx
-            sign_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/sign/{settings.supabase_bucket}/{storage_path}"
-            headers = {
-                "Authorization": f"Bearer {settings.supabase_service_role}",
-                "apikey": settings.supabase_service_role,
-                "Content-Type": "application/json",
-            }
-            body = {"expiresIn": 3600}
-            async with httpx.AsyncClient(timeout=15) as client:
-                s = await client.post(sign_url, headers=headers, content=json.dumps(body))
-                if s.status_code in (200, 201):
-                    data = s.json()
-                    if isinstance(data, dict) and 'signedURL' in data:
-                        preview_url = f"{settings.supabase_url.rstrip('/')}{data['signedURL']}"
-        except Exception:
-            preview_url = None
-
-        return {"video": video, "preview_url": preview_url}
+            await storage.upload_stream(
+                storage.reader_chunks(file.read),
+                storage_path,
+                content_type=file.content_type or "video/mp4",
+                size=getattr(file, 'size', None)
+            )
+        except storage.StorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        return await _register_user_video(storage_path, title or file.filename, theme_slug)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/user-videos/upload-url")
+async def create_user_video_upload_url():
+    """
+    Direct upload, step 1: a signed URL the client PUTs the video to, so the file
+    never passes through the API. Then call /user-videos/upload-complete.
+    """
+    if not storage.storage_configured():
+        raise HTTPException(status_code=500, detail="Supabase not configured")
+    storage_path = storage.new_user_object_path()
+    try:
+        signed = await storage.create_signed_upload_url(storage_path)
+    except storage.StorageError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return {
+        "storage_path": storage_path,
+        "upload_url": signed['url'],
+        "token": signed['token'],
+        "method": "PUT",
+    }
+
+
+@app.post("/user-videos/upload-complete")
+async def complete_user_video_upload(request: UserVideoCompleteRequest):
+    """Direct upload, step 2: register the uploaded object as a video (idempotent)."""
+    if not storage.USER_OBJECT_PATH_RE.match(request.storage_path):
+        raise HTTPException(status_code=400, detail="Invalid storage_path")
+    try:
+        size = await storage.object_size(request.storage_path)
+    except storage.StorageError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if not size:
+        raise HTTPException(status_code=409, detail="Upload not found in storage yet")
+    try:
+        return await _register_user_video(request.storage_path, request.title, request.theme_slug)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/user-videos/upload-batch")
 async def upload_user_videos_batch(files: List[UploadFile] = File(...)):
-    """Upload multiple videos (MP4 or ZIP of MP4s). Returns list of {video, preview_url}."""
+    """
+    Upload multiple videos (MP4 or ZIP of MP4s). MP4s are stored and returned as
+    {video, preview_url} items; each ZIP is staged in storage and ingested by a
+    background job (see `jobs`), whose result holds its items.
+    """
     results = []
+    queued = []
     try:
-        import tempfile, zipfile, os as _os
         for f in files:
             if f.filename.lower().endswith('.zip'):
-                # Extract zip to temp and upload contained mp4s
-                data = await f.read()
-                with tempfile.TemporaryDirectory() as td:
-                    zpath = _os.path.join(td, 'in.zip')
-                    with open(zpath, 'wb') as zf:
-                        zf.write(data)
-                    with zipfile.ZipFile(zpath, 'r') as z:
-                        for name in z.namelist():
-                            if not name.lower().endswith('.mp4'):
-                                continue
-                            with z.open(name) as src:
-                                tmp = _os.path.join(td, _os.path.basename(name))
-                                with open(tmp, 'wb') as out:
-                                    out.write(src.read())
-                                # Re-upload via single endpoint logic
-                                with open(tmp, 'rb') as file_obj:
-                                    upf = UploadFile(filename=_os.path.basename(name), file=file_obj)
-                                    # call internal function path (reuse logic):
-                                    # FastAPI internal call not trivial; replicate minimal upload
-                                    import httpx, uuid as _uuid
-                                    storage_id = _uuid.uuid4().hex
-                                    storage_path = f"user/{storage_id}.mp4"
-                                    storage_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/{settings.supabase_bucket}/{storage_path}"
-                                    headers = {"Authorization": f"Bearer {settings.supabase_service_role}", "apikey": settings.supabase_service_role, "Content-Type": "video/mp4"}
-                                    with httpx.Client(timeout=60) as client:
-                                        r = client.post(storage_url, headers=headers, content=open(tmp, 'rb').read())
-                                        if r.status_code not in (200,201):
-                                            continue
-                                    # create video row
-                                    v = await models.upsert_video(
-                                        source_video_id=f"user:{storage_path}",
-                                        title=_os.path.basename(name),
-                                        channel_title=None,
-                                        thumbnail_url=None,
-                                        views=None,
-                                        duration_seconds=None,
-                                        theme_slug='custom'
-                                    )
-                                    # sign
-                                    preview_url = None
-                                    try:
-                                        import json
-                                        sign_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/sign/{settings.supabase_bucket}/{storage_path}"
-                                        headers2 = {"Authorization": f"Bearer {settings.supabase_service_role}", "apikey": settings.supabase_service_role, "Content-Type": "application/json"}
-                                        with httpx.Client(timeout=15) as client:
-                                            s = client.post(sign_url, headers=headers2, content=json.dumps({"expiresIn":3600}))
-                                            if s.status_code in (200,201):
-                                                data = s.json()
-                                                if isinstance(data, dict) and 'signedURL' in data:
-                                                    preview_url = f"{settings.supabase_url.rstrip('/')}{data['signedURL']}"
-                                    except Exception:
-                                        pass
-                                    results.append({"video": v, "preview_url": preview_url})
+                staged = storage.new_ingest_object_path()
+                await storage.upload_stream(
+                    storage.reader_chunks(f.read),
+                    staged,
+                    content_type="application/zip",
+                    size=getattr(f, 'size', None)
+                )
+                job = await jobs.enqueue('zip_ingest', {'object_path': staged, 'filename': f.filename})
+                queued.append({"job_id": job['id'], "archive": f.filename, "status": job['status']})
             else:
                 # Single file
                 res = await upload_user_video(theme_slug=None, title=None, file=f)  # type: ignore
                 results.append(res)
-        return {"items": results, "count": len(results)}
+        return {"items": results, "count": len(results), "jobs": queued}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -453,10 +453,9 @@ async def schedule_user_bulk(request: BulkUserScheduleRequest):
         slot_index = 0
         for item in request.items:
             schedule_date = (request.start_datetime.date())
-            from datetime import timedelta, datetime as _dt
             schedule_date = request.start_datetime.date() + timedelta(days=day_index)
             t = times[min(slot_index, len(times)-1)]
-            scheduled_for = _dt.combine(schedule_date, t)
+            scheduled_for = datetime.combine(schedule_date, t)
             # Advance slot/day
             slot_index += 1
             if slot_index >= len(times):
@@ -584,7 +583,7 @@ async def get_dashboard_metrics():
         uploads_today = [u for u in all_uploads if u['created_at'].date() == today]
         done_count = len([u for u in uploads_today if u['status'] == 'done'])
         failed_count = len([u for u in all_uploads if u['status'] == 'failed'])
-        scheduled_count = len([u for u in all_uploads if u['status'] == 'scheduled'])
+        scheduled_count = len([u for u in all_uploads if u['status'] in ('scheduled', 'prepared')])
         
         # Get account stats
         accounts = await models.list_accounts()
@@ -603,6 +602,60 @@ async def get_dashboard_metrics():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/metrics/pipeline")
+async def get_pipeline_metrics(hours: int = Query(24, ge=1, le=24 * 30)):
+    """
+    Per-stage latency of the upload pipeline over the last `hours`:
+    p50/p95 wall and CPU time per stage, and the same broken down by
+    source platform and by account, to see which stage is the bottleneck.
+    """
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    rows = await models.get_pipeline_latency(since)
+    result = {"since": since.isoformat(), "stages": [], "by_platform": [], "by_account": []}
+    sections = {"stage": "stages", "platform": "by_platform", "account": "by_account"}
+    for row in rows:
+        grouping = row.pop("grouping")
+        if grouping != "platform":
+            row.pop("source_platform")
+        if grouping != "account":
+            row.pop("account_id")
+        result[sections[grouping]].append(row)
+    return result
+
+
+@app.get("/metrics/leases")
+async def get_lease_metrics(hours: int = Query(24, ge=1, le=24 * 30)):
+    """
+    Uploads reclaimed from dead workers (expired lease -> retry) over the last
+    `hours`, and how many uploads are leased right now / already past their lease.
+    """
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    counts = await models.count_reclaimed_uploads(since)
+    return {"since": since.isoformat(), **counts}
+
+
+@app.get("/metrics/dispatch-lag")
+async def get_dispatch_lag_metrics(hours: int = Query(24, ge=1, le=24 * 30)):
+    """
+    How late uploads started relative to scheduled_for over the last `hours`,
+    as a histogram (the same buckets the worker logs per batch) with p50/p95/max.
+    """
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    data = await models.get_dispatch_lag_histogram(since, [float(bound) for bound in dispatcher.LAG_BUCKETS])
+    histogram = {
+        label: data['buckets'].get(index, 0)
+        for index, label in enumerate(dispatcher.lag_labels())
+    }
+    return {
+        "since": since.isoformat(),
+        "runs": data['runs'],
+        "histogram": histogram,
+        "p50_seconds": data['p50'],
+        "p95_seconds": data['p95'],
+        "max_seconds": data['max'],
+    }
+
+
 # Quota endpoints
 @app.get("/quota/status")
 async def get_quota_status():
@@ -612,26 +665,34 @@ async def get_quota_status():
 
 
 # Roblox automation endpoints
-@app.post("/roblox/trigger-scheduler")
+@app.post("/roblox/trigger-scheduler", status_code=202)
 async def trigger_roblox_scheduler():
-    """Manually trigger the Roblox video scheduler to check for accounts and create projects."""
+    """Queue a run of the Roblox video scheduler (check accounts and create projects) on the worker."""
     try:
-        from roblox_scheduler import ensure_daily_roblox_video
-        from datetime import datetime
-        now = datetime.utcnow()
-        await ensure_daily_roblox_video(now)
-        return {
-            "success": True,
-            "message": "Roblox scheduler executed successfully",
-            "timestamp": now.isoformat()
-        }
+        job = await jobs.enqueue('roblox_scheduler', {})
+        return {"success": True, "job_id": job['id'], "status": job['status']}
     except Exception as e:
-        import traceback
-        return {
-            "success": False,
-            "error": str(e),
-            "traceback": traceback.format_exc()
-        }
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Background jobs
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: UUID):
+    """Status, progress and (once finished) result of a background job."""
+    job = await models.get_background_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs")
+async def list_jobs(
+    kind: Optional[str] = Query(None),
+    status: Optional[str] = Query(None, description="queued, running, succeeded or failed"),
+    limit: int = Query(50, ge=1, le=200)
+):
+    items = await models.list_background_jobs(kind, status, limit)
+    return {"jobs": items, "count": len(items)}
 
 
 if __name__ == "__main__":
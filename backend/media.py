@@ -0,0 +1,366 @@
+"""
+Media helpers: async subprocess runner, ffprobe and the Shorts transform planner.
+"""
+import asyncio
+import json
+import os
+import subprocess
+from typing import Dict, Any, Optional, Tuple
+from uuid import UUID
+from deps import settings
+import models
+import storage
+
+
+# YouTube Shorts target format
+SHORTS_WIDTH = 1080
+SHORTS_HEIGHT = 1920
+SHORTS_MAX_SECONDS = 60
+SHORTS_VIDEO_CODECS = ('h264',)
+SHORTS_AUDIO_CODECS = ('aac',)
+SHORTS_PIX_FMTS = ('yuv420p', 'yuvj420p')
+
+# Named libx264/AAC settings for the full re-encode, selectable per account or theme
+# ('balanced' is the historical default). Compare them with benchmark_encoders.py.
+ENCODE_PROFILES = {
+    'fast': {
+        'video_codec': 'libx264',
+        'preset': 'veryfast',
+        'crf': 24,
+        'audio_codec': 'aac',
+        'audio_bitrate': '128k',
+    },
+    'balanced': {
+        'video_codec': 'libx264',
+        'preset': 'medium',
+        'crf': 23,
+        'audio_codec': 'aac',
+        'audio_bitrate': '128k',
+    },
+    'small': {
+        'video_codec': 'libx264',
+        'preset': 'slow',
+        'crf': 27,
+        'audio_codec': 'aac',
+        'audio_bitrate': '96k',
+    },
+}
+
+
+def resolve_encode_profile(name: Optional[str] = None) -> str:
+    """Requested profile if known, else the configured default, else 'balanced'."""
+    for candidate in (name, settings.encode_profile):
+        if candidate in ENCODE_PROFILES:
+            return candidate
+    return 'balanced'
+
+
+async def run_command(cmd: list, timeout: float) -> subprocess.CompletedProcess:
+    """
+    Run an external command without blocking the event loop.
+    Raises subprocess.TimeoutExpired on timeout; the child is killed on timeout
+    and on cancellation so no orphan yt-dlp/ffmpeg processes are left behind.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if isinstance(exc, asyncio.TimeoutError):
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        raise
+    return subprocess.CompletedProcess(
+        cmd,
+        proc.returncode,
+        stdout.decode('utf-8', errors='replace'),
+        stderr.decode('utf-8', errors='replace'),
+    )
+
+
+async def run_piped(
+    producer_cmd: list,
+    consumer_cmd: list,
+    timeout: float
+) -> Tuple[subprocess.CompletedProcess, subprocess.CompletedProcess]:
+    """
+    Run `producer | consumer` without a shell, e.g. yt-dlp into ffmpeg.
+    Both processes are killed on timeout or cancellation.
+    Returns (producer, consumer) results with their stderr.
+    """
+    read_fd, write_fd = os.pipe()
+    try:
+        producer = await asyncio.create_subprocess_exec(
+            *producer_cmd,
+            stdout=write_fd,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            consumer = await asyncio.create_subprocess_exec(
+                *consumer_cmd,
+                stdin=read_fd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except BaseException:
+            producer.kill()
+            await producer.wait()
+            raise
+    finally:
+        # The children hold their own copies; closing ours lets EOF/EPIPE propagate
+        os.close(read_fd)
+        os.close(write_fd)
+
+    try:
+        (_, producer_err), (_, consumer_err) = await asyncio.wait_for(
+            asyncio.gather(producer.communicate(), consumer.communicate()),
+            timeout=timeout,
+        )
+    except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+        for proc in (producer, consumer):
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+        if isinstance(exc, asyncio.TimeoutError):
+            raise subprocess.TimeoutExpired(consumer_cmd, timeout)
+        raise
+    return (
+        subprocess.CompletedProcess(producer_cmd, producer.returncode, None, producer_err.decode('utf-8', errors='replace')),
+        subprocess.CompletedProcess(consumer_cmd, consumer.returncode, None, consumer_err.decode('utf-8', errors='replace')),
+    )
+
+
+def ffprobe_bin() -> str:
+    """ffprobe lives next to ffmpeg."""
+    return settings.ffmpeg_bin.replace('ffmpeg', 'ffprobe')
+
+
+async def ffprobe_json(target: str, headers: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Run ffprobe on a local path or an HTTP(S) URL and return the full JSON.
+    Returns None if ffprobe is missing or cannot read the input.
+    """
+    cmd = [ffprobe_bin(), '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format']
+    if headers:
+        cmd += ['-headers', ''.join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    cmd += [target]
+    try:
+        result = await run_command(cmd, timeout=30)
+    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        print(f"Warning: ffprobe unavailable: {e}")
+        return None
+    if result.returncode != 0:
+        print(f"Warning: Could not probe video (exit {result.returncode}): {result.stderr[:200]}")
+        return None
+    try:
+        return json.loads(result.stdout or '{}')
+    except ValueError as e:
+        print(f"Warning: Could not parse ffprobe output: {e}")
+        return None
+
+
+async def probe_media(path: str) -> Optional[Dict[str, Any]]:
+    """Probe a file and return the summarized stream info (None on failure)."""
+    raw = await ffprobe_json(path)
+    return summarize_probe(raw) if raw is not None else None
+
+
+def _parse_rate(value: Optional[str]) -> Optional[float]:
+    """Parse an ffprobe rational like '30000/1001'."""
+    if not value:
+        return None
+    try:
+        if '/' in value:
+            num, den = value.split('/', 1)
+            return round(float(num) / float(den), 3) if float(den) else None
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, '', 'N/A') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value: Any) -> Optional[int]:
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+
+def _rotation(stream: Dict[str, Any]) -> int:
+    """Display rotation in degrees (tags.rotate or displaymatrix side data)."""
+    rotate = (stream.get('tags') or {}).get('rotate')
+    if rotate is None:
+        for side_data in stream.get('side_data_list') or []:
+            if 'rotation' in side_data:
+                rotate = side_data['rotation']
+                break
+    return abs(_to_int(rotate) or 0) % 360
+
+
+def summarize_probe(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Reduce full ffprobe JSON to the fields the pipeline plans with."""
+    streams = raw.get('streams') or []
+    fmt = raw.get('format') or {}
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None) or {}
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None) or {}
+
+    duration = _to_float(fmt.get('duration')) or _to_float(video.get('duration'))
+    return {
+        'format_name': fmt.get('format_name'),
+        'duration': duration,
+        'size_bytes': _to_int(fmt.get('size')),
+        'bit_rate': _to_int(fmt.get('bit_rate')),
+        'video_codec': video.get('codec_name'),
+        'width': _to_int(video.get('width')),
+        'height': _to_int(video.get('height')),
+        'pix_fmt': video.get('pix_fmt'),
+        'fps': _parse_rate(video.get('avg_frame_rate')) or _parse_rate(video.get('r_frame_rate')),
+        'video_bit_rate': _to_int(video.get('bit_rate')),
+        'rotation': _rotation(video) if video else 0,
+        'has_audio': bool(audio),
+        'audio_codec': audio.get('codec_name'),
+        'audio_bit_rate': _to_int(audio.get('bit_rate')),
+        'audio_channels': _to_int(audio.get('channels')),
+        'audio_sample_rate': _to_int(audio.get('sample_rate')),
+    }
+
+
+def plan_transform(info: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Decide how to turn a source into a Short.
+    - 'copy':  no usable probe info, use the file as-is (legacy behaviour)
+    - 'remux': already 1080x1920 H.264/AAC ≤60s, stream-copy + faststart only
+    - 'encode': anything else, full scale/pad/trim re-encode
+    Returns {'mode': ..., 'reason': ...}.
+    """
+    if not info or not info.get('width') or not info.get('height'):
+        return {'mode': 'copy', 'reason': 'no video stream info'}
+
+    reasons = []
+    if info.get('video_codec') not in SHORTS_VIDEO_CODECS:
+        reasons.append(f"video codec {info.get('video_codec')}")
+    if (info['width'], info['height']) != (SHORTS_WIDTH, SHORTS_HEIGHT):
+        reasons.append(f"resolution {info['width']}x{info['height']}")
+    if info.get('rotation'):
+        reasons.append(f"rotation {info['rotation']}")
+    if info.get('pix_fmt') and info['pix_fmt'] not in SHORTS_PIX_FMTS:
+        reasons.append(f"pixel format {info['pix_fmt']}")
+    duration = info.get('duration')
+    if duration is None or duration > SHORTS_MAX_SECONDS:
+        reasons.append(f"duration {duration}")
+    if info.get('has_audio') and info.get('audio_codec') not in SHORTS_AUDIO_CODECS:
+        reasons.append(f"audio codec {info.get('audio_codec')}")
+
+    if reasons:
+        return {'mode': 'encode', 'reason': ', '.join(reasons)}
+    return {'mode': 'remux', 'reason': 'source already matches Shorts format'}
+
+
+async def keyframe_times(path: str, until: float) -> list:
+    """Timestamps (seconds) of the video keyframes in the first `until` seconds."""
+    cmd = [
+        ffprobe_bin(), '-v', 'error',
+        '-select_streams', 'v:0',
+        '-skip_frame', 'nokey',
+        '-read_intervals', f'%+{until}',
+        '-show_entries', 'frame=pts_time',
+        '-of', 'csv=p=0',
+        path,
+    ]
+    try:
+        result = await run_command(cmd, timeout=60)
+    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        print(f"Warning: Could not read keyframes: {e}")
+        return []
+    if result.returncode != 0:
+        return []
+    times = sorted({t for t in (_to_float(line.strip().rstrip(',')) for line in result.stdout.splitlines()) if t is not None})
+    return [t for t in times if t < until]
+
+
+def plan_segments(keyframes: list, duration: float, count: int, min_seconds: float) -> list:
+    """
+    Split [0, duration) into up to `count` (start, end) ranges cut at keyframes,
+    each at least `min_seconds` long. Returns [(0, duration)] if no useful cut exists.
+    """
+    cuts = [0.0]
+    for index in range(1, count):
+        target = duration * index / count
+        # First keyframe at or after the even split point
+        candidate = next((k for k in keyframes if k >= target), None)
+        if candidate is None:
+            break
+        if candidate - cuts[-1] >= min_seconds and duration - candidate >= min_seconds:
+            cuts.append(candidate)
+    cuts.append(duration)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def media_info_matches_file(info: Optional[Dict[str, Any]], path: str) -> bool:
+    """
+    Stored info is only trusted for a file of the same byte size; a different
+    size means a different rendition was downloaded and must be probed again.
+    """
+    if not info or not info.get('size_bytes'):
+        return False
+    try:
+        return os.path.getsize(path) == info['size_bytes']
+    except OSError:
+        return False
+
+
+def parse_storage_ref(source_video_id: str) -> Optional[Tuple[str, str]]:
+    """
+    Resolve 'user:<path>' / 'supabase:<bucket>/<path>' source ids to (bucket, object_path).
+    Returns None for YouTube video ids.
+    """
+    if not source_video_id.startswith(('user:', 'supabase:')):
+        return None
+    storage_ref = source_video_id.split(':', 1)[1]
+    if source_video_id.startswith('supabase:'):
+        if '/' not in storage_ref:
+            raise ValueError("Supabase reference must include bucket and object path.")
+        bucket, object_path = storage_ref.split('/', 1)
+        return bucket, object_path
+    return settings.supabase_bucket, storage_ref
+
+
+async def probe_and_store(
+    video_id: UUID,
+    target: str,
+    headers: Optional[Dict[str, str]] = None
+) -> Optional[Dict[str, Any]]:
+    """Probe a path/URL once and persist the result in video_media_info."""
+    raw = await ffprobe_json(target, headers=headers)
+    if raw is None:
+        return None
+    info = summarize_probe(raw)
+    await models.save_video_media_info(video_id, info, raw)
+    return info
+
+
+async def ingest_media_info(video_id: UUID, source_video_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Probe a storage-backed source right after it enters the system.
+    ffprobe reads the object over HTTP (range requests), so nothing is downloaded
+    in full. YouTube sources are probed after their first download instead.
+    Best-effort: returns None instead of raising.
+    """
+    try:
+        ref = parse_storage_ref(source_video_id)
+        if not ref or not settings.supabase_url:
+            return None
+        bucket, object_path = ref
+        return await probe_and_store(video_id, storage.object_url(object_path, bucket), headers=storage.auth_headers())
+    except Exception as e:
+        print(f"Warning: media info ingest failed for {source_video_id}: {e}")
+        return None
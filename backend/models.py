@@ -4,10 +4,22 @@ Database models and queries using asyncpg.
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 from uuid import UUID
+import json
 import asyncpg
 from deps import get_db, encrypt_field, decrypt_field
 
 _ACCOUNT_RECONNECT_COLUMNS_READY = False
+_VIDEO_MEDIA_INFO_READY = False
+_RATE_LIMIT_TABLE_READY = False
+_UPLOAD_SESSIONS_READY = False
+_PIPELINE_RUNS_READY = False
+_UPLOAD_PREPARE_COLUMNS_READY = False
+_ENCODE_PROFILE_COLUMNS_READY = False
+_BACKGROUND_JOBS_READY = False
+_UPLOADS_NOTIFY_READY = False
+_UPLOAD_LEASE_COLUMNS_READY = False
+_UPLOAD_RETRY_COLUMN_READY = False
+_TRANSFORM_CLAIMS_READY = False
 
 
 async def _ensure_account_reconnect_columns() -> None:
@@ -28,6 +40,200 @@ async def _ensure_account_reconnect_columns() -> None:
     _ACCOUNT_RECONNECT_COLUMNS_READY = True
 
 
+async def _ensure_video_media_info_table() -> None:
+    """Best-effort creation of the ffprobe metadata table for older DBs."""
+    global _VIDEO_MEDIA_INFO_READY
+    if _VIDEO_MEDIA_INFO_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS video_media_info (
+              video_id UUID PRIMARY KEY REFERENCES videos(id) ON DELETE CASCADE,
+              format_name TEXT,
+              duration DOUBLE PRECISION,
+              size_bytes BIGINT,
+              bit_rate BIGINT,
+              video_codec TEXT,
+              width INT,
+              height INT,
+              pix_fmt TEXT,
+              fps DOUBLE PRECISION,
+              video_bit_rate BIGINT,
+              rotation INT NOT NULL DEFAULT 0,
+              has_audio BOOLEAN NOT NULL DEFAULT false,
+              audio_codec TEXT,
+              audio_bit_rate BIGINT,
+              audio_channels INT,
+              audio_sample_rate INT,
+              probe JSONB NOT NULL DEFAULT '{}'::jsonb,
+              probed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+    _VIDEO_MEDIA_INFO_READY = True
+
+
+async def _ensure_rate_limit_table() -> None:
+    """Best-effort creation of the shared token-bucket table for older DBs."""
+    global _RATE_LIMIT_TABLE_READY
+    if _RATE_LIMIT_TABLE_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+              name TEXT PRIMARY KEY,
+              tokens DOUBLE PRECISION NOT NULL,
+              capacity DOUBLE PRECISION NOT NULL,
+              refill_per_second DOUBLE PRECISION NOT NULL,
+              penalty_until TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+    _RATE_LIMIT_TABLE_READY = True
+
+
+async def _ensure_upload_sessions_table() -> None:
+    """Best-effort creation of the resumable upload session table for older DBs."""
+    global _UPLOAD_SESSIONS_READY
+    if _UPLOAD_SESSIONS_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+              upload_id UUID PRIMARY KEY REFERENCES uploads(id) ON DELETE CASCADE,
+              session_uri TEXT NOT NULL,
+              offset_bytes BIGINT NOT NULL DEFAULT 0,
+              total_bytes BIGINT NOT NULL,
+              content_sha256 TEXT NOT NULL,
+              chunk_size INT,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+    _UPLOAD_SESSIONS_READY = True
+
+
+async def _ensure_pipeline_runs_table() -> None:
+    """Best-effort creation of the per-stage telemetry table for older DBs."""
+    global _PIPELINE_RUNS_READY
+    if _PIPELINE_RUNS_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pipeline_runs (
+              id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+              run_id TEXT NOT NULL,
+              upload_id UUID REFERENCES uploads(id) ON DELETE SET NULL,
+              account_id UUID,
+              source_platform TEXT NOT NULL,
+              stage TEXT NOT NULL,
+              status TEXT NOT NULL,
+              wall_seconds DOUBLE PRECISION NOT NULL,
+              cpu_seconds DOUBLE PRECISION,
+              bytes_in BIGINT,
+              bytes_out BIGINT,
+              ffmpeg_speed DOUBLE PRECISION,
+              ytdlp_attempts INT,
+              upload_bytes_per_second DOUBLE PRECISION,
+              details JSONB NOT NULL DEFAULT '{}'::jsonb,
+              error TEXT,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            CREATE INDEX IF NOT EXISTS idx_pipeline_runs_created ON pipeline_runs(created_at DESC, stage);
+            CREATE INDEX IF NOT EXISTS idx_pipeline_runs_run ON pipeline_runs(run_id)
+            """
+        )
+    _PIPELINE_RUNS_READY = True
+
+
+async def _ensure_upload_prepare_columns() -> None:
+    """Best-effort addition of prefetch bookkeeping columns for older DBs."""
+    global _UPLOAD_PREPARE_COLUMNS_READY
+    if _UPLOAD_PREPARE_COLUMNS_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            ALTER TABLE IF EXISTS uploads
+            ADD COLUMN IF NOT EXISTS prepare_started_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS prepared_at TIMESTAMPTZ
+            """
+        )
+    _UPLOAD_PREPARE_COLUMNS_READY = True
+
+
+async def _ensure_upload_lease_columns() -> None:
+    """Best-effort addition of the claim/lease columns used by multi-worker claiming."""
+    global _UPLOAD_LEASE_COLUMNS_READY
+    if _UPLOAD_LEASE_COLUMNS_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            ALTER TABLE IF EXISTS uploads
+            ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+            ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+            CREATE INDEX IF NOT EXISTS idx_uploads_lease ON uploads(lease_expires_at) WHERE status = 'uploading'
+            """
+        )
+    _UPLOAD_LEASE_COLUMNS_READY = True
+
+
+async def _ensure_transform_claims_table() -> None:
+    """Best-effort creation of the cross-replica single-flight claims table."""
+    global _TRANSFORM_CLAIMS_READY
+    if _TRANSFORM_CLAIMS_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transform_claims (
+              key TEXT PRIMARY KEY,
+              holder TEXT NOT NULL,
+              expires_at TIMESTAMPTZ NOT NULL
+            )
+            """
+        )
+    _TRANSFORM_CLAIMS_READY = True
+
+
+async def _ensure_upload_retry_column() -> None:
+    """Best-effort addition of next_attempt_at (retry backoff) for older DBs."""
+    global _UPLOAD_RETRY_COLUMN_READY
+    if _UPLOAD_RETRY_COLUMN_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            ALTER TABLE IF EXISTS uploads ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ;
+            CREATE INDEX IF NOT EXISTS idx_uploads_next_attempt ON uploads(next_attempt_at) WHERE status = 'retry'
+            """
+        )
+    _UPLOAD_RETRY_COLUMN_READY = True
+
+
+async def _ensure_encode_profile_columns() -> None:
+    """Best-effort addition of per-account/per-theme encoder profile columns."""
+    global _ENCODE_PROFILE_COLUMNS_READY
+    if _ENCODE_PROFILE_COLUMNS_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            ALTER TABLE IF EXISTS accounts ADD COLUMN IF NOT EXISTS encode_profile TEXT;
+            ALTER TABLE IF EXISTS themes ADD COLUMN IF NOT EXISTS encode_profile TEXT
+            """
+        )
+    _ENCODE_PROFILE_COLUMNS_READY = True
+
+
 # API Projects
 async def create_api_project(
     project_name: str,
@@ -112,6 +318,66 @@ async def update_quota_usage(project_id: UUID, cost: int) -> None:
         )
 
 
+async def reserve_project_quota(cost: int, exclude: Optional[List[UUID]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Charge `cost` up front to the first project (same order as list_api_projects)
+    that still has room and is not in `exclude`. The check and the charge happen
+    under a row lock, so concurrent uploads cannot overshoot a daily quota.
+    Returns the project, or None when none has room. Undo with release_project_quota.
+    """
+    async with get_db() as conn:
+        async with conn.transaction():
+            row = await conn.fetchrow(
+                """
+                SELECT id, project_name, daily_quota, quota_used_today, quota_reset_at, created_at
+                FROM api_projects
+                WHERE quota_used_today + $1 <= daily_quota
+                  AND NOT (id = ANY($2::uuid[]))
+                ORDER BY created_at DESC
+                LIMIT 1
+                FOR UPDATE
+                """,
+                cost, exclude or []
+            )
+            if not row:
+                return None
+            await conn.execute(
+                """
+                INSERT INTO quota_history (api_project_id, operation, cost, quota_before, quota_after)
+                VALUES ($1, 'upload', $2, $3, $3 + $2)
+                """,
+                row['id'], cost, row['quota_used_today']
+            )
+            await conn.execute(
+                "UPDATE api_projects SET quota_used_today = quota_used_today + $1 WHERE id = $2",
+                cost, row['id']
+            )
+            project = dict(row)
+            project['quota_used_today'] += cost
+            return project
+
+
+async def release_project_quota(project_id: UUID, cost: int) -> None:
+    """Give back a reservation whose upload did not happen."""
+    async with get_db() as conn:
+        async with conn.transaction():
+            before = await conn.fetchval(
+                "SELECT quota_used_today FROM api_projects WHERE id = $1 FOR UPDATE",
+                project_id
+            )
+            if before is None:
+                return
+            after = max(0, before - cost)
+            await conn.execute(
+                """
+                INSERT INTO quota_history (api_project_id, operation, cost, quota_before, quota_after)
+                VALUES ($1, 'upload_released', $2, $3, $4)
+                """,
+                project_id, after - before, before, after
+            )
+            await conn.execute("UPDATE api_projects SET quota_used_today = $1 WHERE id = $2", after, project_id)
+
+
 async def reset_daily_quotas() -> None:
     """Reset all project quotas (called by cron daily)."""
     async with get_db() as conn:
@@ -245,6 +511,26 @@ async def update_account_status(account_id: UUID, active: bool) -> None:
         )
 
 
+async def set_account_encode_profile(account_id: UUID, profile: Optional[str]) -> None:
+    """Override the encoder profile of an account (None = use the theme's)."""
+    await _ensure_encode_profile_columns()
+    async with get_db() as conn:
+        await conn.execute(
+            "UPDATE accounts SET encode_profile = $1 WHERE id = $2",
+            profile, account_id
+        )
+
+
+async def set_theme_encode_profile(slug: str, profile: Optional[str]) -> None:
+    """Set the encoder profile of a theme (None = use the global default)."""
+    await _ensure_encode_profile_columns()
+    async with get_db() as conn:
+        await conn.execute(
+            "UPDATE themes SET encode_profile = $1 WHERE slug = $2",
+            profile, slug
+        )
+
+
 async def flag_account_for_reconnect(account_id: UUID, error_code: str, error_message: str) -> None:
     """Mark account as needing reconnection due to OAuth issues."""
     await _ensure_account_reconnect_columns()
@@ -324,6 +610,47 @@ async def upsert_video(
         return dict(row)
 
 
+async def upsert_videos_bulk(
+    source_video_ids: List[str],
+    titles: List[Optional[str]],
+    theme_slug: str,
+    *,
+    source_platform: str = "youtube"
+) -> List[Dict[str, Any]]:
+    """Insert or update many videos in one statement (returned in input order)."""
+    if not source_video_ids:
+        return []
+    async with get_db() as conn:
+        rows = await conn.fetch(
+            """
+            INSERT INTO videos (source_platform, source_video_id, title, theme_slug)
+            SELECT $1, u.source_video_id, u.title, $4
+            FROM unnest($2::text[], $3::text[]) AS u(source_video_id, title)
+            ON CONFLICT (source_video_id) DO UPDATE
+            SET title = EXCLUDED.title,
+                source_platform = EXCLUDED.source_platform,
+                theme_slug = EXCLUDED.theme_slug
+            RETURNING *
+            """,
+            source_platform, source_video_ids, titles, theme_slug
+        )
+    by_source = {row['source_video_id']: dict(row) for row in rows}
+    return [by_source[source_id] for source_id in source_video_ids if source_id in by_source]
+
+
+async def ensure_theme(slug: str) -> None:
+    """Create a bare theme (title = capitalized slug) if it does not exist."""
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            INSERT INTO themes (slug, title)
+            VALUES ($1, $2)
+            ON CONFLICT (slug) DO NOTHING
+            """,
+            slug, slug.capitalize()
+        )
+
+
 async def list_videos(theme_slug: str, picked: Optional[bool] = None, limit: int = 50) -> List[Dict[str, Any]]:
     """List videos by theme, optionally filtered by picked status."""
     async with get_db() as conn:
@@ -357,6 +684,58 @@ async def get_video_by_id(video_id: UUID) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 
+MEDIA_INFO_FIELDS = [
+    'format_name', 'duration', 'size_bytes', 'bit_rate',
+    'video_codec', 'width', 'height', 'pix_fmt', 'fps', 'video_bit_rate', 'rotation',
+    'has_audio', 'audio_codec', 'audio_bit_rate', 'audio_channels', 'audio_sample_rate',
+]
+
+
+async def save_video_media_info(video_id: UUID, info: Dict[str, Any], probe: Dict[str, Any]) -> None:
+    """Store summarized ffprobe info plus the full probe JSON for a video."""
+    await _ensure_video_media_info_table()
+    values = [info.get(field) for field in MEDIA_INFO_FIELDS]
+    values[MEDIA_INFO_FIELDS.index('rotation')] = info.get('rotation') or 0
+    values[MEDIA_INFO_FIELDS.index('has_audio')] = bool(info.get('has_audio'))
+    columns = ', '.join(MEDIA_INFO_FIELDS)
+    placeholders = ', '.join(f"${i + 2}" for i in range(len(MEDIA_INFO_FIELDS)))
+    updates = ', '.join(f"{field} = EXCLUDED.{field}" for field in MEDIA_INFO_FIELDS)
+    probe_param = len(MEDIA_INFO_FIELDS) + 2
+    async with get_db() as conn:
+        await conn.execute(
+            f"""
+            INSERT INTO video_media_info (video_id, {columns}, probe)
+            VALUES ($1, {placeholders}, ${probe_param}::jsonb)
+            ON CONFLICT (video_id) DO UPDATE
+            SET {updates},
+                probe = EXCLUDED.probe,
+                probed_at = NOW()
+            """,
+            video_id, *values, json.dumps(probe)
+        )
+        # User uploads arrive without a duration; fill it from the probe
+        if info.get('duration') is not None:
+            await conn.execute(
+                """
+                UPDATE videos
+                SET duration_seconds = ROUND($2::numeric)::int
+                WHERE id = $1 AND duration_seconds IS NULL
+                """,
+                video_id, info['duration']
+            )
+
+
+async def get_video_media_info(video_id: UUID) -> Optional[Dict[str, Any]]:
+    """Get stored ffprobe summary for a video (without the raw probe JSON)."""
+    await _ensure_video_media_info_table()
+    async with get_db() as conn:
+        row = await conn.fetchrow(
+            f"SELECT {', '.join(MEDIA_INFO_FIELDS)}, probed_at FROM video_media_info WHERE video_id = $1",
+            video_id
+        )
+        return dict(row) if row else None
+
+
 async def mark_video_picked(video_id: UUID) -> None:
     """Mark a video as picked."""
     async with get_db() as conn:
@@ -623,9 +1002,15 @@ async def update_upload_status(
     status: str,
     run_id: Optional[str] = None,
     error: Optional[str] = None,
-    youtube_video_id: Optional[str] = None
+    youtube_video_id: Optional[str] = None,
+    next_attempt_at: Optional[datetime] = None
 ) -> None:
-    """Update upload status."""
+    """
+    Update upload status (any status but 'uploading' ends the worker's lease).
+    next_attempt_at holds a 'retry' back until then; other updates clear it.
+    """
+    await _ensure_upload_lease_columns()
+    await _ensure_upload_retry_column()
     async with get_db() as conn:
         # Record in history
         await conn.execute(
@@ -641,7 +1026,10 @@ async def update_upload_status(
             await conn.execute(
                 """
                 UPDATE uploads
-                SET status = $1, run_id = $2, error = $3, youtube_video_id = $4
+                SET status = $1, run_id = $2, error = $3, youtube_video_id = $4,
+                    claimed_by = CASE WHEN $1 = 'uploading' THEN claimed_by END,
+                    lease_expires_at = CASE WHEN $1 = 'uploading' THEN lease_expires_at END,
+                    next_attempt_at = NULL
                 WHERE id = $5
                 """,
                 status, run_id, error, youtube_video_id, upload_id
@@ -650,10 +1038,13 @@ async def update_upload_status(
             await conn.execute(
                 """
                 UPDATE uploads
-                SET status = $1, run_id = $2, error = $3
+                SET status = $1, run_id = $2, error = $3,
+                    claimed_by = CASE WHEN $1 = 'uploading' THEN claimed_by END,
+                    lease_expires_at = CASE WHEN $1 = 'uploading' THEN lease_expires_at END,
+                    next_attempt_at = $5
                 WHERE id = $4
                 """,
-                status, run_id, error, upload_id
+                status, run_id, error, upload_id, next_attempt_at
             )
 
 
@@ -681,7 +1072,11 @@ async def update_upload(
     tags: Optional[List[str]] = None,
     status: Optional[str] = None
 ) -> Dict[str, Any]:
-    """Update mutable fields of an upload and return updated row."""
+    """
+    Update mutable fields of an upload and return updated row. Setting
+    scheduled_for or status explicitly also ends any retry backoff.
+    """
+    await _ensure_upload_retry_column()
     async with get_db() as conn:
         fields = []
         values: List[Any] = []
@@ -700,6 +1095,8 @@ async def update_upload(
         if status is not None:
             fields.append("status = $%d" % (len(values)+1))
             values.append(status)
+        if scheduled_for is not None or status is not None:
+            fields.append("next_attempt_at = NULL")
         if not fields:
             row = await conn.fetchrow("SELECT * FROM uploads WHERE id = $1", upload_id)
             return dict(row) if row else None
@@ -716,31 +1113,795 @@ async def delete_upload(upload_id: UUID) -> None:
         await conn.execute("DELETE FROM uploads WHERE id = $1", upload_id)
 
 
-async def select_due_uploads(now: datetime, limit: int = 10) -> List[Dict[str, Any]]:
-    """Select uploads that are due for processing."""
+UPLOADS_CHANNEL = 'uploads_changed'
+
+
+async def ensure_uploads_notify_trigger() -> None:
+    """
+    Best-effort installation of the trigger that NOTIFYs UPLOADS_CHANNEL with
+    {id, status, scheduled_for, due_at} whenever an upload is inserted or its
+    status / scheduled_for / next_attempt_at change (wakes the worker; see
+    wakeups.py). due_at is when it can actually run, after any retry backoff.
+    """
+    global _UPLOADS_NOTIFY_READY
+    if _UPLOADS_NOTIFY_READY:
+        return
+    await _ensure_upload_retry_column()
+    async with get_db() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                CREATE OR REPLACE FUNCTION notify_uploads_changed()
+                RETURNS TRIGGER AS $$
+                BEGIN
+                  PERFORM pg_notify('uploads_changed', json_build_object(
+                    'id', NEW.id, 'status', NEW.status, 'scheduled_for', NEW.scheduled_for,
+                    'due_at', GREATEST(NEW.scheduled_for, NEW.next_attempt_at)
+                  )::text);
+                  RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+                DROP TRIGGER IF EXISTS uploads_notify_changed ON uploads;
+                CREATE TRIGGER uploads_notify_changed AFTER INSERT OR UPDATE OF status, scheduled_for, next_attempt_at ON uploads
+                  FOR EACH ROW EXECUTE FUNCTION notify_uploads_changed()
+                """
+            )
+    _UPLOADS_NOTIFY_READY = True
+
+
+async def extend_upload_leases(upload_ids: List[UUID], worker_id: str, lease: timedelta) -> List[UUID]:
+    """
+    Heartbeat: push out the lease of uploads this worker still holds. Returns the
+    ids actually extended; a missing id means the lease was lost (reclaimed).
+    """
+    if not upload_ids:
+        return []
+    await _ensure_upload_lease_columns()
     async with get_db() as conn:
         rows = await conn.fetch(
             """
-            SELECT u.*, a.oauth_refresh_token, a.api_project_id, v.source_video_id
-            FROM uploads u
-            JOIN accounts a ON u.account_id = a.id
-            JOIN videos v ON u.video_id = v.id
-            WHERE u.status IN ('scheduled', 'retry')
-              AND u.scheduled_for <= $1
-              AND a.active = true
-            ORDER BY u.scheduled_for ASC
+            UPDATE uploads
+            SET lease_expires_at = NOW() + $3::interval
+            WHERE id = ANY($1::uuid[]) AND claimed_by = $2 AND status = 'uploading'
+            RETURNING id
+            """,
+            upload_ids, worker_id, lease
+        )
+        return [row['id'] for row in rows]
+
+
+async def reclaim_expired_uploads(legacy_stale_after: timedelta, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Reaper: uploads stuck in 'uploading' whose lease expired (their worker died)
+    go back to 'retry', or to 'failed' once retries are used up. Rows from before
+    leases existed (no lease_expires_at) count as expired after
+    `legacy_stale_after` without updates. Each reclaim is recorded in
+    upload_history as 'reclaimed'.
+    """
+    await _ensure_upload_lease_columns()
+    async with get_db() as conn:
+        async with conn.transaction():
+            rows = await conn.fetch(
+                """
+                WITH expired AS (
+                  SELECT id, claimed_by
+                  FROM uploads
+                  WHERE status = 'uploading'
+                    AND (lease_expires_at < NOW()
+                         OR (lease_expires_at IS NULL AND updated_at < NOW() - $1::interval))
+                  ORDER BY lease_expires_at ASC NULLS FIRST
+                  LIMIT $2
+                  FOR UPDATE SKIP LOCKED
+                )
+                UPDATE uploads u
+                SET status = CASE WHEN u.retry_count + 1 >= u.max_retries THEN 'failed' ELSE 'retry' END,
+                    retry_count = u.retry_count + 1,
+                    error = 'Lease expired: worker ' || COALESCE(expired.claimed_by, 'unknown') || ' stopped responding',
+                    claimed_by = NULL,
+                    lease_expires_at = NULL
+                FROM expired
+                WHERE u.id = expired.id
+                RETURNING u.id, u.status, u.run_id, u.error, expired.claimed_by
+                """,
+                legacy_stale_after, limit
+            )
+            if rows:
+                await conn.executemany(
+                    """
+                    INSERT INTO upload_history (upload_id, status, run_id, error)
+                    VALUES ($1, 'reclaimed', $2, $3)
+                    """,
+                    [(row['id'], row['run_id'] or '', row['error']) for row in rows]
+                )
+                await conn.execute(
+                    """
+                    UPDATE roblox_projects p
+                    SET status = u.status, updated_at = NOW()
+                    FROM uploads u
+                    WHERE p.upload_id = u.id AND u.id = ANY($1::uuid[])
+                    """,
+                    [row['id'] for row in rows]
+                )
+            return [dict(row) for row in rows]
+
+
+async def count_reclaimed_uploads(since: datetime) -> Dict[str, Any]:
+    """Reclaimed uploads since `since`, plus uploads currently leased (and how many are overdue)."""
+    await _ensure_upload_lease_columns()
+    async with get_db() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT
+              (SELECT COUNT(*) FROM upload_history WHERE status = 'reclaimed' AND created_at >= $1) AS reclaimed,
+              (SELECT COUNT(*) FROM uploads WHERE status = 'uploading') AS uploading,
+              (SELECT COUNT(*) FROM uploads WHERE status = 'uploading' AND lease_expires_at < NOW()) AS expired_leases
+            """,
+            since
+        )
+        return dict(row)
+
+
+async def list_upcoming_upload_times(until: datetime, limit: int = 500) -> List[Dict[str, Any]]:
+    """
+    (id, due_at) of uploads waiting to run up to `until`, earliest first (overdue
+    included). due_at is scheduled_for, or next_attempt_at while a retry backs off.
+    """
+    await _ensure_upload_retry_column()
+    async with get_db() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT id, GREATEST(scheduled_for, next_attempt_at) AS due_at
+            FROM uploads
+            WHERE status IN ('scheduled', 'retry', 'prepared')
+              AND GREATEST(scheduled_for, next_attempt_at) <= $1
+            ORDER BY due_at ASC
             LIMIT $2
             """,
-            now, limit
+            until, limit
         )
-        
-        # Decrypt tokens
-        result = []
-        for row in rows:
-            data = dict(row)
-            # Temporarily skip decryption to avoid UTF-8 errors
-            # data['oauth_refresh_token'] = decrypt_field(data['oauth_refresh_token'])
-            result.append(data)
-        
-        return result
+        return [dict(row) for row in rows]
 
+
+async def plan_due_uploads(
+    now: datetime,
+    today_start: datetime,
+    limit: int,
+    worker_id: str,
+    lease: timedelta
+) -> List[Dict[str, Any]]:
+    """
+    One tick's plan in a single statement. Due uploads are claimed atomically
+    for this worker (status 'uploading', claimed_by / lease_expires_at; rows
+    locked by a concurrent claim are skipped, so no two replicas get the same
+    upload) and returned with plan_action='run'. Only 'scheduled', 'retry' and
+    'prepared' uploads run; 'pending' ones are never claimed (as before), and
+    those not due yet come back unclaimed with plan_action='early'. An upload is due once
+    both scheduled_for and its retry backoff (next_attempt_at) have passed; rows
+    carry that moment as due_at. Due uploads are taken
+    round-robin across accounts (each account's oldest first, then its second
+    oldest, ...), so one account's backlog cannot fill the whole batch. Every
+    row carries its account's uploads scheduled since `today_start` (scheduled_today).
+    """
+    await _ensure_encode_profile_columns()
+    await _ensure_upload_lease_columns()
+    await _ensure_upload_retry_column()
+    async with get_db() as conn:
+        rows = await conn.fetch(
+            """
+            WITH ranked AS (
+              SELECT u.id,
+                     row_number() OVER (
+                       PARTITION BY u.account_id ORDER BY GREATEST(u.scheduled_for, u.next_attempt_at)
+                     ) AS account_rank
+              FROM uploads u
+              JOIN accounts a ON u.account_id = a.id
+              WHERE u.status IN ('scheduled', 'retry', 'prepared')
+                AND GREATEST(u.scheduled_for, u.next_attempt_at) <= $1
+                AND a.active = true
+            ),
+            picked AS (
+              SELECT u.id, u.status, GREATEST(u.scheduled_for, u.next_attempt_at) AS due_at
+              FROM uploads u
+              JOIN ranked r ON r.id = u.id
+              -- Re-checked on the locked row in case another worker claimed it meanwhile
+              WHERE u.status IN ('scheduled', 'retry', 'prepared')
+                AND GREATEST(u.scheduled_for, u.next_attempt_at) <= $1
+              ORDER BY r.account_rank ASC, due_at ASC
+              LIMIT $3
+              FOR UPDATE OF u SKIP LOCKED
+            ),
+            claimed AS (
+              UPDATE uploads u
+              SET status = 'uploading',
+                  claimed_by = $4,
+                  claimed_at = $1,
+                  lease_expires_at = $1 + $5::interval,
+                  next_attempt_at = NULL
+              FROM picked
+              WHERE u.id = picked.id
+              RETURNING u.*, picked.status AS claimed_from_status, 'run' AS plan_action, picked.due_at
+            ),
+            early AS (
+              SELECT u.*, u.status AS claimed_from_status, 'early' AS plan_action, u.scheduled_for AS due_at
+              FROM uploads u
+              WHERE u.status = 'pending' AND u.scheduled_for > $1
+              ORDER BY u.scheduled_for ASC
+              LIMIT $3
+            ),
+            planned AS (
+              SELECT * FROM claimed
+              UNION ALL
+              SELECT * FROM early
+            ),
+            daily AS (
+              SELECT account_id, COUNT(*) AS scheduled_today
+              FROM uploads
+              WHERE scheduled_for >= $2
+                AND account_id IN (SELECT account_id FROM planned)
+              GROUP BY account_id
+            )
+            SELECT p.*, COALESCE(d.scheduled_today, 0) AS scheduled_today,
+                   a.oauth_refresh_token, a.api_project_id, v.source_video_id, v.duration_seconds,
+                   COALESCE(a.encode_profile, t.encode_profile) AS encode_profile
+            FROM planned p
+            JOIN accounts a ON a.id = p.account_id
+            JOIN videos v ON v.id = p.video_id
+            LEFT JOIN themes t ON t.slug = a.theme_slug
+            LEFT JOIN daily d ON d.account_id = p.account_id
+            ORDER BY p.due_at ASC
+            """,
+            now, today_start, limit, worker_id, lease
+        )
+        return [dict(row) for row in rows]
+
+
+async def skip_and_reschedule_uploads(reschedules: List[tuple]) -> None:
+    """Mark uploads 'skipped' with a new scheduled_for: [(upload_id, new_scheduled_for), ...]."""
+    if not reschedules:
+        return
+    async with get_db() as conn:
+        await conn.executemany(
+            """
+            UPDATE uploads
+            SET status = 'skipped', scheduled_for = $2
+            WHERE id = $1
+            """,
+            reschedules
+        )
+
+
+
+async def claim_uploads_to_prepare(
+    now: datetime,
+    until: datetime,
+    limit: int = 3,
+    stale_after: timedelta = timedelta(minutes=30)
+) -> List[Dict[str, Any]]:
+    """
+    Claim scheduled uploads due within (now, until] for prefetching.
+    A claim is a prepare_started_at timestamp, so other workers skip the row;
+    claims older than `stale_after` (crashed or failed prefetch) can be taken again.
+    """
+    await _ensure_upload_prepare_columns()
+    await _ensure_encode_profile_columns()
+    async with get_db() as conn:
+        rows = await conn.fetch(
+            """
+            WITH picked AS (
+              SELECT u.id
+              FROM uploads u
+              JOIN accounts a ON u.account_id = a.id
+              WHERE u.status = 'scheduled'
+                AND u.scheduled_for > $1
+                AND u.scheduled_for <= $2
+                AND a.active = true
+                AND (u.prepare_started_at IS NULL OR u.prepare_started_at < $1 - $4::interval)
+              ORDER BY u.scheduled_for ASC
+              LIMIT $3
+              FOR UPDATE OF u SKIP LOCKED
+            )
+            UPDATE uploads u
+            SET prepare_started_at = $1
+            FROM picked, videos v, accounts a
+            LEFT JOIN themes t ON t.slug = a.theme_slug
+            WHERE u.id = picked.id AND v.id = u.video_id AND a.id = u.account_id
+            RETURNING u.*, v.source_video_id, v.duration_seconds,
+                      COALESCE(a.encode_profile, t.encode_profile) AS encode_profile
+            """,
+            now, until, limit, stale_after
+        )
+        return [dict(row) for row in rows]
+
+
+async def mark_upload_prepared(upload_id: UUID, run_id: str) -> bool:
+    """Mark a prefetched upload as 'prepared' unless its status changed meanwhile."""
+    await _ensure_upload_prepare_columns()
+    async with get_db() as conn:
+        async with conn.transaction():
+            updated = await conn.fetchval(
+                """
+                UPDATE uploads
+                SET status = 'prepared', prepared_at = NOW(), run_id = $2
+                WHERE id = $1 AND status = 'scheduled'
+                RETURNING id
+                """,
+                upload_id, run_id
+            )
+            if updated:
+                await conn.execute(
+                    """
+                    INSERT INTO upload_history (upload_id, status, run_id, error)
+                    VALUES ($1, 'prepared', $2, NULL)
+                    """,
+                    upload_id, run_id
+                )
+            return bool(updated)
+
+
+# Resumable upload sessions (YouTube session URI + confirmed byte offset)
+async def save_upload_session(
+    upload_id: UUID,
+    session_uri: str,
+    offset_bytes: int,
+    total_bytes: int,
+    content_sha256: str,
+    chunk_size: Optional[int] = None
+) -> None:
+    """Create or advance the resumable session of an upload."""
+    await _ensure_upload_sessions_table()
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            INSERT INTO upload_sessions (upload_id, session_uri, offset_bytes, total_bytes, content_sha256, chunk_size)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (upload_id) DO UPDATE
+            SET session_uri = EXCLUDED.session_uri,
+                offset_bytes = EXCLUDED.offset_bytes,
+                total_bytes = EXCLUDED.total_bytes,
+                content_sha256 = EXCLUDED.content_sha256,
+                chunk_size = EXCLUDED.chunk_size,
+                updated_at = NOW()
+            """,
+            upload_id, session_uri, offset_bytes, total_bytes, content_sha256, chunk_size
+        )
+
+
+async def get_upload_session(upload_id: UUID) -> Optional[Dict[str, Any]]:
+    """Get the persisted resumable session of an upload, if any."""
+    await _ensure_upload_sessions_table()
+    async with get_db() as conn:
+        row = await conn.fetchrow("SELECT * FROM upload_sessions WHERE upload_id = $1", upload_id)
+        return dict(row) if row else None
+
+
+async def delete_upload_session(upload_id: UUID) -> None:
+    """Forget a finished or unusable resumable session."""
+    await _ensure_upload_sessions_table()
+    async with get_db() as conn:
+        await conn.execute("DELETE FROM upload_sessions WHERE upload_id = $1", upload_id)
+
+
+# Pipeline telemetry (one row per stage of a run)
+async def insert_pipeline_run(
+    run_id: str,
+    upload_id: Optional[UUID],
+    account_id: Optional[UUID],
+    source_platform: str,
+    stage: str,
+    status: str,
+    wall_seconds: float,
+    cpu_seconds: Optional[float] = None,
+    bytes_in: Optional[int] = None,
+    bytes_out: Optional[int] = None,
+    ffmpeg_speed: Optional[float] = None,
+    ytdlp_attempts: Optional[int] = None,
+    upload_bytes_per_second: Optional[float] = None,
+    details: Optional[Dict[str, Any]] = None,
+    error: Optional[str] = None
+) -> None:
+    """Store the measurements of one pipeline stage."""
+    await _ensure_pipeline_runs_table()
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            INSERT INTO pipeline_runs (
+              run_id, upload_id, account_id, source_platform, stage, status, wall_seconds,
+              cpu_seconds, bytes_in, bytes_out, ffmpeg_speed, ytdlp_attempts,
+              upload_bytes_per_second, details, error
+            )
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14::jsonb, $15)
+            """,
+            run_id, upload_id, account_id, source_platform, stage, status, wall_seconds,
+            cpu_seconds, bytes_in, bytes_out, ffmpeg_speed, ytdlp_attempts,
+            upload_bytes_per_second, json.dumps(details or {}), error
+        )
+
+
+async def get_pipeline_latency(since: datetime) -> List[Dict[str, Any]]:
+    """
+    p50/p95 per stage, overall and broken down by source platform and by account.
+    Percentiles only use successful stages; errors are counted separately.
+    """
+    await _ensure_pipeline_runs_table()
+    async with get_db() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT
+              stage,
+              source_platform,
+              account_id,
+              CASE
+                WHEN GROUPING(source_platform) = 0 THEN 'platform'
+                WHEN GROUPING(account_id) = 0 THEN 'account'
+                ELSE 'stage'
+              END AS grouping,
+              COUNT(*) AS runs,
+              COUNT(*) FILTER (WHERE status = 'error') AS errors,
+              percentile_cont(0.5) WITHIN GROUP (ORDER BY wall_seconds) FILTER (WHERE status = 'ok') AS wall_p50,
+              percentile_cont(0.95) WITHIN GROUP (ORDER BY wall_seconds) FILTER (WHERE status = 'ok') AS wall_p95,
+              percentile_cont(0.5) WITHIN GROUP (ORDER BY cpu_seconds) FILTER (WHERE status = 'ok') AS cpu_p50,
+              percentile_cont(0.95) WITHIN GROUP (ORDER BY cpu_seconds) FILTER (WHERE status = 'ok') AS cpu_p95,
+              percentile_cont(0.5) WITHIN GROUP (ORDER BY ffmpeg_speed) FILTER (WHERE status = 'ok') AS ffmpeg_speed_p50,
+              percentile_cont(0.5) WITHIN GROUP (ORDER BY upload_bytes_per_second) FILTER (WHERE status = 'ok') AS upload_bps_p50,
+              percentile_cont(0.05) WITHIN GROUP (ORDER BY upload_bytes_per_second) FILTER (WHERE status = 'ok') AS upload_bps_p5,
+              AVG(ytdlp_attempts) AS ytdlp_attempts_avg,
+              SUM(bytes_in) AS bytes_in,
+              SUM(bytes_out) AS bytes_out
+            FROM pipeline_runs
+            WHERE created_at >= $1
+            GROUP BY GROUPING SETS ((stage), (stage, source_platform), (stage, account_id))
+            ORDER BY stage, grouping, runs DESC
+            """,
+            since
+        )
+        return [dict(row) for row in rows]
+
+
+async def get_dispatch_lag_histogram(since: datetime, bounds: List[float]) -> Dict[str, Any]:
+    """
+    Dispatch lag (download start minus scheduled_for, recorded by the scheduler
+    in the download stage's details) since `since`: counts per width_bucket()
+    over `bounds` (index 0 = below bounds[0]) plus p50/p95/max.
+    """
+    await _ensure_pipeline_runs_table()
+    async with get_db() as conn:
+        rows = await conn.fetch(
+            """
+            WITH lags AS (
+              SELECT (details->>'dispatch_lag_seconds')::double precision AS lag
+              FROM pipeline_runs
+              WHERE stage = 'download'
+                AND created_at >= $1
+                AND details ? 'dispatch_lag_seconds'
+            )
+            SELECT width_bucket(lag, $2::double precision[]) AS bucket, COUNT(*) AS runs
+            FROM lags
+            GROUP BY bucket
+            ORDER BY bucket
+            """,
+            since, bounds
+        )
+        summary = await conn.fetchrow(
+            """
+            SELECT
+              COUNT(*) AS runs,
+              percentile_cont(0.5) WITHIN GROUP (ORDER BY lag) AS p50,
+              percentile_cont(0.95) WITHIN GROUP (ORDER BY lag) AS p95,
+              MAX(lag) AS max
+            FROM (
+              SELECT (details->>'dispatch_lag_seconds')::double precision AS lag
+              FROM pipeline_runs
+              WHERE stage = 'download'
+                AND created_at >= $1
+                AND details ? 'dispatch_lag_seconds'
+            ) lags
+            """,
+            since
+        )
+        return {'buckets': {row['bucket']: row['runs'] for row in rows}, **dict(summary)}
+
+
+# Transform claims (single-flight between replicas): short rows with a TTL, so
+# no pooled connection or open transaction is held while the leader works
+async def claim_transform(key: str, holder: str, ttl: timedelta) -> bool:
+    """Claim `key` for `holder` unless another holder's claim is still live."""
+    await _ensure_transform_claims_table()
+    async with get_db() as conn:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO transform_claims (key, holder, expires_at)
+            VALUES ($1, $2, NOW() + $3::interval)
+            ON CONFLICT (key) DO UPDATE
+              SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+              WHERE transform_claims.expires_at < NOW() OR transform_claims.holder = EXCLUDED.holder
+            RETURNING key
+            """,
+            key, holder, ttl
+        )
+        return row is not None
+
+
+async def extend_transform_claim(key: str, holder: str, ttl: timedelta) -> bool:
+    """Heartbeat a held claim. False when it was lost (expired and taken over)."""
+    await _ensure_transform_claims_table()
+    async with get_db() as conn:
+        row = await conn.fetchrow(
+            """
+            UPDATE transform_claims
+            SET expires_at = NOW() + $3::interval
+            WHERE key = $1 AND holder = $2
+            RETURNING key
+            """,
+            key, holder, ttl
+        )
+        return row is not None
+
+
+async def release_transform_claim(key: str, holder: str) -> None:
+    await _ensure_transform_claims_table()
+    async with get_db() as conn:
+        await conn.execute("DELETE FROM transform_claims WHERE key = $1 AND holder = $2", key, holder)
+
+
+# Rate limiting (token buckets shared by all workers)
+async def take_rate_limit_tokens(
+    name: str,
+    cost: float,
+    capacity: float,
+    refill_per_second: float
+) -> Dict[str, Any]:
+    """
+    Refill and try to take `cost` tokens from a bucket atomically (row lock).
+    Returns {'granted': bool, 'wait_seconds': float, 'tokens': float}.
+    """
+    await _ensure_rate_limit_table()
+    async with get_db() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO rate_limit_buckets (name, tokens, capacity, refill_per_second)
+                VALUES ($1, $2, $2, $3)
+                ON CONFLICT (name) DO NOTHING
+                """,
+                name, capacity, refill_per_second
+            )
+            row = await conn.fetchrow(
+                """
+                SELECT tokens, penalty_until, updated_at, NOW() AS now
+                FROM rate_limit_buckets
+                WHERE name = $1
+                FOR UPDATE
+                """,
+                name
+            )
+            now = row['now']
+            penalty_wait = max(0.0, (row['penalty_until'] - now).total_seconds())
+            if penalty_wait:
+                # No refill while penalized, so everyone resumes slowly together
+                tokens = min(capacity, row['tokens'])
+            else:
+                elapsed = max(0.0, (now - row['updated_at']).total_seconds())
+                tokens = min(capacity, row['tokens'] + elapsed * refill_per_second)
+
+            granted = penalty_wait == 0 and tokens >= cost
+            if granted:
+                tokens -= cost
+                wait_seconds = 0.0
+            elif penalty_wait:
+                wait_seconds = penalty_wait
+            else:
+                wait_seconds = (cost - tokens) / refill_per_second if refill_per_second > 0 else 60.0
+
+            await conn.execute(
+                """
+                UPDATE rate_limit_buckets
+                SET tokens = $2, capacity = $3, refill_per_second = $4, updated_at = $5
+                WHERE name = $1
+                """,
+                name, tokens, capacity, refill_per_second, now
+            )
+            return {'granted': granted, 'wait_seconds': wait_seconds, 'tokens': tokens}
+
+
+async def penalize_rate_limit(name: str, seconds: float) -> None:
+    """Empty a bucket and block it for `seconds` (e.g. after an HTTP 429)."""
+    await _ensure_rate_limit_table()
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            UPDATE rate_limit_buckets
+            SET tokens = LEAST(tokens, 0),
+                penalty_until = GREATEST(penalty_until, NOW() + make_interval(secs => $2)),
+                updated_at = NOW()
+            WHERE name = $1
+            """,
+            name, float(seconds)
+        )
+
+
+# Background jobs (long-running API operations executed by the worker)
+
+async def _ensure_background_jobs_table() -> None:
+    """Best-effort creation of the background job queue for older DBs."""
+    global _BACKGROUND_JOBS_READY
+    if _BACKGROUND_JOBS_READY:
+        return
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS background_jobs (
+              id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+              kind TEXT NOT NULL,
+              status TEXT NOT NULL DEFAULT 'queued',
+              payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+              progress JSONB NOT NULL DEFAULT '{}'::jsonb,
+              result JSONB,
+              error TEXT,
+              attempts INT NOT NULL DEFAULT 0,
+              max_attempts INT NOT NULL DEFAULT 3,
+              worker_id TEXT,
+              heartbeat_at TIMESTAMPTZ,
+              created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              started_at TIMESTAMPTZ,
+              finished_at TIMESTAMPTZ
+            );
+            CREATE INDEX IF NOT EXISTS idx_background_jobs_status ON background_jobs(status, created_at)
+            """
+        )
+    _BACKGROUND_JOBS_READY = True
+
+
+def _background_job_row(row) -> Dict[str, Any]:
+    job = dict(row)
+    for key in ('payload', 'progress', 'result'):
+        if isinstance(job.get(key), str):
+            job[key] = json.loads(job[key])
+    return job
+
+
+async def enqueue_background_job(kind: str, payload: Dict[str, Any], max_attempts: int = 3) -> Dict[str, Any]:
+    await _ensure_background_jobs_table()
+    async with get_db() as conn:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO background_jobs (kind, payload, max_attempts)
+            VALUES ($1, $2::jsonb, $3)
+            RETURNING *
+            """,
+            kind, json.dumps(payload, default=str), max_attempts
+        )
+        return _background_job_row(row)
+
+
+async def claim_background_jobs(
+    kinds: List[str],
+    limit: int,
+    worker_id: str,
+    stale_after: timedelta
+) -> List[Dict[str, Any]]:
+    """
+    Claim queued jobs (oldest first) of the given kinds. Running jobs whose
+    heartbeat is older than `stale_after` (their worker died) are taken over.
+    """
+    if limit <= 0 or not kinds:
+        return []
+    await _ensure_background_jobs_table()
+    async with get_db() as conn:
+        # Lost for good: the last attempt's worker died
+        await conn.execute(
+            """
+            UPDATE background_jobs
+            SET status = 'failed', error = 'Worker stopped responding', finished_at = NOW()
+            WHERE status = 'running' AND attempts >= max_attempts AND heartbeat_at < NOW() - $1::interval
+            """,
+            stale_after
+        )
+        rows = await conn.fetch(
+            """
+            WITH picked AS (
+              SELECT id
+              FROM background_jobs
+              WHERE kind = ANY($1::text[])
+                AND attempts < max_attempts
+                AND (status = 'queued'
+                     OR (status = 'running' AND heartbeat_at < NOW() - $4::interval))
+              ORDER BY created_at ASC
+              LIMIT $2
+              FOR UPDATE SKIP LOCKED
+            )
+            UPDATE background_jobs j
+            SET status = 'running',
+                attempts = j.attempts + 1,
+                worker_id = $3,
+                heartbeat_at = NOW(),
+                started_at = NOW(),
+                error = NULL
+            FROM picked
+            WHERE j.id = picked.id
+            RETURNING j.*
+            """,
+            kinds, limit, worker_id, stale_after
+        )
+        return [_background_job_row(row) for row in rows]
+
+
+async def heartbeat_background_jobs(job_ids: List[UUID], worker_id: str) -> None:
+    if not job_ids:
+        return
+    await _ensure_background_jobs_table()
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            UPDATE background_jobs SET heartbeat_at = NOW()
+            WHERE id = ANY($1::uuid[]) AND worker_id = $2 AND status = 'running'
+            """,
+            job_ids, worker_id
+        )
+
+
+async def update_background_job_progress(job_id: UUID, progress: Dict[str, Any]) -> None:
+    """Merge `progress` into the job's progress (also counts as a heartbeat)."""
+    await _ensure_background_jobs_table()
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            UPDATE background_jobs
+            SET progress = progress || $2::jsonb, heartbeat_at = NOW()
+            WHERE id = $1
+            """,
+            job_id, json.dumps(progress, default=str)
+        )
+
+
+async def finish_background_job(
+    job_id: UUID,
+    status: str,
+    result: Optional[Dict[str, Any]] = None,
+    error: Optional[str] = None
+) -> None:
+    """
+    Record the outcome. A failed job with attempts left goes back to 'queued'
+    (status='failed' is final only once max_attempts is reached).
+    """
+    await _ensure_background_jobs_table()
+    async with get_db() as conn:
+        await conn.execute(
+            """
+            UPDATE background_jobs
+            SET status = CASE WHEN $2 = 'failed' AND attempts < max_attempts THEN 'queued' ELSE $2 END,
+                result = $3::jsonb,
+                error = $4,
+                finished_at = CASE WHEN $2 = 'failed' AND attempts < max_attempts THEN NULL ELSE NOW() END
+            WHERE id = $1
+            """,
+            job_id, status, json.dumps(result, default=str) if result is not None else None, error
+        )
+
+
+async def get_background_job(job_id: UUID) -> Optional[Dict[str, Any]]:
+    await _ensure_background_jobs_table()
+    async with get_db() as conn:
+        row = await conn.fetchrow("SELECT * FROM background_jobs WHERE id = $1", job_id)
+        return _background_job_row(row) if row else None
+
+
+async def list_background_jobs(
+    kind: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 50
+) -> List[Dict[str, Any]]:
+    await _ensure_background_jobs_table()
+    async with get_db() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT id, kind, status, progress, error, attempts, worker_id,
+                   created_at, started_at, finished_at
+            FROM background_jobs
+            WHERE ($1::text IS NULL OR kind = $1)
+              AND ($2::text IS NULL OR status = $2)
+            ORDER BY created_at DESC
+            LIMIT $3
+            """,
+            kind, status, limit
+        )
+        return [_background_job_row(row) for row in rows]
@@ -2,13 +2,39 @@
 Video processing pipeline: download → transform → upload → cleanup.
 IMPORTANTE: Los videos SIEMPRE se borran después de procesarlos (bloque finally).
 """
+import asyncio
+import hashlib
 import os
+import shutil
 import subprocess
+import time
 import uuid
-from typing import Dict, Any, Optional
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
 from pathlib import Path
+from uuid import UUID
 from deps import settings
+import models
+from media import (
+    run_command,
+    run_piped,
+    probe_media,
+    plan_transform,
+    media_info_matches_file,
+    parse_storage_ref,
+    keyframe_times,
+    plan_segments,
+    SHORTS_WIDTH,
+    SHORTS_HEIGHT,
+    SHORTS_MAX_SECONDS,
+    ENCODE_PROFILES,
+    resolve_encode_profile,
+)
 from youtube_client import upload_video
+from ytdlp_engine import engine_enabled, engine_download
+from rate_limiter import get_youtube_bucket
+import storage
+import telemetry
 
 
 class PipelineError(Exception):
@@ -16,106 +42,172 @@ class PipelineError(Exception):
     pass
 
 
-def download_video(video_id: str, output_path: str) -> str:
+def transform_params(profile: Optional[str] = None) -> Dict[str, Any]:
+    """Everything that changes the transform output; part of the cache key."""
+    return {
+        'width': SHORTS_WIDTH,
+        'height': SHORTS_HEIGHT,
+        'max_seconds': SHORTS_MAX_SECONDS,
+        **ENCODE_PROFILES[resolve_encode_profile(profile)],
+    }
+
+
+# Default user agents to rotate if none configured
+DEFAULT_USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15'
+]
+
+
+def ytdlp_user_agents() -> list:
+    """User agents from settings or the defaults."""
+    user_agents = getattr(settings, 'ytdlp_user_agents', '').split(',') if getattr(settings, 'ytdlp_user_agents', '') else DEFAULT_USER_AGENTS
+    return [ua.strip() for ua in user_agents if ua.strip()]
+
+
+def plan_download(duration_seconds: Optional[int] = None, to_stdout: bool = False) -> Dict[str, Any]:
+    """
+    Pick what yt-dlp fetches. The output is at most 1080x1920 and 60 seconds, so:
+    - format sort prefers the largest resolution up to 1080 on the short side,
+      then H.264/AAC (remuxable), then the lowest bitrate and size
+    - only the first 60 seconds are fetched when the source may be longer
+    Writing to stdout cannot merge separate video/audio streams, so piped mode
+    sticks to single-file formats (ffmpeg stops reading after 60s there anyway).
+    """
+    plan = {
+        'format': 'b' if to_stdout else 'bv*+ba/b',
+        'format_sort': settings.ytdlp_format_sort,
+        'sections': None,
+    }
+    if not to_stdout and (duration_seconds is None or duration_seconds > SHORTS_MAX_SECONDS):
+        plan['sections'] = f"*0-{SHORTS_MAX_SECONDS}"
+    return plan
+
+
+def build_ytdlp_cmd(
+    video_id: str,
+    output_path: str,
+    user_agent: str,
+    plan: Optional[Dict[str, Any]] = None
+) -> list:
+    """yt-dlp command with anti-bot flags; output_path '-' writes to stdout."""
+    plan = plan or plan_download(to_stdout=output_path == '-')
+    cmd = [
+        settings.ytdlp_bin,
+        '-f', plan['format'],
+        '-S', plan['format_sort'],
+        '-o', output_path,
+        '--no-playlist',
+        '--quiet',
+        '--no-warnings',
+        # Robust anti-bot measures
+        '--user-agent', user_agent,
+        '--sleep-subtitles', '5',
+        '--extractor-retries', '3',
+        '--fragment-retries', '5',
+        '--retry-sleep', '5',
+    ]
+    if not settings.ytdlp_rate_limit_enabled:
+        # Without the shared token bucket, pace each invocation on its own
+        cmd += ['--sleep-requests', '3', '--sleep-interval', '8', '--max-sleep-interval', '15']
+    
+    # Force IPv4 if configured
+    if getattr(settings, 'ytdlp_use_ipv4', True):
+        cmd += ['--force-ipv4']
+    
+    # Hardening flags
+    if getattr(settings, 'ytdlp_extractor_args', ''):
+        cmd += ['--extractor-args', settings.ytdlp_extractor_args]
+    if getattr(settings, 'ytdlp_retries', 0):
+        cmd += ['--retries', str(settings.ytdlp_retries)]
+    if getattr(settings, 'ytdlp_sleep_requests', 0):
+        cmd += ['--sleep-requests', str(settings.ytdlp_sleep_requests)]
+    
+    # Add cookies if configured (file has priority)
+    if getattr(settings, 'ytdlp_cookies_file', ''):
+        cmd += ['--cookies', settings.ytdlp_cookies_file]
+    elif getattr(settings, 'ytdlp_cookies_from_browser', ''):
+        cmd += ['--cookies-from-browser', settings.ytdlp_cookies_from_browser]
+    
+    if plan['sections']:
+        cmd += ['--download-sections', plan['sections']]
+    if plan['format'] != 'b' and output_path != '-':
+        cmd += ['--merge-output-format', 'mp4']
+    
+    cmd += [f'https://www.youtube.com/watch?v={video_id}']
+    return cmd
+
+
+async def fetch_youtube(
+    video_id: str,
+    output_path: str,
+    user_agent: str,
+    plan: Dict[str, Any],
+    timeout: float = 300
+) -> subprocess.CompletedProcess:
+    """One yt-dlp attempt, through the in-process engine or the binary."""
+    await acquire_youtube_token()
+    telemetry.add('ytdlp_attempts', 1)
+    if engine_enabled():
+        return await engine_download(video_id, output_path, plan, user_agent, timeout=timeout)
+    return await run_command(build_ytdlp_cmd(video_id, output_path, user_agent, plan), timeout=timeout)
+
+
+async def acquire_youtube_token() -> None:
+    """Wait for the shared YouTube request budget (no-op when disabled)."""
+    bucket = get_youtube_bucket()
+    if bucket:
+        await bucket.acquire()
+
+
+def is_rate_limited(stderr: str) -> bool:
+    return 'HTTP Error 429' in stderr or 'rate limit' in stderr.lower()
+
+
+async def report_rate_limited() -> None:
+    """Slow every replica down after a 429 instead of just this attempt."""
+    bucket = get_youtube_bucket()
+    if bucket:
+        await bucket.penalize()
+
+
+async def download_video(video_id: str, output_path: str, duration_seconds: Optional[int] = None) -> str:
     """
     Download video from YouTube using yt-dlp with robust anti-bot measures.
+    Only the smallest adequate format and the first 60 seconds are fetched
+    (see plan_download); `duration_seconds` lets Shorts skip the section cut.
     Returns path to downloaded file.
     """
     import random
-    import time
     
     # Handle user-uploaded videos stored in Supabase Storage
     if video_id.startswith(('user:', 'supabase:')):
         try:
-            import httpx
-            storage_ref = video_id.split(':', 1)[1]
-            if video_id.startswith('supabase:'):
-                if '/' not in storage_ref:
-                    raise PipelineError("Supabase reference must include bucket and object path.")
-                bucket, object_path = storage_ref.split('/', 1)
-            else:
-                bucket = settings.supabase_bucket
-                object_path = storage_ref
-
-            storage_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/{bucket}/{object_path}"
-            headers = {
-                "Authorization": f"Bearer {settings.supabase_service_role}",
-                "apikey": settings.supabase_service_role,
-            }
-            with httpx.Client(timeout=60) as client:
-                r = client.get(storage_url, headers=headers)
-                if r.status_code != 200:
-                    raise PipelineError(f"Supabase download failed: {r.status_code} {r.text}")
-                with open(output_path, 'wb') as f:
-                    f.write(r.content)
+            bucket, object_path = parse_storage_ref(video_id)
+            await storage.download_to_file(object_path, output_path, bucket=bucket)
             if not os.path.exists(output_path):
                 raise PipelineError(f"Downloaded file not found: {output_path}")
             return output_path
         except Exception as e:
             raise PipelineError(f"Supabase download error: {str(e)}")
     
-    # Default user agents to rotate if none configured
-    default_user_agents = [
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/121.0',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15'
-    ]
-    
-    # Get user agents from settings or use defaults
-    user_agents = getattr(settings, 'ytdlp_user_agents', '').split(',') if getattr(settings, 'ytdlp_user_agents', '') else default_user_agents
-    user_agents = [ua.strip() for ua in user_agents if ua.strip()]
+    user_agents = ytdlp_user_agents()
     selected_ua = random.choice(user_agents)
+    plan = plan_download(duration_seconds)
     
     max_attempts = 3
     for attempt in range(max_attempts):
         try:
-            if attempt > 0:
-                # Progressive backoff between attempts
+            if attempt > 0 and not settings.ytdlp_rate_limit_enabled:
+                # Progressive backoff between attempts (the token bucket paces them otherwise)
                 sleep_time = min(10 * (2 ** attempt), 60)
                 print(f"Attempt {attempt + 1}/{max_attempts} for video {video_id}, waiting {sleep_time}s...")
-                time.sleep(sleep_time)
-            
-            cmd = [
-                settings.ytdlp_bin,
-                '-f', 'best[ext=mp4]/best',  # Prefer MP4, fallback to best available
-                '-o', output_path,
-                '--no-playlist',
-                '--quiet',
-                '--no-warnings',
-                # Robust anti-bot measures
-                '--user-agent', selected_ua,
-                '--sleep-requests', '3',
-                '--sleep-interval', '8',
-                '--max-sleep-interval', '15',
-                '--sleep-subtitles', '5',
-                '--extractor-retries', '3',
-                '--fragment-retries', '5',
-                '--retry-sleep', '5',
-            ]
-            
-            # Force IPv4 if configured
-            if getattr(settings, 'ytdlp_use_ipv4', True):
-                cmd += ['--force-ipv4']
+                await asyncio.sleep(sleep_time)
             
-            # Hardening flags
-            if getattr(settings, 'ytdlp_extractor_args', ''):
-                cmd += ['--extractor-args', settings.ytdlp_extractor_args]
-            if getattr(settings, 'ytdlp_retries', 0):
-                cmd += ['--retries', str(settings.ytdlp_retries)]
-            if getattr(settings, 'ytdlp_sleep_requests', 0):
-                cmd += ['--sleep-requests', str(settings.ytdlp_sleep_requests)]
-            
-            # Add cookies if configured (file has priority)
-            if getattr(settings, 'ytdlp_cookies_file', ''):
-                cmd += ['--cookies', settings.ytdlp_cookies_file]
-            elif getattr(settings, 'ytdlp_cookies_from_browser', ''):
-                cmd += ['--cookies-from-browser', settings.ytdlp_cookies_from_browser]
-            
-            cmd += [f'https://www.youtube.com/watch?v={video_id}']
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            result = await fetch_youtube(video_id, output_path, selected_ua, plan)
             
             if result.returncode == 0 and os.path.exists(output_path):
                 return output_path
@@ -125,32 +217,17 @@ def download_video(video_id: str, output_path: str) -> str:
             
             # Check for specific error types
             if 'Requested format is not available' in stderr or 'requested format is not available' in stderr.lower():
-                # Fallback: try recoding to mp4 from best available
+                # Fallback: any single-file format, same sort and section limits.
+                # No --recode-video: transform_video re-encodes whatever container arrives.
                 try:
-                    fallback_cmd = [
-                        settings.ytdlp_bin,
-                        '-f', 'best',
-                        '--recode-video', 'mp4',
-                        '-o', output_path,
-                        '--no-playlist',
-                        '--quiet',
-                        '--no-warnings',
-                    ]
-                    if getattr(settings, 'ytdlp_use_ipv4', True):
-                        fallback_cmd += ['--force-ipv4']
-                    if getattr(settings, 'ytdlp_extractor_args', ''):
-                        fallback_cmd += ['--extractor-args', settings.ytdlp_extractor_args]
-                    if getattr(settings, 'ytdlp_retries', 0):
-                        fallback_cmd += ['--retries', str(settings.ytdlp_retries)]
-                    fallback_cmd += [f'https://www.youtube.com/watch?v={video_id}']
-                    recode = subprocess.run(fallback_cmd, capture_output=True, text=True, timeout=600)
-                    if recode.returncode == 0 and os.path.exists(output_path):
+                    fallback = await fetch_youtube(video_id, output_path, selected_ua, dict(plan, format='b'))
+                    if fallback.returncode == 0 and os.path.exists(output_path):
                         return output_path
                     else:
                         # attach fallback stderr to primary error context
-                        stderr += f"\n[fallback recode stderr]\n{recode.stderr or ''}"
+                        stderr += f"\n[fallback format stderr]\n{fallback.stderr or ''}"
                 except Exception as fe:
-                    stderr += f"\n[fallback recode error] {fe}"
+                    stderr += f"\n[fallback format error] {fe}"
             if 'Sign in to confirm you' in stderr or 'cookies' in stderr.lower():
                 if attempt < max_attempts - 1:
                     print(f"Bot check detected, retrying with different user agent...")
@@ -160,7 +237,8 @@ def download_video(video_id: str, output_path: str) -> str:
                     hint = "\nHint: YouTube requires fresh cookies. Update YTDLP_COOKIES_B64 in Railway with new cookies."
                     raise PipelineError(f"yt-dlp bot check failed after {max_attempts} attempts: {stderr}{hint}")
             
-            elif 'HTTP Error 429' in stderr or 'rate limit' in stderr.lower():
+            elif is_rate_limited(stderr):
+                await report_rate_limited()
                 if attempt < max_attempts - 1:
                     print(f"Rate limited, waiting longer...")
                     continue
@@ -194,70 +272,272 @@ def download_video(video_id: str, output_path: str) -> str:
     raise PipelineError(f"Download failed after {max_attempts} attempts")
 
 
-def transform_video(input_path: str, output_path: str) -> str:
+def shorts_video_filter() -> str:
+    """Scale/pad to 9:16 without distortion."""
+    return (
+        f'scale={SHORTS_WIDTH}:{SHORTS_HEIGHT}:force_original_aspect_ratio=decrease,'
+        f'pad={SHORTS_WIDTH}:{SHORTS_HEIGHT}:(ow-iw)/2:(oh-ih)/2'
+    )
+
+
+def build_encode_cmd(input_path: str, output_path: str, profile: Optional[str] = None) -> list:
+    """Full re-encode: scale/pad to 9:16, max 60 seconds, with the given encoder profile."""
+    encode = ENCODE_PROFILES[resolve_encode_profile(profile)]
+    return [
+        settings.ffmpeg_bin,
+        '-benchmark',  # CPU time summary for telemetry
+        '-i', input_path,
+        '-t', str(SHORTS_MAX_SECONDS),  # Max 60 seconds
+        '-vf', shorts_video_filter(),
+        '-c:v', encode['video_codec'],
+        '-preset', encode['preset'],
+        '-crf', str(encode['crf']),
+        '-c:a', encode['audio_codec'],
+        '-b:a', encode['audio_bitrate'],
+        '-movflags', '+faststart',
+        '-y',  # Overwrite output
+        output_path
+    ]
+
+
+def build_segment_encode_cmd(
+    input_path: str,
+    output_path: str,
+    start: float,
+    end: float,
+    threads: int,
+    profile: Optional[str] = None
+) -> list:
+    """Video-only encode of [start, end) of the input (input seeking, exact cut)."""
+    encode = ENCODE_PROFILES[resolve_encode_profile(profile)]
+    return [
+        settings.ffmpeg_bin,
+        '-benchmark',
+        '-ss', f'{start:.3f}',
+        '-i', input_path,
+        '-t', f'{end - start:.3f}',
+        '-map', '0:v:0',
+        '-an',
+        '-vf', shorts_video_filter(),
+        '-c:v', encode['video_codec'],
+        '-preset', encode['preset'],
+        '-crf', str(encode['crf']),
+        '-threads', str(threads),
+        '-y',
+        output_path
+    ]
+
+
+def build_audio_encode_cmd(input_path: str, output_path: str, duration: float, profile: Optional[str] = None) -> list:
+    """Audio-only encode of the first `duration` seconds (runs beside the video segments)."""
+    encode = ENCODE_PROFILES[resolve_encode_profile(profile)]
+    return [
+        settings.ffmpeg_bin,
+        '-benchmark',
+        '-i', input_path,
+        '-t', f'{duration:.3f}',
+        '-map', '0:a:0',
+        '-vn',
+        '-c:a', encode['audio_codec'],
+        '-b:a', encode['audio_bitrate'],
+        '-y',
+        output_path
+    ]
+
+
+def build_concat_cmd(list_path: str, audio_path: Optional[str], output_path: str) -> list:
+    """Join encoded segments with the concat demuxer (stream copy) and add the audio."""
+    cmd = [settings.ffmpeg_bin, '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_path:
+        cmd += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+    cmd += ['-c', 'copy', '-movflags', '+faststart', '-y', output_path]
+    return cmd
+
+
+# Cores currently claimed by encodes in this process (see choose_encode_mode);
+# a single libx264 process at 1080x1920 keeps about this many cores busy
+_reserved_cores = 0
+SINGLE_ENCODE_CORES = 2
+
+
+@contextmanager
+def reserve_cores(count: int):
+    """Count `count` cores as busy while an encode runs."""
+    global _reserved_cores
+    _reserved_cores += count
+    try:
+        yield
+    finally:
+        _reserved_cores -= count
+
+
+def free_cores() -> int:
+    """Cores not busy with other encodes here or with load from other processes."""
+    cpu = os.cpu_count() or 1
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        load = 0.0
+    return max(0, cpu - max(_reserved_cores, round(load)))
+
+
+def choose_encode_mode(duration: Optional[float]) -> Dict[str, Any]:
+    """
+    Single libx264 process, or keyframe segments encoded in parallel?
+    Segmenting pays off only for long enough inputs with several idle cores;
+    when many uploads are transcoding at once, one process each is better.
+    Returns {'mode': 'single'|'segmented', 'segments', 'threads', 'reason'}.
+    """
+    threads = max(1, settings.transcode_segment_threads)
+    single = {'mode': 'single', 'segments': 1, 'threads': 0}
+    if not settings.transcode_segment_parallel:
+        return dict(single, reason='disabled')
+    if not duration:
+        return dict(single, reason='unknown duration')
+    length = min(duration, SHORTS_MAX_SECONDS)
+    by_length = int(length // max(1, settings.transcode_segment_min_seconds))
+    idle = free_cores()
+    segments = min(settings.transcode_segment_max, by_length, idle // threads)
+    if segments < 2:
+        return dict(single, reason=f"{length:.0f}s, {idle} free cores")
+    return {
+        'mode': 'segmented',
+        'segments': segments,
+        'threads': threads,
+        'reason': f"{length:.0f}s, {idle} free cores",
+    }
+
+
+async def encode_segmented(
+    input_path: str,
+    output_path: str,
+    info: Dict[str, Any],
+    mode: Dict[str, Any],
+    profile: Optional[str] = None
+) -> bool:
+    """
+    Encode keyframe-aligned segments concurrently (one ffmpeg process each,
+    at most mode['segments'] at a time), encode the audio alongside, then join
+    with the concat demuxer. Returns False if the input cannot be split.
+    """
+    length = min(info['duration'], SHORTS_MAX_SECONDS)
+    keyframes = await keyframe_times(input_path, length)
+    ranges = plan_segments(keyframes, length, mode['segments'], settings.transcode_segment_min_seconds)
+    if len(ranges) < 2:
+        return False
+
+    workdir = f"{output_path}.segments"
+    os.makedirs(workdir, exist_ok=True)
+    started = time.monotonic()
+
+    async def encode_part(cmd: list, label: str) -> None:
+        result = await run_command(cmd, timeout=300)
+        telemetry.add('cpu_seconds', telemetry.ffmpeg_cpu_seconds(result.stderr) or 0)
+        if result.returncode != 0:
+            raise PipelineError(f"{label} encode failed: {result.stderr[-300:]}")
+
+    try:
+        commands = [
+            (build_segment_encode_cmd(input_path, os.path.join(workdir, f"{i:03d}.mp4"), start, end, mode['threads'], profile), f"segment {i}")
+            for i, (start, end) in enumerate(ranges)
+        ]
+        audio_path = os.path.join(workdir, 'audio.m4a') if info.get('has_audio') else None
+        if audio_path:
+            commands.append((build_audio_encode_cmd(input_path, audio_path, length, profile), 'audio'))
+        # The first failure cancels the other parts (run_command kills their ffmpeg);
+        # the TaskGroup only returns once every process has exited, so the workdir
+        # and the reserved cores are freed only after that
+        with reserve_cores(len(ranges) * mode['threads']):
+            try:
+                async with asyncio.TaskGroup() as group:
+                    for cmd, label in commands:
+                        group.create_task(encode_part(cmd, label))
+            except ExceptionGroup as eg:
+                raise eg.exceptions[0]
+
+        list_path = os.path.join(workdir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            for i in range(len(ranges)):
+                f.write(f"file '{os.path.join(workdir, f'{i:03d}.mp4')}'\n")
+        joined = await run_command(build_concat_cmd(list_path, audio_path, output_path), timeout=120)
+        if joined.returncode != 0 or not os.path.exists(output_path):
+            raise PipelineError(f"segment concat failed: {joined.stderr[-300:]}")
+        telemetry.note(ffmpeg_speed=round(length / max(time.monotonic() - started, 0.001), 2))
+        telemetry.detail(transcode_mode='segmented', segments=len(ranges))
+        print(f"Segmented encode: {len(ranges)} segments x {mode['threads']} threads")
+        return True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def build_remux_cmd(input_path: str, output_path: str) -> list:
+    """Stream copy into MP4 with the moov atom up front; no decoding at all."""
+    return [
+        settings.ffmpeg_bin,
+        '-benchmark',
+        '-i', input_path,
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        '-y',
+        output_path
+    ]
+
+
+async def transform_video(
+    input_path: str,
+    output_path: str,
+    media_info: Optional[Dict[str, Any]] = None,
+    profile: Optional[str] = None
+) -> str:
     """
     Transform video to YouTube Shorts format:
     - 9:16 aspect ratio (vertical) - REQUIRED for Shorts
     - Maximum 60 seconds - STRICT limit
-    - Re-encode if needed
+    - Re-encode only if needed: sources that already are 1080x1920
+      H.264/AAC ≤60s are stream-copied (remux + faststart)
     
+    `media_info` is the stored ffprobe summary; the file is only probed
+    again when it is missing or does not match the downloaded file.
+    `profile` names the encoder settings (see media.ENCODE_PROFILES).
     Returns path to transformed file.
     """
     try:
-        # First, get video info
-        probe_cmd = [
-            settings.ffmpeg_bin.replace('ffmpeg', 'ffprobe'),
-            '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height,duration',
-            '-of', 'csv=p=0',
-            input_path
-        ]
+        info = media_info
+        if not media_info_matches_file(info, input_path):
+            info = await probe_media(input_path)
+        plan = plan_transform(info)
+        print(f"Transform plan: {plan['mode']} ({plan['reason']})")
+        telemetry.detail(transform_mode=plan['mode'])
 
-        try:
-            probe_result = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=30)
-            if probe_result.returncode != 0:
-                # If probe fails, just copy the file
-                print(f"Warning: Could not probe video (exit {probe_result.returncode}), using as-is")
-                import shutil
-                shutil.copy(input_path, output_path)
-                return output_path
-        except FileNotFoundError:
-            # ffprobe missing: fallback to copy
-            print("Warning: ffprobe not found, using input file as-is")
-            import shutil
-            shutil.copy(input_path, output_path)
-            return output_path
-        
-        # Parse probe output
-        parts = probe_result.stdout.strip().split(',')
-        if len(parts) >= 2:
-            width = int(parts[0])
-            height = int(parts[1])
-        else:
-            # Default to copying
+        if plan['mode'] == 'copy':
+            # Probe failed or no video stream: use the file as-is
             import shutil
-            shutil.copy(input_path, output_path)
+            await asyncio.to_thread(shutil.copy, input_path, output_path)
             return output_path
-        
-        # Build ffmpeg command
-        # Ensure 9:16 aspect ratio, max 60 seconds, reasonable quality
-        cmd = [
-            settings.ffmpeg_bin,
-            '-i', input_path,
-            '-t', '60',  # Max 60 seconds
-            '-vf', 'scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2',
-            '-c:v', 'libx264',
-            '-preset', 'medium',
-            '-crf', '23',
-            '-c:a', 'aac',
-            '-b:a', '128k',
-            '-movflags', '+faststart',
-            '-y',  # Overwrite output
-            output_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+
+        if plan['mode'] == 'remux':
+            result = await run_command(build_remux_cmd(input_path, output_path), timeout=120)
+            telemetry.record_ffmpeg(result.stderr)
+            if result.returncode == 0 and os.path.exists(output_path):
+                return output_path
+            print(f"Warning: remux failed (exit {result.returncode}), falling back to full encode")
+            telemetry.detail(transform_mode='encode')
+
+        telemetry.detail(encode_profile=resolve_encode_profile(profile))
+        mode = choose_encode_mode(info.get('duration'))
+        print(f"Encode mode: {mode['mode']} ({mode['reason']})")
+        if mode['mode'] == 'segmented':
+            try:
+                if await encode_segmented(input_path, output_path, info, mode, profile):
+                    return output_path
+            except (PipelineError, subprocess.TimeoutExpired) as e:
+                print(f"Warning: segmented encode failed, falling back to a single process: {e}")
+
+        with reserve_cores(SINGLE_ENCODE_CORES):
+            result = await run_command(build_encode_cmd(input_path, output_path, profile), timeout=300)
+        telemetry.record_ffmpeg(result.stderr)
         
         if result.returncode != 0:
             raise PipelineError(f"ffmpeg failed: {result.stderr}")
@@ -273,6 +553,40 @@ def transform_video(input_path: str, output_path: str) -> str:
         raise PipelineError(f"Transform error: {str(e)}")
 
 
+async def stream_transform(video_id: str, output_path: str, profile: Optional[str] = None) -> str:
+    """
+    Piped mode for YouTube sources: yt-dlp writes to stdout and ffmpeg encodes
+    from stdin, so there is no raw file on disk and encoding starts with the
+    first bytes. Containers that need seeking (MP4 with the moov atom at the
+    end) fail here; callers then fall back to download_video + transform_video.
+    """
+    import random
+
+    ytdlp_cmd = build_ytdlp_cmd(video_id, '-', random.choice(ytdlp_user_agents()))
+    await acquire_youtube_token()
+    telemetry.add('ytdlp_attempts', 1)
+    telemetry.detail(encode_profile=resolve_encode_profile(profile))
+    try:
+        producer, consumer = await run_piped(ytdlp_cmd, build_encode_cmd('pipe:0', output_path, profile), timeout=600)
+    except subprocess.TimeoutExpired:
+        raise PipelineError("Streamed transform timeout (10 minutes)")
+    telemetry.record_ffmpeg(consumer.stderr)
+
+    # ffmpeg stops reading after -t 60, so yt-dlp may die of a broken pipe;
+    # that is only an error if ffmpeg did not finish either.
+    producer_ok = producer.returncode == 0 or 'Broken pipe' in (producer.stderr or '')
+    if consumer.returncode == 0 and producer_ok and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        return output_path
+
+    cleanup_files(output_path)
+    if is_rate_limited(producer.stderr or ''):
+        await report_rate_limited()
+    raise PipelineError(
+        f"Streamed transform failed (yt-dlp exit {producer.returncode}, ffmpeg exit {consumer.returncode}): "
+        f"{(producer.stderr or '')[-300:]} {(consumer.stderr or '')[-300:]}"
+    )
+
+
 def cleanup_files(*file_paths: str) -> None:
     """Delete temporary files. ALWAYS called."""
     for path in file_paths:
@@ -284,6 +598,178 @@ def cleanup_files(*file_paths: str) -> None:
             print(f"⚠️ Warning: Could not delete {path}: {e}")
 
 
+def pipeline_paths(run_id: str) -> Tuple[str, str]:
+    """Temp file paths (raw download, final transform) for a run."""
+    temp_dir = Path(settings.temp_dir)
+    temp_dir.mkdir(exist_ok=True)
+    return (
+        str(temp_dir / f"{run_id}_raw.mp4"),
+        str(temp_dir / f"{run_id}_final.mp4"),
+    )
+
+
+async def stage_download(
+    run_id: str,
+    source_video_id: str,
+    download_path: str,
+    duration_seconds: Optional[int] = None
+) -> str:
+    """Pipeline stage 1: fetch the source video (network-bound)."""
+    print(f"[{run_id}] Downloading...")
+    await download_video(source_video_id, download_path, duration_seconds=duration_seconds)
+    print(f"[{run_id}] Downloaded to {download_path}")
+    return download_path
+
+
+async def stage_transform(
+    run_id: str,
+    download_path: str,
+    transform_path: str,
+    media_info: Optional[Dict[str, Any]] = None,
+    profile: Optional[str] = None
+) -> str:
+    """Pipeline stage 2: convert to Shorts format (CPU-bound)."""
+    print(f"[{run_id}] Transforming...")
+    await transform_video(download_path, transform_path, media_info=media_info, profile=profile)
+    print(f"[{run_id}] Transformed to {transform_path}")
+    return transform_path
+
+
+async def stage_stream_transform(
+    run_id: str,
+    source_video_id: str,
+    transform_path: str,
+    profile: Optional[str] = None
+) -> str:
+    """Pipeline stages 1+2 in one go: yt-dlp piped into ffmpeg, no raw file."""
+    print(f"[{run_id}] Streaming download into transform...")
+    await stream_transform(source_video_id, transform_path, profile=profile)
+    print(f"[{run_id}] Transformed to {transform_path}")
+    return transform_path
+
+
+async def _upload_session_hooks(run_id: str, upload_id: UUID, transform_path: str):
+    """
+    Load a previous session for this upload (only if the file is byte-identical)
+    and build the thread-side callback that persists session progress.
+    """
+    loop = asyncio.get_running_loop()
+    total_bytes = os.path.getsize(transform_path)
+    content_sha256 = await asyncio.to_thread(file_sha256, transform_path)
+
+    resume = None
+    try:
+        session = await models.get_upload_session(upload_id)
+        if session and (session['content_sha256'], session['total_bytes']) == (content_sha256, total_bytes):
+            resume = session
+            print(f"[{run_id}] Found upload session at byte {session['offset_bytes']}/{total_bytes}")
+        elif session:
+            print(f"[{run_id}] Transformed file changed since the last attempt, starting a new upload session")
+            await models.delete_upload_session(upload_id)
+    except Exception as e:
+        print(f"[{run_id}] Warning: Could not load upload session: {e}")
+
+    def on_progress(session_uri: str, offset_bytes: int, chunk_size: int) -> None:
+        # Runs in the upload thread; a lost update only costs re-sending one chunk
+        try:
+            asyncio.run_coroutine_threadsafe(
+                models.save_upload_session(upload_id, session_uri, offset_bytes, total_bytes, content_sha256, chunk_size),
+                loop
+            ).result(timeout=15)
+        except Exception as e:
+            print(f"[{run_id}] Warning: Could not save upload session: {e}")
+
+    return resume, on_progress
+
+
+def _timed_upload_video(*args, **kwargs) -> Dict[str, Any]:
+    """upload_video plus the upload thread's CPU time for telemetry."""
+    started = time.thread_time()
+    try:
+        return upload_video(*args, **kwargs)
+    finally:
+        telemetry.add('cpu_seconds', time.thread_time() - started)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def stage_upload(
+    run_id: str,
+    youtube_client,
+    source_video_id: str,
+    transform_path: str,
+    title: str,
+    description: str,
+    tags: list,
+    privacy_status: str = None,
+    upload_id: Optional[UUID] = None
+) -> Dict[str, Any]:
+    """
+    Pipeline stage 3: publish to YouTube (bandwidth-bound) and drop the user source.
+    With an upload_id the resumable session is persisted after every chunk, and a
+    retry with the same bytes continues from the offset YouTube confirmed.
+    """
+    privacy = privacy_status or settings.upload_visibility
+
+    resume = None
+    on_progress = None
+    if upload_id:
+        resume, on_progress = await _upload_session_hooks(run_id, upload_id, transform_path)
+
+    print(f"[{run_id}] Uploading to YouTube...")
+    started = time.monotonic()
+    # googleapiclient is synchronous; keep the chunked upload off the event loop
+    result = await asyncio.to_thread(
+        _timed_upload_video,
+        youtube_client,
+        transform_path,
+        title,
+        description,
+        tags,
+        privacy_status=privacy,
+        resume=resume,
+        on_progress=on_progress
+    )
+    if result['resumed_from']:
+        print(f"[{run_id}] Resumed upload saved {result['resumed_from']} bytes")
+    total_bytes = os.path.getsize(transform_path)
+    sent_bytes = total_bytes - result['resumed_from']
+    telemetry.note(
+        bytes_in=total_bytes,
+        bytes_out=sent_bytes,
+        upload_bytes_per_second=sent_bytes / max(time.monotonic() - started, 0.001)
+    )
+    print(f"[{run_id}] Uploaded: {result['url']}")
+    if upload_id:
+        try:
+            await models.delete_upload_session(upload_id)
+        except Exception as e:
+            print(f"[{run_id}] Warning: Could not clear upload session: {e}")
+
+    # Post-upload: auto-clean user source from Supabase Storage
+    if source_video_id.startswith('user:'):
+        storage_path = source_video_id.split(':', 1)[1]
+        try:
+            await storage.delete_object(storage_path)
+            print(f"[{run_id}] Supabase object deleted: {storage_path}")
+        except Exception as ce:
+            print(f"[{run_id}] Warning: Supabase cleanup error: {ce}")
+
+    return {
+        'success': True,
+        'run_id': run_id,
+        'video_id': result['video_id'],
+        'url': result['url'],
+        'title': result['title']
+    }
+
+
 async def execute_pipeline(
     youtube_client,
     source_video_id: str,
@@ -302,66 +788,22 @@ async def execute_pipeline(
     Returns upload result with video_id.
     """
     run_id = str(uuid.uuid4())
-    privacy = privacy_status or settings.upload_visibility
-    
-    # Generate temp file paths
-    temp_dir = Path(settings.temp_dir)
-    temp_dir.mkdir(exist_ok=True)
-    
-    download_path = str(temp_dir / f"{run_id}_raw.mp4")
-    transform_path = str(temp_dir / f"{run_id}_final.mp4")
+    download_path, transform_path = pipeline_paths(run_id)
     
     try:
         print(f"[{run_id}] Starting pipeline for video {source_video_id}")
-        
-        # Step 1: Download
-        print(f"[{run_id}] Downloading...")
-        download_video(source_video_id, download_path)
-        print(f"[{run_id}] Downloaded to {download_path}")
-        
-        # Step 2: Transform
-        print(f"[{run_id}] Transforming...")
-        transform_video(download_path, transform_path)
-        print(f"[{run_id}] Transformed to {transform_path}")
-        
-        # Step 3: Upload
-        print(f"[{run_id}] Uploading to YouTube...")
-        result = upload_video(
+        await stage_download(run_id, source_video_id, download_path)
+        await stage_transform(run_id, download_path, transform_path)
+        return await stage_upload(
+            run_id,
             youtube_client,
+            source_video_id,
             transform_path,
             title,
             description,
             tags,
-            privacy_status=privacy
+            privacy_status=privacy_status
         )
-        print(f"[{run_id}] Uploaded: {result['url']}")
-        
-        # Post-upload: auto-clean user source from Supabase Storage
-        if source_video_id.startswith('user:'):
-            try:
-                import httpx
-                storage_path = source_video_id.split(':', 1)[1]
-                delete_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/{settings.supabase_bucket}/{storage_path}"
-                headers = {
-                    "Authorization": f"Bearer {settings.supabase_service_role}",
-                    "apikey": settings.supabase_service_role,
-                }
-                with httpx.Client(timeout=30) as client:
-                    resp = client.delete(delete_url, headers=headers)
-                    if resp.status_code not in (200, 204):
-                        print(f"[{run_id}] Warning: Supabase delete failed {resp.status_code}: {resp.text}")
-                    else:
-                        print(f"[{run_id}] Supabase object deleted: {storage_path}")
-            except Exception as ce:
-                print(f"[{run_id}] Warning: Supabase cleanup error: {ce}")
-        
-        return {
-            'success': True,
-            'run_id': run_id,
-            'video_id': result['video_id'],
-            'url': result['url'],
-            'title': result['title']
-        }
     
     except Exception as e:
         print(f"[{run_id}] Pipeline error: {e}")
@@ -372,4 +814,3 @@ async def execute_pipeline(
         print(f"[{run_id}] Cleaning up...")
         cleanup_files(download_path, transform_path)
         print(f"[{run_id}] ✅ Files deleted. NO local storage used.")
-
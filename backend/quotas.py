@@ -1,7 +1,7 @@
 """
 Quota rotation and tracking for YouTube API projects.
 """
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from uuid import UUID
 import models
 
@@ -24,6 +24,19 @@ async def pick_project_for_upload() -> Optional[Dict[str, Any]]:
     return None
 
 
+async def reserve_upload_quota(exclude: Optional[List[UUID]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Atomically charge one upload to a project with enough quota (skipping
+    `exclude`). Returns the project or None if all are exhausted. Call
+    release_upload_quota if the upload does not go through.
+    """
+    return await models.reserve_project_quota(UPLOAD_COST, exclude)
+
+
+async def release_upload_quota(project_id: UUID) -> None:
+    await models.release_project_quota(project_id, UPLOAD_COST)
+
+
 async def track_quota_usage(project_id: UUID, cost: int = UPLOAD_COST) -> None:
     """
     Track quota usage for a project.
@@ -0,0 +1,102 @@
+"""
+Shared token-bucket rate limiting for YouTube source downloads.
+The bucket lives in Postgres (rate_limit_buckets), so every worker process and
+replica draws from the same request budget; a 429 penalizes the bucket and slows
+all downloads down together. If the database is unreachable, a process-local
+bucket with the same parameters is used instead.
+"""
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+from deps import settings
+import models
+
+
+class LocalTokenBucket:
+    """In-memory token bucket (fallback when Postgres is unavailable)."""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.penalty_until = 0.0
+
+    def take(self, cost: float) -> Dict[str, Any]:
+        now = time.monotonic()
+        if now < self.penalty_until:
+            return {'granted': False, 'wait_seconds': self.penalty_until - now, 'tokens': self.tokens}
+        # No refill while penalized
+        elapsed = now - max(self.updated_at, self.penalty_until)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return {'granted': True, 'wait_seconds': 0.0, 'tokens': self.tokens}
+        wait = (cost - self.tokens) / self.refill_per_second if self.refill_per_second > 0 else 60.0
+        return {'granted': False, 'wait_seconds': wait, 'tokens': self.tokens}
+
+    def penalize(self, seconds: float) -> None:
+        self.tokens = min(self.tokens, 0.0)
+        self.penalty_until = max(self.penalty_until, time.monotonic() + seconds)
+
+
+class SharedTokenBucket:
+    """Cross-replica token bucket backed by a Postgres row."""
+
+    def __init__(self, name: str, capacity: float, refill_per_second: float, penalty_seconds: float):
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.penalty_seconds = penalty_seconds
+        self._local = LocalTokenBucket(capacity, refill_per_second)
+
+    async def _take(self, cost: float) -> Dict[str, Any]:
+        try:
+            return await models.take_rate_limit_tokens(self.name, cost, self.capacity, self.refill_per_second)
+        except Exception as e:
+            print(f"[ratelimit] Shared bucket '{self.name}' unavailable, using local bucket: {e}")
+            return self._local.take(cost)
+
+    async def acquire(self, cost: float = 1.0) -> float:
+        """Wait until `cost` tokens are available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            result = await self._take(cost)
+            if result['granted']:
+                if waited:
+                    print(f"[ratelimit] '{self.name}' granted after waiting {waited:.1f}s")
+                return waited
+            # Small jitter so replicas do not wake up in lockstep
+            delay = min(result['wait_seconds'], 60.0) + random.uniform(0, 0.5)
+            await asyncio.sleep(delay)
+            waited += delay
+
+    async def penalize(self, seconds: Optional[float] = None) -> None:
+        """Drain the bucket and pause it for everyone (e.g. after HTTP 429)."""
+        seconds = self.penalty_seconds if seconds is None else seconds
+        print(f"[ratelimit] '{self.name}' penalized for {seconds:.0f}s")
+        self._local.penalize(seconds)
+        try:
+            await models.penalize_rate_limit(self.name, seconds)
+        except Exception as e:
+            print(f"[ratelimit] Could not penalize shared bucket '{self.name}': {e}")
+
+
+_youtube_bucket: Optional[SharedTokenBucket] = None
+
+
+def get_youtube_bucket() -> Optional[SharedTokenBucket]:
+    """Bucket for yt-dlp requests to YouTube (None when disabled)."""
+    global _youtube_bucket
+    if not settings.ytdlp_rate_limit_enabled:
+        return None
+    if _youtube_bucket is None:
+        _youtube_bucket = SharedTokenBucket(
+            'youtube_download',
+            capacity=settings.ytdlp_rate_limit_burst,
+            refill_per_second=settings.ytdlp_rate_limit_per_minute / 60.0,
+            penalty_seconds=settings.ytdlp_rate_limit_penalty_seconds,
+        )
+    return _youtube_bucket
@@ -5,9 +5,10 @@ from uuid import UUID
 from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
 import models
+from media import ingest_media_info
 from roblox_generator import RobloxGeneratorClient
 
-UPLOAD_STATUS_ACTIVE = ["scheduled", "retry", "uploading"]
+UPLOAD_STATUS_ACTIVE = ["scheduled", "prepared", "retry", "uploading"]
 PROJECT_STATUSES_READY = ["completed"]
 PROJECT_STATUSES_IN_PROGRESS = ["generating", "processing"]
 RESCHEDULE_LOOKAHEAD_DAYS = 120
@@ -269,6 +270,7 @@ async def ensure_daily_roblox_video(now: datetime) -> None:
                 theme_slug="roblox",
                 source_platform="generator",
             )
+            await ingest_media_info(video_record["id"], source_id)
 
             description = "Susbcribete! #pov #roblox"
             default_tags = ["#pov", "#roblox"]
@@ -1,102 +1,471 @@
 """
 Job scheduler for processing uploads.
 """
-from datetime import datetime
-from typing import List, Dict, Any
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta, time as time_cls, timezone
+from typing import List, Dict, Any, Optional
 from uuid import UUID
+import uuid
 import models
 from youtube_oauth import get_authorized_youtube_client, TokenRefreshError
-from pipeline import execute_pipeline, PipelineError
-from quotas import pick_project_for_upload, track_quota_usage
+from pipeline import (
+    PipelineError,
+    pipeline_paths,
+    stage_download,
+    stage_transform,
+    stage_stream_transform,
+    stage_upload,
+    cleanup_files,
+    transform_params,
+)
+from executor import build_executor
+from dispatcher import FairDispatcher
+from transcode_cache import get_transcode_cache, get_staging_area, TranscodeCache
+from media import (
+    media_info_matches_file,
+    probe_and_store,
+    parse_storage_ref,
+    plan_transform,
+    resolve_encode_profile,
+)
+from deps import settings, WORKER_ID
+from ytdlp_engine import engine_enabled
+from quotas import reserve_upload_quota, release_upload_quota
+from telemetry import tracked
+import telemetry
+import single_flight
 import traceback
 
 
-async def select_due_uploads(limit: int = 10) -> List[Dict[str, Any]]:
+class UploadSkipped(Exception):
+    """Raised by a stage when an upload must stop early with a ready-made result."""
+
+    def __init__(self, result: Dict[str, Any]):
+        self.result = result
+        super().__init__(result.get('error', 'Upload skipped'))
+
+
+# Retry backoff per error class: (base, cap) in seconds, doubled per attempt
+RETRY_BACKOFF = {
+    'bot_check': (1800, 6 * 3600),      # yt-dlp needs fresh cookies; hammering makes it worse
+    'rate_limited': (600, 3 * 3600),    # HTTP 429 / YouTube rate or quota limits
+    'unavailable': (3600, 24 * 3600),   # private/removed video; rarely comes back
+    'transient': (60, 1800),            # network hiccups, ffmpeg, storage
+}
+
+
+def classify_upload_error(exc: Exception) -> str:
+    """Map a pipeline failure to a RETRY_BACKOFF class."""
+    message = str(exc).lower()
+    status = getattr(getattr(exc, 'resp', None), 'status', None)
+    if 'bot check' in message or 'sign in to confirm' in message:
+        return 'bot_check'
+    if status == 429 or 'http error 429' in message or 'rate limit' in message or 'ratelimitexceeded' in message or 'quotaexceeded' in message:
+        return 'rate_limited'
+    if 'is unavailable' in message or 'video unavailable' in message or 'private video' in message:
+        return 'unavailable'
+    return 'transient'
+
+
+def retry_delay(error_class: str, attempt: int) -> float:
+    """Exponential backoff with equal jitter: half the delay fixed, half random."""
+    base, cap = RETRY_BACKOFF.get(error_class, RETRY_BACKOFF['transient'])
+    delay = min(cap, base * 2 ** max(0, attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def plan_batch(limit: int = 10) -> Dict[str, List[Dict[str, Any]]]:
     """
-    Select uploads that are ready to process.
+    Plan one tick: claim due uploads (they become 'uploading' under this
+    worker's lease, so other worker replicas skip them) and list 'pending'
+    uploads that are not due yet. Each carries its account's scheduled_today.
     """
-    now = datetime.utcnow()
-    uploads = await models.select_due_uploads(now, limit)
-    return uploads
+    now = datetime.now(timezone.utc)
+    today_start = datetime.combine(now.date(), time_cls(0, 0, 0), tzinfo=timezone.utc)
+    rows = await models.plan_due_uploads(
+        now,
+        today_start,
+        limit,
+        WORKER_ID,
+        timedelta(seconds=settings.upload_lease_seconds)
+    )
+    return {
+        'due': [row for row in rows if row['plan_action'] == 'run'],
+        'early': [row for row in rows if row['plan_action'] == 'early'],
+    }
 
 
-async def process_upload(upload: Dict[str, Any]) -> Dict[str, Any]:
+async def select_due_uploads(limit: int = 10) -> List[Dict[str, Any]]:
+    """Claim uploads that are ready to process."""
+    return (await plan_batch(limit))['due']
+
+
+def new_upload_job(upload: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-upload state carried through the pipeline stages."""
+    run_id = str(uuid.uuid4())
+    download_path, transform_path = pipeline_paths(run_id)
+    # Encoder profile: account override, then theme, then ENCODE_PROFILE
+    profile = resolve_encode_profile(upload.get('encode_profile'))
+    return {
+        'upload': upload,
+        'run_id': run_id,
+        'download_path': download_path,
+        'transform_path': transform_path,
+        'project': None,
+        'quota_checked': False,
+        'published': False,
+        'youtube': None,
+        'media_info': None,
+        'profile': profile,
+        'cache_key': TranscodeCache.make_key(upload['source_video_id'], transform_params(profile)),
+        'cache_hit': False,
+        'stream': False,
+        'flight': None,
+    }
+
+
+@tracked('download')
+async def prepare_and_download(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 1: reserve quota, mark as uploading, authorize and download the source."""
+    upload = job['upload']
+    upload_id = upload['id']
+    run_id = job['run_id']
+
+    print(f"[{run_id}] Processing upload {upload_id}")
+    if 'dispatch_lag_seconds' in job:
+        telemetry.detail(dispatch_lag_seconds=round(job['dispatch_lag_seconds'], 3))
+
+    # Quota is normally reserved at admission (reserve_quota); charge it here otherwise
+    if not job['quota_checked']:
+        job['project'] = await reserve_upload_quota()
+        job['quota_checked'] = True
+    if not job['project']:
+        error = "No API projects with available quota"
+        print(f"[{run_id}] {error}")
+        telemetry.note(status='skipped')
+        await models.update_roblox_project_status_by_upload(upload_id, 'paused')
+        await models.update_upload_status(
+            upload_id,
+            status='paused',
+            run_id=run_id,
+            error=error
+        )
+        raise UploadSkipped({
+            'success': False,
+            'upload_id': upload_id,
+            'error': error,
+            'should_retry': False
+        })
+
+    # Update status to uploading
+    await models.update_upload_status(
+        upload_id,
+        status='uploading',
+        run_id=run_id
+    )
+
+    # Get authorized YouTube client
+    job['youtube'], _ = await get_authorized_youtube_client(upload['account_id'])
+
+    # Prefetched ahead of scheduled_for: only the YouTube upload remains
+    staging = get_staging_area()
+    if staging and staging.fetch(str(upload_id), job['transform_path']):
+        job['cache_hit'] = True
+        telemetry.detail(staged=True)
+        print(f"[{run_id}] Using prepared file for upload {upload_id}, skipping download/transform")
+        return job
+
+    return await fetch_source(job)
+
+
+async def fetch_source(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the source ready for transcode: cache hit, streamed, or downloaded."""
+    upload = job['upload']
+    run_id = job['run_id']
+
+    # Same source + same transform already produced (other account or a retry)
+    if _fetch_from_cache(job):
+        return job
+
+    # Same source + same transform being produced right now by another upload
+    flight, leader = single_flight.join(job['cache_key'])
+    if not leader:
+        print(f"[{run_id}] {upload['source_video_id']} is already being prepared by another upload, waiting...")
+        if await single_flight.wait_for_artifact(flight, job['transform_path']):
+            job['cache_hit'] = True
+            telemetry.detail(coalesced=True)
+            print(f"[{run_id}] Reusing the other upload's transform")
+            return job
+        print(f"[{run_id}] Other upload did not produce a transform, fetching it here")
+    else:
+        job['flight'] = flight
+        if flight and await single_flight.lock_across_replicas(flight) and _fetch_from_cache(job):
+            # Another replica finished it while we waited for its claim
+            return job
+
+    # ffprobe metadata stored at ingest (or by a previous attempt)
+    job['media_info'] = await models.get_video_media_info(upload['video_id'])
+
+    print(f"[{run_id}] Starting pipeline for video {upload['source_video_id']}")
+    if should_stream(upload['source_video_id'], job['media_info']):
+        # yt-dlp will feed ffmpeg directly in the transcode stage
+        job['stream'] = True
+        telemetry.detail(streamed=True)
+        return job
+    await stage_download(
+        run_id,
+        upload['source_video_id'],
+        job['download_path'],
+        duration_seconds=upload.get('duration_seconds')
+    )
+    _note_file_bytes(bytes_in=job['download_path'], bytes_out=job['download_path'])
+    return job
+
+
+@tracked('download')
+async def prefetch_source(job: Dict[str, Any]) -> Dict[str, Any]:
+    """fetch_source as its own telemetry stage, for prefetch runs."""
+    telemetry.detail(prefetch=True)
+    return await fetch_source(job)
+
+
+async def prepare_upload_ahead(upload: Dict[str, Any]) -> bool:
     """
-    Process a single upload job.
-    Returns result with success status.
+    Prefetch stage: download and transcode an upload before scheduled_for into
+    the staging area and mark it 'prepared'. No quota or OAuth is used here.
+    Failures only cost the head start; the upload is processed normally when due.
     """
+    staging = get_staging_area()
+    job = new_upload_job(upload)
+    run_id = job['run_id']
     upload_id = upload['id']
-    account_id = upload['account_id']
-    source_video_id = upload['source_video_id']
-    
-    import uuid
-    run_id = str(uuid.uuid4())
-    
+    print(f"[{run_id}] Preparing upload {upload_id} (scheduled for {upload['scheduled_for']})")
     try:
-        print(f"[{run_id}] Processing upload {upload_id}")
-        
-        # Check quota availability
-        project = await pick_project_for_upload()
-        if not project:
-            error = "No API projects with available quota"
-            print(f"[{run_id}] {error}")
-            await models.update_roblox_project_status_by_upload(upload_id, 'paused')
-            await models.update_upload_status(
-                upload_id,
-                status='paused',
-                run_id=run_id,
-                error=error
+        await prefetch_source(job)
+        await transcode(job)
+        if not staging.store(str(upload_id), job['transform_path']):
+            print(f"[{run_id}] Staging area full, upload {upload_id} will be processed when due")
+            return False
+        if not await models.mark_upload_prepared(upload_id, run_id):
+            # Rescheduled, paused or deleted meanwhile
+            staging.discard(str(upload_id))
+            return False
+        print(f"[{run_id}] Upload {upload_id} prepared")
+        return True
+    except Exception as e:
+        print(f"[{run_id}] Prefetch failed for upload {upload_id}, will retry when due: {e}")
+        return False
+    finally:
+        await _finish_flight(job)
+        release_job_files(job)
+
+
+async def prepare_upcoming(limit: int = 3) -> Dict[str, Any]:
+    """Claim uploads due within the lookahead window and prepare them."""
+    staging = get_staging_area()
+    if not staging:
+        return {'claimed': 0, 'prepared': 0}
+    staging.sweep()
+    now = datetime.now(timezone.utc)
+    uploads = await models.claim_uploads_to_prepare(
+        now,
+        now + timedelta(minutes=settings.prefetch_lookahead_minutes),
+        limit
+    )
+    prepared = 0
+    for upload in uploads:
+        if await prepare_upload_ahead(upload):
+            prepared += 1
+    return {'claimed': len(uploads), 'prepared': prepared, 'staging': staging.stats()}
+
+
+def _fetch_from_cache(job: Dict[str, Any]) -> bool:
+    cache = get_transcode_cache()
+    if cache and cache.fetch(job['cache_key'], job['transform_path']):
+        job['cache_hit'] = True
+        telemetry.detail(cache_hit=True)
+        print(f"[{job['run_id']}] Transcode cache hit for {job['upload']['source_video_id']}, skipping download/transform")
+        return True
+    return False
+
+
+def should_stream(source_video_id: str, media_info: Dict[str, Any]) -> bool:
+    """
+    Pipe YouTube sources into ffmpeg unless the stored probe says the source
+    can simply be remuxed (that needs the file anyway).
+    """
+    if not settings.pipeline_stream_downloads or parse_storage_ref(source_video_id):
+        return False
+    if engine_enabled():
+        # The in-process engine reuses cached extractions; piping needs the binary
+        return False
+    return not media_info or plan_transform(media_info)['mode'] != 'remux'
+
+
+def _note_file_bytes(**paths: str) -> None:
+    """Record file sizes as stage telemetry (e.g. bytes_in=<path>)."""
+    for name, path in paths.items():
+        try:
+            telemetry.note(**{name: os.path.getsize(path)})
+        except OSError:
+            pass
+
+
+@tracked('transcode')
+async def transcode(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 2: convert the downloaded source to Shorts format."""
+    if job['cache_hit']:
+        telemetry.detail(cache_hit=True)
+        await _finish_flight(job, job['transform_path'])
+        return job
+    if job['stream']:
+        try:
+            await stage_stream_transform(
+                job['run_id'],
+                job['upload']['source_video_id'],
+                job['transform_path'],
+                profile=job['profile']
             )
-            return {
-                'success': False,
-                'upload_id': upload_id,
-                'error': error,
-                'should_retry': False
-            }
-        
-        # Update status to uploading
-        await models.update_upload_status(
-            upload_id,
-            status='uploading',
-            run_id=run_id
-        )
-        
-        # Get authorized YouTube client
-        youtube, _ = await get_authorized_youtube_client(account_id)
-        
-        # Execute pipeline
-        result = await execute_pipeline(
-            youtube,
-            source_video_id,
+            telemetry.detail(streamed=True)
+            _note_file_bytes(bytes_out=job['transform_path'])
+            await _transcode_done(job)
+            return job
+        except PipelineError as e:
+            print(f"[{job['run_id']}] Streamed transform failed, falling back to file download: {e}")
+            job['stream'] = False
+            await stage_download(
+                job['run_id'],
+                job['upload']['source_video_id'],
+                job['download_path'],
+                duration_seconds=job['upload'].get('duration_seconds')
+            )
+    if not media_info_matches_file(job['media_info'], job['download_path']):
+        # First download of this source (or a different rendition): probe once and keep it
+        job['media_info'] = await probe_and_store(job['upload']['video_id'], job['download_path'])
+    await stage_transform(
+        job['run_id'],
+        job['download_path'],
+        job['transform_path'],
+        media_info=job['media_info'],
+        profile=job['profile']
+    )
+    _note_file_bytes(bytes_in=job['download_path'], bytes_out=job['transform_path'])
+    await _transcode_done(job)
+    return job
+
+
+async def _transcode_done(job: Dict[str, Any]) -> None:
+    """Cache the result, then hand it to uploads coalesced on this one."""
+    cache = get_transcode_cache()
+    if cache:
+        cache.store(job['cache_key'], job['transform_path'])
+    await _finish_flight(job, job['transform_path'])
+
+
+async def _finish_flight(job: Dict[str, Any], transform_path: str = None) -> None:
+    """Leader only, once: share transform_path (None = failed) and release the claim."""
+    await single_flight.finish(job.pop('flight', None), transform_path)
+
+
+@tracked('upload')
+async def publish(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 3: upload to YouTube (quota was reserved at admission) and mark the upload as done."""
+    upload = job['upload']
+    upload_id = upload['id']
+    run_id = job['run_id']
+
+    try:
+        result = await stage_upload(
+            run_id,
+            job['youtube'],
+            upload['source_video_id'],
+            job['transform_path'],
             upload['title'],
             upload['description'],
-            upload['tags'] or []
-        )
-        
-        # Track quota usage
-        await track_quota_usage(project['id'])
-        
-        # Update status to done
-        await models.update_upload_status(
-            upload_id,
-            status='done',
-            run_id=run_id,
-            youtube_video_id=result['video_id']
+            upload['tags'] or [],
+            upload_id=upload_id
         )
-        await models.update_roblox_project_status_by_upload(upload_id, 'uploaded')
-        
-        print(f"[{run_id}] Upload {upload_id} completed: {result['url']}")
-        
-        return {
-            'success': True,
-            'upload_id': upload_id,
-            'youtube_video_id': result['video_id'],
-            'url': result['url']
-        }
-    
-    except TokenRefreshError as e:
+    finally:
+        release_job_files(job)
+    job['published'] = True
+
+    staging = get_staging_area()
+    if staging:
+        staging.discard(str(upload_id))
+
+    # Update status to done
+    await models.update_upload_status(
+        upload_id,
+        status='done',
+        run_id=run_id,
+        youtube_video_id=result['video_id']
+    )
+    await models.update_roblox_project_status_by_upload(upload_id, 'uploaded')
+
+    print(f"[{run_id}] Upload {upload_id} completed: {result['url']}")
+
+    return {
+        'success': True,
+        'upload_id': upload_id,
+        'youtube_video_id': result['video_id'],
+        'url': result['url']
+    }
+
+
+def release_job_files(job: Dict[str, Any]) -> None:
+    """ALWAYS delete the run's temp files (even if error)."""
+    run_id = job['run_id']
+    print(f"[{run_id}] Cleaning up...")
+    cleanup_files(job['download_path'], job['transform_path'])
+    print(f"[{run_id}] ✅ Files deleted. NO local storage used.")
+
+
+async def reserve_quota(job: Dict[str, Any], full_projects: List[str]) -> Optional[str]:
+    """
+    Dispatcher admission: charge the upload to a project with quota that is not
+    at its in-flight cap. Returns the project id (the dispatcher's cap key).
+    """
+    try:
+        job['project'] = await reserve_upload_quota([UUID(project) for project in full_projects])
+    except Exception as e:
+        # prepare_and_download tries again and fails the upload properly
+        print(f"[{job['run_id']}] Warning: Could not reserve quota at admission: {e}")
+        return None
+    job['quota_checked'] = True
+    return str(job['project']['id']) if job['project'] else None
+
+
+async def _release_quota(job: Dict[str, Any]) -> None:
+    """Give back the reservation of an upload that did not reach YouTube."""
+    project = job.get('project')
+    if not project or job['published']:
+        return
+    job['project'] = None
+    try:
+        await release_upload_quota(project['id'])
+    except Exception as e:
+        print(f"[{job['run_id']}] Warning: Could not release reserved quota on {project['id']}: {e}")
+
+
+async def handle_upload_error(job: Dict[str, Any], exc: Exception, stage: str = None) -> Dict[str, Any]:
+    """Turn a stage failure into a status update and a result dict."""
+    upload = job['upload']
+    upload_id = upload['id']
+    account_id = upload['account_id']
+    run_id = job['run_id']
+
+    await _finish_flight(job)
+    release_job_files(job)
+    await _release_quota(job)
+
+    if isinstance(exc, UploadSkipped):
+        return exc.result
+
+    if isinstance(exc, TokenRefreshError):
         friendly_error = "Token expirado o revocado. Reconecta la cuenta para reanudar los uploads."
-        await models.flag_account_for_reconnect(account_id, e.code, str(e))
+        await models.flag_account_for_reconnect(account_id, exc.code, str(exc))
         await models.update_roblox_project_status_by_upload(upload_id, 'paused')
         await models.update_upload_status(
             upload_id,
@@ -112,92 +481,95 @@ async def process_upload(upload: Dict[str, Any]) -> Dict[str, Any]:
             'retry_count': upload.get('retry_count', 0)
         }
 
-    except PipelineError as e:
-        error = f"Pipeline error: {str(e)}"
-        print(f"[{run_id}] {error}")
-        
-        # Increment retry count
-        retry_count = await models.increment_upload_retry(upload_id)
-        
-        if retry_count >= upload.get('max_retries', 3):
-            # Max retries exceeded
-            await models.update_upload_status(
-                upload_id,
-                status='failed',
-                run_id=run_id,
-                error=error
-            )
-            should_retry = False
-            await models.update_roblox_project_status_by_upload(upload_id, 'failed')
-        else:
-            # Schedule retry
-            await models.update_upload_status(
-                upload_id,
-                status='retry',
-                run_id=run_id,
-                error=error
-            )
-            should_retry = True
-            await models.update_roblox_project_status_by_upload(upload_id, 'retry')
-        
-        return {
-            'success': False,
-            'upload_id': upload_id,
-            'error': error,
-            'should_retry': should_retry,
-            'retry_count': retry_count
-        }
-    
+    if isinstance(exc, PipelineError):
+        error = f"Pipeline error: {str(exc)}"
+    else:
+        error = f"Unexpected error: {str(exc)}\n{''.join(traceback.format_exception(exc))}"
+    print(f"[{run_id}] {error}")
+
+    # Increment retry count
+    retry_count = await models.increment_upload_retry(upload_id)
+
+    if retry_count >= upload.get('max_retries', 3):
+        # Max retries exceeded
+        await models.update_upload_status(
+            upload_id,
+            status='failed',
+            run_id=run_id,
+            error=error
+        )
+        should_retry = False
+        await models.update_roblox_project_status_by_upload(upload_id, 'failed')
+    else:
+        # Schedule retry after a backoff that depends on what went wrong
+        error_class = classify_upload_error(exc)
+        next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=retry_delay(error_class, retry_count))
+        await models.update_upload_status(
+            upload_id,
+            status='retry',
+            run_id=run_id,
+            error=error,
+            next_attempt_at=next_attempt_at
+        )
+        should_retry = True
+        await models.update_roblox_project_status_by_upload(upload_id, 'retry')
+        print(f"[{run_id}] Retry {retry_count} ({error_class}) not before {next_attempt_at.isoformat()}")
+
+    result = {
+        'success': False,
+        'upload_id': upload_id,
+        'error': error,
+        'should_retry': should_retry,
+        'retry_count': retry_count
+    }
+    if should_retry:
+        result.update(error_class=error_class, next_attempt_at=next_attempt_at.isoformat())
+    return result
+
+
+async def process_upload(upload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Process a single upload job.
+    Returns result with success status.
+    """
+    job = new_upload_job(upload)
+    try:
+        await prepare_and_download(job)
+        await transcode(job)
+        return await publish(job)
     except Exception as e:
-        error = f"Unexpected error: {str(e)}\n{traceback.format_exc()}"
-        print(f"[{run_id}] {error}")
-        
-        # Increment retry count
-        retry_count = await models.increment_upload_retry(upload_id)
-        
-        if retry_count >= upload.get('max_retries', 3):
-            await models.update_upload_status(
-                upload_id,
-                status='failed',
-                run_id=run_id,
-                error=error
-            )
-            should_retry = False
-            await models.update_roblox_project_status_by_upload(upload_id, 'failed')
-        else:
-            await models.update_upload_status(
-                upload_id,
-                status='retry',
-                run_id=run_id,
-                error=error
-            )
-            should_retry = True
-            await models.update_roblox_project_status_by_upload(upload_id, 'retry')
-        
-        return {
-            'success': False,
-            'upload_id': upload_id,
-            'error': error,
-            'should_retry': should_retry,
-            'retry_count': retry_count
-        }
+        return await handle_upload_error(job, e)
 
 
-async def process_batch(batch_size: int = 5) -> Dict[str, Any]:
+async def heartbeat_leases(upload_ids: List[UUID]) -> None:
+    """Keep extending this worker's lease on a running batch until cancelled."""
+    lease = timedelta(seconds=settings.upload_lease_seconds)
+    held = list(upload_ids)
+    while held:
+        await asyncio.sleep(settings.upload_lease_heartbeat_seconds)
+        try:
+            # Finished uploads drop out (their status is no longer 'uploading')
+            held = await models.extend_upload_leases(held, WORKER_ID, lease)
+        except Exception as e:
+            print(f"Warning: Could not extend upload leases: {e}")
+
+
+async def reclaim_expired_uploads() -> List[Dict[str, Any]]:
+    """Return uploads whose worker died mid-pipeline to the retry queue."""
+    reclaimed = await models.reclaim_expired_uploads(timedelta(seconds=settings.upload_lease_seconds))
+    for row in reclaimed:
+        print(f"  - Reclaimed upload {row['id']} from {row['claimed_by'] or 'unknown worker'} -> {row['status']}")
+    return reclaimed
+
+
+async def process_uploads(uploads: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Process a batch of due uploads.
-    Returns summary of processing results.
+    Run uploads through the staged executor (download → transcode → upload),
+    each stage with its own concurrency limit. Uploads are admitted by a
+    FairDispatcher: earliest scheduled_for first, round-robin across accounts,
+    capped globally, per account and per quota project (reserved on admission).
+    Returns summary of processing results, including per-stage and dispatch stats.
     """
-    uploads = await select_due_uploads(batch_size)
-    
-    if not uploads:
-        return {
-            'processed': 0,
-            'successful': 0,
-            'failed': 0,
-            'retrying': 0
-        }
-    
     results = {
         'processed': len(uploads),
         'successful': 0,
@@ -205,17 +577,64 @@ async def process_batch(batch_size: int = 5) -> Dict[str, Any]:
         'retrying': 0,
         'uploads': []
     }
-    
-    for upload in uploads:
-        result = await process_upload(upload)
+    if not uploads:
+        return results
+
+    executor = build_executor(
+        download=prepare_and_download,
+        transcode=transcode,
+        upload=publish,
+        on_error=handle_upload_error,
+    )
+    dispatcher = FairDispatcher(
+        global_limit=settings.dispatch_concurrency,
+        account_limit=settings.dispatch_per_account,
+        project_limit=settings.dispatch_per_project,
+        reserve=reserve_quota,
+    )
+    heartbeat = asyncio.create_task(heartbeat_leases([upload['id'] for upload in uploads]))
+    try:
+        outcomes = await executor.run([new_upload_job(upload) for upload in uploads], dispatcher=dispatcher)
+    finally:
+        heartbeat.cancel()
+
+    for result in outcomes:
+        if result is None:
+            # The error handler itself failed; the executor already logged it
+            results['failed'] += 1
+            continue
         results['uploads'].append(result)
-        
+
         if result['success']:
             results['successful'] += 1
         elif result.get('should_retry'):
             results['retrying'] += 1
         else:
             results['failed'] += 1
-    
+
+    results['stages'] = executor.stats()
+    results['dispatch'] = dispatcher.stats()
+    lags = {bucket: n for bucket, n in results['dispatch']['dispatch_lag_histogram'].items() if n}
+    print(f"Dispatch lag (start - scheduled_for): {lags}, max {results['dispatch']['max_dispatch_lag_seconds']}s")
+    cache = get_transcode_cache()
+    if cache:
+        results['cache'] = cache.stats()
     return results
 
+
+async def process_batch(batch_size: int = 5) -> Dict[str, Any]:
+    """
+    Process a batch of due uploads.
+    Returns summary of processing results.
+    """
+    uploads = await select_due_uploads(batch_size)
+
+    if not uploads:
+        return {
+            'processed': 0,
+            'successful': 0,
+            'failed': 0,
+            'retrying': 0
+        }
+
+    return await process_uploads(uploads)
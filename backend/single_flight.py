@@ -0,0 +1,164 @@
+"""
+Single-flight coalescing of download + transcode for the same source.
+Uploads whose cache key (source_video_id + transform parameters) matches an
+in-progress run wait for that run's artifact instead of fetching and encoding
+again. Across replicas, the producer holds a claim row in transform_claims
+(short TTL, heartbeated) until the result is in the transcode cache, so other
+replicas poll it and then reuse the cached result. No database connection is
+held while producing; a crashed producer's claim simply expires.
+"""
+import asyncio
+import os
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from deps import settings, WORKER_ID
+import models
+
+
+CLAIM_TTL = timedelta(seconds=120)
+CLAIM_HEARTBEAT_SECONDS = 40
+CLAIM_POLL_SECONDS = 2
+
+
+class Flight:
+    """One in-progress production of a transform (the leader) and its waiters."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.done = asyncio.Event()
+        self.waiters = 0
+        self.artifact: Optional[str] = None
+        self.claim: Optional[Dict[str, Any]] = None
+
+    def _consumed(self) -> None:
+        """A waiter is done with the artifact; the last one deletes it."""
+        self.waiters -= 1
+        if self.waiters <= 0 and self.artifact:
+            try:
+                os.remove(self.artifact)
+            except FileNotFoundError:
+                pass
+            self.artifact = None
+
+
+_flights: Dict[str, Flight] = {}
+
+
+def join(key: str) -> Tuple[Optional[Flight], bool]:
+    """
+    Returns (flight, is_leader). The leader produces the transform and must call
+    `finish`; others call `wait_for_artifact`. (None, True) when disabled.
+    """
+    if not settings.pipeline_single_flight:
+        return None, True
+    flight = _flights.get(key)
+    if flight:
+        flight.waiters += 1
+        return flight, False
+    flight = Flight(key)
+    _flights[key] = flight
+    return flight, True
+
+
+async def wait_for_artifact(flight: Flight, dest_path: str) -> bool:
+    """Wait for the leader and link its result to dest_path. False if it failed or took too long."""
+    try:
+        await asyncio.wait_for(flight.done.wait(), timeout=settings.pipeline_single_flight_wait_seconds)
+    except asyncio.TimeoutError:
+        pass
+    if not flight.done.is_set():
+        # Not counted at finish time, so no artifact is kept for us
+        flight.waiters -= 1
+        return False
+    try:
+        if not flight.artifact:
+            return False
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        os.link(flight.artifact, dest_path)
+        return True
+    except OSError as e:
+        print(f"⚠️ Warning: Could not reuse coalesced transform {flight.artifact}: {e}")
+        return False
+    finally:
+        flight._consumed()
+
+
+async def _heartbeat_claim(key: str, holder: str) -> None:
+    while True:
+        await asyncio.sleep(CLAIM_HEARTBEAT_SECONDS)
+        try:
+            if not await models.extend_transform_claim(key, holder, CLAIM_TTL):
+                print(f"⚠️ Warning: Lost single-flight claim for {key}")
+                return
+        except Exception as e:
+            print(f"⚠️ Warning: Could not extend single-flight claim for {key}: {e}")
+
+
+async def lock_across_replicas(flight: Flight) -> bool:
+    """
+    Leader only: claim this key across replicas, polling while another replica's
+    claim is live. Returns True if another replica held it (so the caller should
+    look in the transcode cache first). Gives up waiting after the configured
+    time and proceeds without the claim.
+    """
+    if not settings.pipeline_single_flight_across_replicas:
+        return False
+    key = f"transform:{flight.key}"
+    holder = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.pipeline_single_flight_wait_seconds
+    waited = False
+    try:
+        while not await models.claim_transform(key, holder, CLAIM_TTL):
+            if loop.time() >= deadline:
+                print(f"⚠️ Warning: Single-flight claim for {flight.key} still held after waiting, producing anyway")
+                return True
+            waited = True
+            await asyncio.sleep(CLAIM_POLL_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Warning: Could not claim single-flight key {flight.key}: {e}")
+        return waited
+    flight.claim = {
+        'key': key,
+        'holder': holder,
+        'heartbeat': asyncio.create_task(_heartbeat_claim(key, holder)),
+    }
+    return waited
+
+
+async def finish(flight: Optional[Flight], transform_path: Optional[str]) -> None:
+    """
+    Leader only: publish the result (None on failure) to waiters, then release the
+    cross-replica claim. Store the result in the transcode cache before calling this.
+    Waiters get a hard link of their own; the shared artifact is removed after the
+    last of them has linked it.
+    """
+    if flight is None or flight.done.is_set():
+        return
+    _flights.pop(flight.key, None)
+    if transform_path and flight.waiters > 0:
+        artifact = Path(settings.temp_dir) / 'single_flight' / f"{flight.key}.mp4"
+        try:
+            artifact.parent.mkdir(parents=True, exist_ok=True)
+            if artifact.exists():
+                artifact.unlink()
+            os.link(transform_path, artifact)
+            flight.artifact = str(artifact)
+        except OSError as e:
+            print(f"⚠️ Warning: Could not share transform {transform_path}: {e}")
+    flight.done.set()
+    if flight.claim:
+        claim, flight.claim = flight.claim, None
+        claim['heartbeat'].cancel()
+        try:
+            await models.release_transform_claim(claim['key'], claim['holder'])
+        except Exception as e:
+            print(f"⚠️ Warning: Could not release single-flight claim for {flight.key}: {e}")
+
+
+def in_flight() -> Dict[str, int]:
+    """Keys currently being produced and how many uploads wait on each."""
+    return {key: flight.waiters for key, flight in _flights.items()}
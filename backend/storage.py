@@ -0,0 +1,296 @@
+"""
+Supabase Storage client shared by the API and the worker.
+Every storage call goes through one pooled httpx.AsyncClient. Object bodies are
+streamed to and from disk in fixed-size chunks, and large downloads are split
+into parallel HTTP Range requests written straight into their file offsets, so
+memory use stays flat whatever the object size.
+"""
+import asyncio
+import os
+import re
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+from deps import settings
+
+
+class StorageError(Exception):
+    """Storage request failed (status is None for network errors)."""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+_CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+_client = None
+
+
+# Objects created by user uploads: user/<32 hex>.mp4
+USER_OBJECT_PATH_RE = re.compile(r'^user/[0-9a-f]{32}\.mp4$')
+
+
+def new_user_object_path() -> str:
+    return f"user/{uuid.uuid4().hex}.mp4"
+
+
+def new_ingest_object_path() -> str:
+    """Staging object for an uploaded ZIP until a background job ingests it."""
+    return f"ingest/{uuid.uuid4().hex}.zip"
+
+
+def storage_configured() -> bool:
+    return bool(settings.supabase_url and settings.supabase_service_role)
+
+
+def auth_headers() -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {settings.supabase_service_role}",
+        "apikey": settings.supabase_service_role,
+    }
+
+
+def object_url(object_path: str, bucket: Optional[str] = None) -> str:
+    """Authenticated URL of an object (also handed to ffprobe, which does its own range reads)."""
+    return f"{settings.supabase_url.rstrip('/')}/storage/v1/object/{bucket or settings.supabase_bucket}/{object_path}"
+
+
+def get_client():
+    """The process-wide pooled client, created on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        import httpx
+        _client = httpx.AsyncClient(
+            headers=auth_headers(),
+            timeout=httpx.Timeout(settings.storage_timeout_seconds, connect=10),
+            limits=httpx.Limits(
+                max_connections=settings.storage_max_connections,
+                max_keepalive_connections=settings.storage_max_connections,
+            ),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+async def _raise_for_status(response, action: str, ok=(200, 201)) -> None:
+    if response.status_code not in ok:
+        body = (await response.aread()).decode(errors='replace')[:300]
+        raise StorageError(f"Storage {action} failed: {response.status_code} {body}", response.status_code)
+
+
+def _write_stream_at(path: str, offset: int):
+    """File handle positioned at offset, for one ranged part (file already sized)."""
+    f = open(path, 'r+b')
+    f.seek(offset)
+    return f
+
+
+async def _stream_to(response, f) -> int:
+    """Copy the response body into f; the writes run in a thread, off the event loop."""
+    written = 0
+    async for chunk in response.aiter_bytes(settings.storage_chunk_bytes):
+        await asyncio.to_thread(f.write, chunk)
+        written += len(chunk)
+    return written
+
+
+async def _download_range(url: str, dest_path: str, start: int, end: int) -> int:
+    """GET bytes start..end (inclusive) into the same offsets of dest_path."""
+    async with get_client().stream('GET', url, headers={'Range': f'bytes={start}-{end}'}) as response:
+        await _raise_for_status(response, f'range download ({start}-{end})', ok=(206,))
+        with await asyncio.to_thread(_write_stream_at, dest_path, start) as f:
+            written = await _stream_to(response, f)
+    if written != end - start + 1:
+        raise StorageError(f"Short read for bytes {start}-{end}: got {written}")
+    return written
+
+
+def _plan_ranges(start: int, total: int, part_size: int) -> list:
+    return [(offset, min(offset + part_size, total) - 1) for offset in range(start, total, part_size)]
+
+
+async def download_to_file(object_path: str, dest_path: str, bucket: Optional[str] = None) -> int:
+    """
+    Stream an object to dest_path and return its size. The first request asks
+    for the first part only; when the server answers 206 with the total size and
+    there is more, the remaining parts are fetched concurrently (bounded by
+    storage_range_parallelism). A server that ignores Range gets a plain stream.
+    The first failing part cancels the others, and the call returns only once
+    none of them is still writing to dest_path.
+    """
+    url = object_url(object_path, bucket)
+    part_size = settings.storage_range_part_bytes
+    headers = {'Range': f'bytes=0-{part_size - 1}'} if settings.storage_range_parallelism > 1 else {}
+    try:
+        async with get_client().stream('GET', url, headers=headers) as response:
+            await _raise_for_status(response, 'download', ok=(200, 206))
+            match = _CONTENT_RANGE_RE.match(response.headers.get('content-range', ''))
+            with await asyncio.to_thread(open, dest_path, 'wb') as f:
+                first = await _stream_to(response, f)
+                total = int(match.group(3)) if response.status_code == 206 and match else first
+                if total > first:
+                    await asyncio.to_thread(f.truncate, total)
+        if total <= first:
+            return first
+
+        semaphore = asyncio.Semaphore(settings.storage_range_parallelism)
+
+        async def fetch(start: int, end: int) -> int:
+            async with semaphore:
+                return await _download_range(url, dest_path, start, end)
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                parts = [group.create_task(fetch(s, e)) for s, e in _plan_ranges(first, total, part_size)]
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0]
+        return first + sum(part.result() for part in parts)
+    except StorageError:
+        raise
+    except Exception as e:
+        raise StorageError(f"Storage download error: {e}")
+
+
+async def file_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(settings.storage_chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def reader_chunks(read: Callable[[int], Awaitable[bytes]]) -> AsyncIterator[bytes]:
+    """Chunks from an async read(n) such as FastAPI's UploadFile.read."""
+    while True:
+        chunk = await read(settings.storage_chunk_bytes)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def upload_stream(
+    chunks: AsyncIterator[bytes],
+    object_path: str,
+    content_type: str = "video/mp4",
+    size: Optional[int] = None,
+    bucket: Optional[str] = None,
+    upsert: bool = False
+) -> None:
+    """Upload a body produced chunk by chunk (sent chunked when size is unknown)."""
+    headers = {"Content-Type": content_type}
+    if size is not None:
+        headers["Content-Length"] = str(size)
+    if upsert:
+        headers["x-upsert"] = "true"
+    try:
+        response = await get_client().post(object_url(object_path, bucket), headers=headers, content=chunks)
+    except Exception as e:
+        raise StorageError(f"Storage upload error: {e}")
+    await _raise_for_status(response, 'upload')
+
+
+async def upload_file(
+    path: str,
+    object_path: str,
+    content_type: str = "video/mp4",
+    bucket: Optional[str] = None,
+    upsert: bool = False
+) -> int:
+    """Upload a file from disk without reading it into memory; returns its size."""
+    size = os.path.getsize(path)
+    await upload_stream(file_chunks(path), object_path, content_type, size=size, bucket=bucket, upsert=upsert)
+    return size
+
+
+def _absolute_url(signed: str) -> str:
+    """Signed paths come back relative to the storage API (older versions include /storage/v1)."""
+    base = settings.supabase_url.rstrip('/')
+    if signed.startswith('/storage/v1/'):
+        return f"{base}{signed}"
+    return f"{base}/storage/v1{signed}"
+
+
+async def create_signed_url(object_path: str, expires_in: int = 3600, bucket: Optional[str] = None) -> Optional[str]:
+    """Signed download URL, or None if signing failed (previews are optional)."""
+    sign_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/sign/{bucket or settings.supabase_bucket}/{object_path}"
+    try:
+        response = await get_client().post(sign_url, json={"expiresIn": expires_in})
+        if response.status_code not in (200, 201):
+            return None
+        data = response.json()
+    except Exception:
+        return None
+    if isinstance(data, dict) and 'signedURL' in data:
+        return _absolute_url(data['signedURL'])
+    return None
+
+
+async def create_signed_urls(
+    object_paths: List[str],
+    expires_in: int = 3600,
+    bucket: Optional[str] = None
+) -> Dict[str, Optional[str]]:
+    """Sign many objects in one request: {object_path: url or None}."""
+    urls: Dict[str, Optional[str]] = {path: None for path in object_paths}
+    if not object_paths:
+        return urls
+    sign_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/sign/{bucket or settings.supabase_bucket}"
+    try:
+        response = await get_client().post(sign_url, json={"expiresIn": expires_in, "paths": object_paths})
+        if response.status_code not in (200, 201):
+            return urls
+        data = response.json()
+    except Exception:
+        return urls
+    for entry in data if isinstance(data, list) else []:
+        if isinstance(entry, dict) and entry.get('path') in urls and entry.get('signedURL'):
+            urls[entry['path']] = _absolute_url(entry['signedURL'])
+    return urls
+
+
+async def create_signed_upload_url(object_path: str, bucket: Optional[str] = None) -> Dict[str, str]:
+    """
+    One-time URL the client PUTs the file body to, straight into storage (valid
+    for two hours on Supabase). Returns {'url', 'token'}.
+    """
+    sign_url = f"{settings.supabase_url.rstrip('/')}/storage/v1/object/upload/sign/{bucket or settings.supabase_bucket}/{object_path}"
+    try:
+        response = await get_client().post(sign_url)
+    except Exception as e:
+        raise StorageError(f"Storage upload signing error: {e}")
+    await _raise_for_status(response, 'upload signing')
+    data = response.json()
+    signed = data.get('url') if isinstance(data, dict) else None
+    if not signed:
+        raise StorageError(f"Storage upload signing returned no URL: {data}")
+    token = parse_qs(urlparse(signed).query).get('token', [''])[0]
+    return {'url': _absolute_url(signed), 'token': token}
+
+
+async def object_size(object_path: str, bucket: Optional[str] = None) -> Optional[int]:
+    """Size of a stored object, or None if it does not exist."""
+    try:
+        response = await get_client().head(object_url(object_path, bucket))
+    except Exception as e:
+        raise StorageError(f"Storage metadata error: {e}")
+    if response.status_code in (400, 404):
+        return None
+    await _raise_for_status(response, 'metadata', ok=(200,))
+    return int(response.headers.get('content-length') or 0)
+
+
+async def delete_object(object_path: str, bucket: Optional[str] = None) -> None:
+    try:
+        response = await get_client().delete(object_url(object_path, bucket))
+    except Exception as e:
+        raise StorageError(f"Storage delete error: {e}")
+    await _raise_for_status(response, 'delete', ok=(200, 204))
+
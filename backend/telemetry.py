@@ -0,0 +1,131 @@
+"""
+Per-stage pipeline telemetry, stored in pipeline_runs (one row per stage of a run).
+A stage is wrapped in `track_stage`; code running inside it (including threads
+started with asyncio.to_thread) adds metrics with `note` / `add` without having
+to thread a stats object through every call.
+"""
+import functools
+import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+import models
+
+
+STAGE_METRICS = (
+    'cpu_seconds', 'bytes_in', 'bytes_out', 'ffmpeg_speed', 'ytdlp_attempts', 'upload_bytes_per_second',
+)
+
+_current: ContextVar[Optional[Dict[str, Any]]] = ContextVar('pipeline_stage_metrics', default=None)
+
+_BENCH_RE = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
+_SPEED_RE = re.compile(r'speed=\s*([\d.]+)x')
+
+
+def note(**metrics: Any) -> None:
+    """Set metrics on the stage being tracked (no-op outside a stage)."""
+    current = _current.get()
+    if current is not None:
+        current.update(metrics)
+
+
+def add(name: str, value: float) -> None:
+    """Accumulate a counter on the stage being tracked (attempts, CPU seconds)."""
+    current = _current.get()
+    if current is not None:
+        current[name] = (current.get(name) or 0) + value
+
+
+def detail(**values: Any) -> None:
+    """Add free-form details (transform mode, cache hit, ...) to the tracked stage."""
+    current = _current.get()
+    if current is not None:
+        current['details'].update(values)
+
+
+def ffmpeg_cpu_seconds(stderr: str) -> Optional[float]:
+    """User + system CPU time from ffmpeg's `-benchmark` summary line."""
+    matches = _BENCH_RE.findall(stderr or '')
+    if not matches:
+        return None
+    utime, stime = matches[-1]
+    return float(utime) + float(stime)
+
+
+def record_ffmpeg(stderr: str) -> None:
+    """Take CPU time and the final speed factor from an ffmpeg run's stderr."""
+    cpu = ffmpeg_cpu_seconds(stderr)
+    if cpu is not None:
+        add('cpu_seconds', cpu)
+    speeds = _SPEED_RE.findall(stderr or '')
+    if speeds:
+        note(ffmpeg_speed=float(speeds[-1]))
+
+
+def source_platform(source_video_id: str) -> str:
+    """'youtube', 'user' (our storage bucket) or 'supabase' (any bucket)."""
+    if source_video_id.startswith(('user:', 'supabase:')):
+        return source_video_id.split(':', 1)[0]
+    return 'youtube'
+
+
+@asynccontextmanager
+async def track_stage(job: Dict[str, Any], stage: str):
+    """
+    Time a stage of an upload job and store a pipeline_runs row when it ends.
+    Yields the metrics dict, so callers can set bytes/details directly.
+    """
+    metrics: Dict[str, Any] = {'details': {}}
+    token = _current.set(metrics)
+    started = time.monotonic()
+    status, error = 'ok', None
+    try:
+        yield metrics
+    except BaseException as e:
+        # A stage that stops on purpose (no quota) notes status='skipped' first
+        status, error = metrics.pop('status', 'error'), str(e)[:500]
+        raise
+    finally:
+        _current.reset(token)
+        wall_seconds = time.monotonic() - started
+        await _record(job, stage, status, wall_seconds, metrics, error)
+
+
+def tracked(stage: str) -> Callable:
+    """Decorator for executor stage handlers that take the upload job dict."""
+    def decorator(handler: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        @functools.wraps(handler)
+        async def wrapper(job: Dict[str, Any]) -> Any:
+            async with track_stage(job, stage):
+                return await handler(job)
+        return wrapper
+    return decorator
+
+
+async def _record(
+    job: Dict[str, Any],
+    stage: str,
+    status: str,
+    wall_seconds: float,
+    metrics: Dict[str, Any],
+    error: Optional[str]
+) -> None:
+    upload = job['upload']
+    row = {name: metrics.get(name) for name in STAGE_METRICS}
+    try:
+        await models.insert_pipeline_run(
+            run_id=job['run_id'],
+            upload_id=upload['id'],
+            account_id=upload['account_id'],
+            source_platform=source_platform(upload['source_video_id']),
+            stage=stage,
+            status=status,
+            wall_seconds=wall_seconds,
+            error=error,
+            details=metrics['details'],
+            **row
+        )
+    except Exception as e:
+        # Telemetry must never fail an upload
+        print(f"[{job['run_id']}] Warning: Could not record {stage} telemetry: {e}")
@@ -0,0 +1,196 @@
+"""
+Content-addressed cache of transformed (Shorts-ready) files under settings.temp_dir.
+Keyed by source_video_id + a hash of the transform parameters, bounded by a byte
+budget (LRU eviction) and a TTL, so nothing stays on disk beyond either limit.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+from deps import settings
+
+
+class TranscodeCache:
+    """Size-bounded LRU cache of final MP4s. Entries are handed out as hard links."""
+
+    def __init__(self, root: str, max_bytes: int, ttl_seconds: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> {'path', 'size', 'created_at'}; order = least recently used first
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(source_video_id: str, params: Dict[str, Any]) -> str:
+        """Content address: source id plus a hash of the transform parameters."""
+        digest = hashlib.sha256(
+            json.dumps({'source': source_video_id, 'params': params}, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        return digest[:40]
+
+    def _load(self) -> None:
+        """Rebuild the index from disk after a restart (oldest first)."""
+        found = []
+        for path in self.root.glob('*.mp4'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path.stem, str(path), stat.st_size))
+        for created_at, key, path, size in sorted(found):
+            self._entries[key] = {'path': path, 'size': size, 'created_at': created_at}
+        self.sweep()
+
+    def _adopt(self, key: str) -> Optional[Dict[str, Any]]:
+        """Pick up an entry written by another process sharing this directory."""
+        path = self.root / f"{key}.mp4"
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        entry = {'path': str(path), 'size': stat.st_size, 'created_at': stat.st_mtime}
+        self._entries[key] = entry
+        return entry
+
+    def _remove(self, key: str, evicted: bool = True) -> None:
+        entry = self._entries.pop(key, None)
+        if not entry:
+            return
+        try:
+            os.remove(entry['path'])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Warning: Could not delete cache entry {entry['path']}: {e}")
+        if evicted:
+            self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        """Drop an entry that is no longer needed (not counted as an eviction)."""
+        self._remove(key, evicted=False)
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return now - entry['created_at'] > self.ttl_seconds
+
+    def total_bytes(self) -> int:
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def sweep(self) -> None:
+        """Drop expired entries, then least recently used ones until under budget."""
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if self._expired(e, now)]:
+            self._remove(key)
+        total = self.total_bytes()
+        while self._entries and total > self.max_bytes:
+            key = next(iter(self._entries))
+            total -= self._entries[key]['size']
+            self._remove(key)
+
+    def fetch(self, key: str, dest_path: str) -> bool:
+        """
+        On a hit, link the cached file to dest_path (the run's own temp file,
+        deleted by the normal cleanup) and return True.
+        """
+        entry = self._entries.get(key) or self._adopt(key)
+        if entry and (self._expired(entry, time.time()) or not os.path.exists(entry['path'])):
+            self._remove(key)
+            entry = None
+        if not entry:
+            self.misses += 1
+            return False
+        try:
+            _link_or_copy(entry['path'], dest_path)
+        except Exception as e:
+            print(f"⚠️ Warning: Could not read cache entry {entry['path']}: {e}")
+            self._remove(key)
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def store(self, key: str, src_path: str) -> bool:
+        """Add a finished transform to the cache and enforce the budget."""
+        try:
+            size = os.path.getsize(src_path)
+        except OSError:
+            return False
+        if size > self.max_bytes:
+            return False
+        self._remove(key, evicted=False)
+        target = str(self.root / f"{key}.mp4")
+        try:
+            _link_or_copy(src_path, target)
+        except Exception as e:
+            print(f"⚠️ Warning: Could not cache {src_path}: {e}")
+            return False
+        self._entries[key] = {'path': target, 'size': size, 'created_at': time.time()}
+        self.sweep()
+        return key in self._entries
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'entries': len(self._entries),
+            'bytes': self.total_bytes(),
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+        }
+
+
+def _link_or_copy(src: str, dest: str) -> None:
+    """Hard link (same filesystem, no extra bytes); copy as a fallback."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+_cache: Optional[TranscodeCache] = None
+_staging: Optional[TranscodeCache] = None
+
+
+def get_transcode_cache() -> Optional[TranscodeCache]:
+    """Get or create the process-wide cache (None when disabled)."""
+    global _cache
+    if not settings.transcode_cache_enabled:
+        return None
+    if _cache is None:
+        _cache = TranscodeCache(
+            str(Path(settings.temp_dir) / 'transcode_cache'),
+            settings.transcode_cache_max_bytes,
+            settings.transcode_cache_ttl_seconds,
+        )
+    return _cache
+
+
+def get_staging_area() -> Optional[TranscodeCache]:
+    """
+    Prefetched uploads, keyed by upload id (None when prefetch is disabled).
+    Same LRU/TTL bookkeeping as the transcode cache, with its own budget; the TTL
+    covers the lookahead plus an hour of slack for late or retried uploads.
+    """
+    global _staging
+    if not settings.prefetch_enabled:
+        return None
+    if _staging is None:
+        _staging = TranscodeCache(
+            str(Path(settings.temp_dir) / 'staging'),
+            settings.prefetch_staging_max_bytes,
+            settings.prefetch_lookahead_minutes * 60 + 3600,
+        )
+    return _staging
@@ -0,0 +1,131 @@
+"""
+Event-driven worker wakeups.
+A trigger on uploads NOTIFYs models.UPLOADS_CHANNEL on insert and on status /
+scheduled_for / next_attempt_at changes. The worker LISTENs on a dedicated
+connection and keeps a min-heap of upcoming due times (scheduled_for, or
+next_attempt_at while a retry backs off), so it sleeps until exactly the next
+due upload or the next notification instead of polling every minute. The heap
+is rebuilt from the database after every tick; polling is only a safety net.
+"""
+import asyncio
+import heapq
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from deps import settings
+import models
+
+
+# Statuses the due-upload query picks up
+WAITING_STATUSES = ('scheduled', 'retry', 'prepared')
+
+
+class DueTimer:
+    """Next-due times of waiting uploads plus the LISTEN connection that keeps them current."""
+
+    def __init__(self, horizon: timedelta = timedelta(hours=24)):
+        self.horizon = horizon
+        self.heap: List[Tuple[datetime, str]] = []
+        self.times: Dict[str, datetime] = {}
+        self.changed = asyncio.Event()
+        self.conn = None
+
+    # Heap maintenance (stale entries are skipped lazily via self.times)
+
+    def push(self, upload_id: str, when: datetime) -> None:
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        self.times[upload_id] = when
+        heapq.heappush(self.heap, (when, upload_id))
+
+    def discard(self, upload_id: str) -> None:
+        self.times.pop(upload_id, None)
+
+    def next_due(self) -> Optional[datetime]:
+        while self.heap:
+            when, upload_id = self.heap[0]
+            if self.times.get(upload_id) == when:
+                return when
+            heapq.heappop(self.heap)
+        return None
+
+    async def refresh(self) -> None:
+        """Rebuild from the database (after each tick and on the safety poll)."""
+        rows = await models.list_upcoming_upload_times(datetime.now(timezone.utc) + self.horizon)
+        self.heap, self.times = [], {}
+        for row in rows:
+            self.push(str(row['id']), row['due_at'])
+
+    # LISTEN/NOTIFY
+
+    @property
+    def listening(self) -> bool:
+        return self.conn is not None and not self.conn.is_closed()
+
+    async def listen(self) -> bool:
+        """(Re)open the LISTEN connection if needed. False when it cannot be opened."""
+        if self.listening:
+            return True
+        import asyncpg
+        try:
+            await models.ensure_uploads_notify_trigger()
+            # LISTEN needs a session, so not through pgbouncer in transaction mode
+            self.conn = await asyncpg.connect(
+                settings.database_listen_url or settings.database_url,
+                statement_cache_size=0
+            )
+            await self.conn.add_listener(models.UPLOADS_CHANNEL, self._on_notify)
+            self.conn.add_termination_listener(lambda conn: self.changed.set())
+            print(f"[{datetime.now(timezone.utc)}] Listening for upload changes on '{models.UPLOADS_CHANNEL}'")
+            return True
+        except Exception as e:
+            print(f"[{datetime.now(timezone.utc)}] Could not LISTEN for upload changes (falling back to polling): {e}")
+            await self.close()
+            return False
+
+    def _on_notify(self, conn, pid: int, channel: str, payload: str) -> None:
+        try:
+            data: Dict[str, Any] = json.loads(payload)
+            upload_id = str(data['id'])
+            due_at = data.get('due_at') or data.get('scheduled_for')
+            scheduled_for = datetime.fromisoformat(due_at) if due_at else None
+        except Exception as e:
+            print(f"Warning: Bad {channel} payload {payload!r}: {e}")
+            return
+        if data.get('status') not in WAITING_STATUSES or scheduled_for is None:
+            self.discard(upload_id)
+            return
+        previous = self.next_due()
+        self.push(upload_id, scheduled_for)
+        if previous is None or scheduled_for < previous:
+            # New earliest deadline: recompute the sleep
+            self.changed.set()
+
+    async def close(self) -> None:
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    def pop_overdue(self, now: datetime) -> int:
+        """Drop entries already due (the tick just ran what it could); returns how many."""
+        count = 0
+        while True:
+            when = self.next_due()
+            if when is None or when > now:
+                return count
+            _, upload_id = heapq.heappop(self.heap)
+            self.times.pop(upload_id, None)
+            count += 1
+
+    async def wait(self, timeout: float) -> None:
+        """Sleep for up to timeout seconds, or until a notification brings the next due time forward."""
+        if timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.changed.clear()
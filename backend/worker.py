@@ -3,8 +3,14 @@ import asyncio
 import signal
 from datetime import datetime, timedelta, time as time_cls, timezone
 from deps import settings, get_db_pool, close_db_pool
-from scheduler import process_batch
+from scheduler import plan_batch, process_uploads, prepare_upcoming, reclaim_expired_uploads
+from models import skip_and_reschedule_uploads
 from quotas import reset_all_quotas
+from transcode_cache import get_transcode_cache
+from ytdlp_engine import shutdown_engine
+import storage
+from jobs import JobRunner
+from wakeups import DueTimer
 
 SPAIN_OFFSET = timedelta(hours=1)  # UTC+1 por defecto
 
@@ -17,6 +23,10 @@ class Worker:
         self.batch_size = settings.worker_batch_size
         self.roblox_sync_interval = timedelta(minutes=5)
         self.last_roblox_sync = datetime.min.replace(tzinfo=timezone.utc)
+        self.prefetch_task: asyncio.Task | None = None
+        self.job_runner = JobRunner()
+        self.jobs_task: asyncio.Task | None = None
+        self.due_timer = DueTimer()
 
     def handle_shutdown(self, signum, frame):
         print(f"\nReceived signal {signum}, shutting down gracefully...")
@@ -32,77 +42,85 @@ class Worker:
             except Exception as e:
                 print(f"[{now}] Error resetting quotas: {e}")
 
-    async def get_due_uploads(self, db, limit):
-        """Consider 'scheduled' uploads as pending if the scheduled time has arrived."""
-        query = """
-            SELECT * FROM uploads
-            WHERE status = 'pending' OR (status = 'scheduled' AND scheduled_for <= NOW())
-            ORDER BY scheduled_for ASC
-            LIMIT $1
+    def start_prefetch(self):
+        """Prepare uploads due within the lookahead in the background, one pass at a time."""
+        if not settings.prefetch_enabled:
+            return
+        if self.prefetch_task and not self.prefetch_task.done():
+            return
+        self.prefetch_task = asyncio.create_task(self.run_prefetch())
+
+    async def run_prefetch(self):
+        try:
+            results = await prepare_upcoming(settings.prefetch_batch_size)
+            if results['claimed']:
+                print(f"[{datetime.now(timezone.utc)}] Prefetch summary: Claimed={results['claimed']}, Prepared={results['prepared']}, Staging={results.get('staging')}")
+        except Exception as e:
+            print(f"[{datetime.now(timezone.utc)}] Prefetch error: {e}")
+
+    async def wait_for_next_tick(self, results):
         """
-        uploads = await db.fetch(query, limit)
-        print(f"[{datetime.now(timezone.utc)}] Found {len(uploads)} pending/scheduled uploads:")
-        for u in uploads:
-            print(f"  - Upload ID {u['id']} | Account {u['account_id']} | Scheduled: {u['scheduled_for']} | Status: {u['status']}")
-        return uploads
+        Sleep until the next upload is due, a change notification arrives or a
+        periodic chore (Roblox sync, midnight quota reset) is due. Without a
+        LISTEN connection this falls back to polling every poll_interval.
+        """
+        if not settings.worker_wakeups_enabled:
+            await asyncio.sleep(self.poll_interval)
+            return
+        try:
+            await self.due_timer.refresh()
+        except Exception as e:
+            print(f"[{datetime.now(timezone.utc)}] Could not load upcoming uploads: {e}")
+            await asyncio.sleep(self.poll_interval)
+            return
+        listening = await self.due_timer.listen()
+
+        now = datetime.now(timezone.utc)
+        next_midnight = datetime.combine(now.date() + timedelta(days=1), time_cls(0, 0, 30), tzinfo=timezone.utc)
+        timeout = min(
+            settings.worker_safety_poll_interval if listening else self.poll_interval,
+            (self.last_roblox_sync + self.roblox_sync_interval - now).total_seconds(),
+            (next_midnight - now).total_seconds(),
+        )
+        if self.due_timer.pop_overdue(now):
+            # Due uploads left over: go again right away while the batch makes
+            # progress, otherwise (quota, inactive account) retry at the poll rate
+            timeout = min(timeout, 1 if results['processed'] else self.poll_interval)
+        next_due = self.due_timer.next_due()
+        if next_due is not None:
+            timeout = min(timeout, (next_due - now).total_seconds())
+        await self.due_timer.wait(max(timeout, 0))
 
     async def process_batch_wrapper(self, batch_size):
-        db = await get_db_pool()
-        uploads = await self.get_due_uploads(db, batch_size)
+        """
+        One planning query per tick: due uploads come back already claimed and go
+        to the executor together, exactly once; 'pending' uploads that are not due
+        yet are rescheduled when their account already has uploads today.
+        """
+        plan = await plan_batch(batch_size)
+        now_utc = datetime.now(timezone.utc)
         results = {'processed': 0, 'successful': 0, 'failed': 0, 'rescheduled': 0}
-
-        for upload in uploads:
-            now_utc = datetime.now(timezone.utc)
-            scheduled_for = upload['scheduled_for']
-
-            # Parse datetime if string
-            if isinstance(scheduled_for, str):
-                try:
-                    if scheduled_for.endswith("Z"):
-                        scheduled_for = scheduled_for[:-1] + "+00:00"
-                    scheduled_for = datetime.fromisoformat(scheduled_for)
-                except Exception:
-                    scheduled_for = datetime.strptime(scheduled_for, "%Y-%m-%d %H:%M:%S")
-            if scheduled_for.tzinfo is None:
-                scheduled_for = scheduled_for.replace(tzinfo=timezone.utc)
-
-            print(f"[{now_utc}] Processing upload {upload['id']} | Scheduled: {scheduled_for} | Account: {upload['account_id']}")
-
-            today_start = datetime.combine(now_utc.date(), time_cls(0, 0, 0), tzinfo=timezone.utc)
-            query_count = """
-                SELECT COUNT(*) FROM uploads
-                WHERE account_id = $1
-                  AND scheduled_for >= $2
-            """
-            scheduled_count = await db.fetchval(query_count, upload['account_id'], today_start)
-            print(f"  - Scheduled uploads today for account {upload['account_id']}: {scheduled_count}")
-
-            # Skip if too many scheduled today
-            if scheduled_for > now_utc and scheduled_count > 1:
-                reschedule_day = scheduled_count - 1
-                new_schedule = (today_start + timedelta(days=reschedule_day)).replace(hour=17, minute=0, tzinfo=timezone.utc)
-                query_update = """
-                    UPDATE uploads
-                    SET status = 'skipped', scheduled_for = $1
-                    WHERE id = $2
-                """
-                await db.execute(query_update, new_schedule, upload['id'])
-                print(f"  - Upload {upload['id']} skipped, rescheduled for {new_schedule}")
-                results['rescheduled'] += 1
-                continue
-
-            # Process upload if scheduled time has arrived
-            if scheduled_for <= now_utc:
-                try:
-                    print(f"  - Upload {upload['id']} is due, processing now...")
-                    res = await process_batch()  # No arguments, evitar error
-                    results['processed'] += 1
-                    results['successful'] += res.get('successful', 0)
-                    results['failed'] += res.get('failed', 0)
-                    print(f"  - Upload {upload['id']} processed successfully | Success: {res.get('successful', 0)}, Failed: {res.get('failed', 0)}")
-                except Exception as e:
-                    print(f"  - Failed to process upload {upload['id']}: {e}")
-                    results['failed'] += 1
+        print(f"[{now_utc}] Found {len(plan['due'])} due and {len(plan['early'])} early pending uploads")
+
+        # Skip if too many scheduled today
+        today_start = datetime.combine(now_utc.date(), time_cls(0, 0, 0), tzinfo=timezone.utc)
+        reschedules = []
+        for upload in plan['early']:
+            scheduled_count = upload['scheduled_today']
+            if scheduled_count > 1:
+                new_schedule = (today_start + timedelta(days=scheduled_count - 1)).replace(hour=17, minute=0)
+                reschedules.append((upload['id'], new_schedule))
+                print(f"  - Upload {upload['id']} skipped ({scheduled_count} scheduled today for account {upload['account_id']}), rescheduled for {new_schedule}")
+        await skip_and_reschedule_uploads(reschedules)
+        results['rescheduled'] = len(reschedules)
+
+        if plan['due']:
+            for upload in plan['due']:
+                print(f"  - Upload {upload['id']} | Account {upload['account_id']} | Scheduled: {upload['scheduled_for']} | Was: {upload['claimed_from_status']}")
+            res = await process_uploads(plan['due'])
+            results['processed'] = res['processed']
+            results['successful'] = res['successful']
+            results['failed'] = res['failed']
 
         return results
 
@@ -116,6 +134,9 @@ class Worker:
 
         await get_db_pool()
 
+        # Scans, Roblox runs and ZIP ingestion queued by the API
+        self.jobs_task = asyncio.create_task(self.job_runner.run(lambda: self.running))
+
         # Initial Roblox automation
         try:
             from roblox_scheduler import ensure_daily_roblox_video
@@ -143,12 +164,30 @@ class Worker:
                         self.last_roblox_sync = now_utc
 
                 await self.check_quota_reset()
+
+                # Uploads left 'uploading' by a dead worker go back to retry
+                try:
+                    reclaimed = await reclaim_expired_uploads()
+                    if reclaimed:
+                        print(f"  - Reclaimed {len(reclaimed)} upload(s) with expired leases")
+                except Exception as e:
+                    print(f"  - Lease reaper error: {e}")
+
+                # Enforce transcode cache TTL/budget even when nothing is processed
+                cache = get_transcode_cache()
+                if cache:
+                    cache.sweep()
+                    print(f"  - Transcode cache: {cache.stats()}")
+
+                # Download/transcode upcoming uploads while due ones are published
+                self.start_prefetch()
+
                 results = await self.process_batch_wrapper(self.batch_size)
 
                 print(f"[{now_utc}] Batch summary: Processed={results['processed']}, Successful={results['successful']}, Failed={results['failed']}, Rescheduled={results['rescheduled']}")
 
                 if self.running:
-                    await asyncio.sleep(self.poll_interval)
+                    await self.wait_for_next_tick(results)
 
             except Exception as e:
                 print(f"[{datetime.now(timezone.utc)}] Error in worker loop: {e}")
@@ -157,6 +196,19 @@ class Worker:
                 if self.running:
                     await asyncio.sleep(30)
 
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+            try:
+                await self.prefetch_task
+            except asyncio.CancelledError:
+                pass
+        await self.due_timer.close()
+        if self.jobs_task:
+            self.jobs_task.cancel()
+            await asyncio.gather(self.jobs_task, return_exceptions=True)
+            await self.job_runner.stop()
+        shutdown_engine()
+        await storage.close_client()
         print(f"[{datetime.now(timezone.utc)}] Closing database connections...")
         await close_db_pool()
         print(f"[{datetime.now(timezone.utc)}] Worker stopped.")
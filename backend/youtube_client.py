@@ -2,8 +2,10 @@
 YouTube Data API v3 client wrapper.
 SOLO busca y procesa Shorts (videos de 1-60 segundos).
 """
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from datetime import datetime, timedelta
+import json
+import time
 from googleapiclient.http import MediaFileUpload
 from googleapiclient.errors import HttpError
 
@@ -110,6 +112,62 @@ def parse_duration(duration_str: str) -> int:
     return hours * 3600 + minutes * 60 + seconds
 
 
+# Resumable upload chunking: sizes must be multiples of 256 KiB
+CHUNK_ALIGN = 256 * 1024
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+TARGET_CHUNK_SECONDS = 5.0
+
+
+class AdaptiveMediaFileUpload(MediaFileUpload):
+    """
+    MediaFileUpload whose chunk size follows measured throughput, so each chunk
+    takes about TARGET_CHUNK_SECONDS: few round trips on fast links, little
+    re-sent data on slow or flaky ones.
+    """
+
+    def __init__(self, filename: str, mimetype: str, chunksize: int = MIN_CHUNK_SIZE):
+        super().__init__(filename, mimetype=mimetype, resumable=True, chunksize=_align_chunk(chunksize))
+        self._adaptive_chunksize = _align_chunk(chunksize)
+        self._throughput = None
+
+    def chunksize(self) -> int:
+        return self._adaptive_chunksize
+
+    def record_chunk(self, sent_bytes: int, seconds: float) -> None:
+        """Update the throughput estimate (EWMA) and the next chunk size."""
+        if sent_bytes <= 0 or seconds <= 0:
+            return
+        rate = sent_bytes / seconds
+        self._throughput = rate if self._throughput is None else 0.7 * self._throughput + 0.3 * rate
+        self._adaptive_chunksize = _align_chunk(self._throughput * TARGET_CHUNK_SECONDS)
+
+
+def _align_chunk(size: float) -> int:
+    size = min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, int(size)))
+    return size - size % CHUNK_ALIGN
+
+
+def query_upload_session(http, session_uri: str, total_bytes: int) -> Optional[Dict[str, Any]]:
+    """
+    Ask YouTube how much of a resumable session it has stored.
+    Returns {'offset': int} for an open session, {'response': dict} if the upload
+    had already completed, or None if the session expired or is unknown.
+    """
+    resp, content = http.request(
+        session_uri,
+        method='PUT',
+        headers={'Content-Length': '0', 'Content-Range': f'bytes */{total_bytes}'}
+    )
+    if resp.status in (200, 201):
+        return {'response': json.loads(content)}
+    if resp.status == 308:
+        # 'bytes=0-N' confirms N+1 bytes; no Range header means nothing stored yet
+        confirmed = resp.get('range')
+        return {'offset': int(confirmed.rsplit('-', 1)[1]) + 1 if confirmed else 0}
+    return None
+
+
 def upload_video(
     youtube,
     file_path: str,
@@ -117,11 +175,18 @@ def upload_video(
     description: str,
     tags: List[str],
     category_id: str = "22",  # People & Blogs
-    privacy_status: str = "unlisted"
+    privacy_status: str = "unlisted",
+    resume: Optional[Dict[str, Any]] = None,
+    on_progress: Optional[Callable[[str, int, int], None]] = None
 ) -> Dict[str, Any]:
     """
     Upload a video to YouTube.
     Returns video metadata including video_id.
+
+    `resume` ({'session_uri', 'chunk_size'}) continues a previous resumable session
+    from the offset YouTube confirms. `on_progress(session_uri, offset, chunk_size)`
+    is called after every chunk, and once more if the upload fails, so callers can
+    persist the session.
     
     Quota cost: ~1600 units
     """
@@ -138,11 +203,10 @@ def upload_video(
         }
     }
     
-    media = MediaFileUpload(
+    media = AdaptiveMediaFileUpload(
         file_path,
         mimetype='video/mp4',
-        resumable=True,
-        chunksize=1024*1024  # 1MB chunks
+        chunksize=(resume or {}).get('chunk_size') or MIN_CHUNK_SIZE
     )
     
     request = youtube.videos().insert(
@@ -152,14 +216,37 @@ def upload_video(
     )
     
     response = None
-    while response is None:
-        status, response = request.next_chunk()
-        if status:
-            print(f"Upload progress: {int(status.progress() * 100)}%")
+    resumed_from = 0
+    if resume:
+        session = query_upload_session(request.http, resume['session_uri'], media.size())
+        if session is None:
+            print("Upload session expired, starting a new one")
+        elif 'response' in session:
+            response = session['response']
+        else:
+            request.resumable_uri = resume['session_uri']
+            request.resumable_progress = resumed_from = session['offset']
+            print(f"Resuming upload at byte {resumed_from}/{media.size()}")
+
+    try:
+        while response is None:
+            sent_before = request.resumable_progress
+            started = time.monotonic()
+            status, response = request.next_chunk()
+            sent = (request.resumable_progress if status else media.size()) - sent_before
+            media.record_chunk(sent, time.monotonic() - started)
+            if status:
+                print(f"Upload progress: {int(status.progress() * 100)}% (next chunk {media.chunksize() // 1024} KiB)")
+                if on_progress:
+                    on_progress(request.resumable_uri, request.resumable_progress, media.chunksize())
+    except Exception:
+        if on_progress and request.resumable_uri:
+            on_progress(request.resumable_uri, request.resumable_progress, media.chunksize())
+        raise
     
     return {
         'video_id': response['id'],
         'title': response['snippet']['title'],
-        'url': f"https://www.youtube.com/watch?v={response['id']}"
+        'url': f"https://www.youtube.com/watch?v={response['id']}",
+        'resumed_from': resumed_from
     }
-
@@ -0,0 +1,242 @@
+"""
+In-process yt-dlp engine (YTDLP_ENGINE=python).
+Drives yt-dlp through its Python API in worker processes instead of spawning the
+binary per attempt: each worker keeps one YoutubeDL (cookie jar, HTTP session,
+loaded extractors) for its whole life, and extracted info JSON is cached per
+video id with a TTL so retries and repeat sources skip extraction. A cached
+info is dropped only when a failure says its stream URLs went stale.
+Each call carries its own deadline inside the worker (SIGALRM), so a stuck
+download fails alone instead of taking the whole pool down with it.
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+from deps import settings
+
+
+# Worker-process state (one YoutubeDL per process)
+_ydl = None
+
+# Parent-process state
+_pool: Optional[ProcessPoolExecutor] = None
+_info_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+# Extra time the parent gives a worker past its own deadline before giving up on the pool
+WORKER_GRACE_SECONDS = 30
+
+# Failures meaning the cached info's stream URLs are no longer usable
+STALE_INFO_MARKERS = (
+    'http error 403', 'http error 410', 'requested format is not available',
+    'signature', 'expired',
+)
+
+
+class EngineTimeout(Exception):
+    """A worker call ran past its deadline and was interrupted inside the worker."""
+
+
+def engine_enabled() -> bool:
+    return settings.ytdlp_engine == 'python'
+
+
+def _parse_extractor_args(value: str) -> Dict[str, Dict[str, list]]:
+    """'youtube:player_client=android,web;skip=dash' -> yt-dlp extractor_args dict."""
+    result: Dict[str, Dict[str, list]] = {}
+    if not value or ':' not in value:
+        return result
+    ie_key, args = value.split(':', 1)
+    for pair in args.split(';'):
+        if '=' in pair:
+            key, values = pair.split('=', 1)
+            result.setdefault(ie_key.strip().lower(), {})[key.strip()] = [v.strip() for v in values.split(',')]
+    return result
+
+
+def build_engine_options() -> Dict[str, Any]:
+    """YoutubeDL params equivalent to the flags in pipeline.build_ytdlp_cmd."""
+    opts: Dict[str, Any] = {
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        'noprogress': True,
+        'sleep_interval_subtitles': 5,
+        'extractor_retries': 3,
+        'fragment_retries': 5,
+        'retries': settings.ytdlp_retries or 10,
+        'format_sort': [f.strip() for f in settings.ytdlp_format_sort.split(',') if f.strip()],
+    }
+    if settings.ytdlp_sleep_requests:
+        opts['sleep_interval_requests'] = settings.ytdlp_sleep_requests
+    if not settings.ytdlp_rate_limit_enabled:
+        # Without the shared token bucket, pace each download on its own
+        opts.update({'sleep_interval_requests': settings.ytdlp_sleep_requests or 3, 'sleep_interval': 8, 'max_sleep_interval': 15})
+    if settings.ytdlp_use_ipv4:
+        opts['source_address'] = '0.0.0.0'
+    if settings.ytdlp_extractor_args:
+        opts['extractor_args'] = _parse_extractor_args(settings.ytdlp_extractor_args)
+    if settings.ytdlp_cookies_file:
+        opts['cookiefile'] = settings.ytdlp_cookies_file
+    elif settings.ytdlp_cookies_from_browser:
+        opts['cookiesfrombrowser'] = (settings.ytdlp_cookies_from_browser,)
+    return opts
+
+
+def _init_worker(opts: Dict[str, Any]) -> None:
+    """Worker initializer: load yt-dlp and its extractors once."""
+    global _ydl
+    from yt_dlp import YoutubeDL
+    _ydl = YoutubeDL(opts)
+    signal.signal(signal.SIGALRM, _on_deadline)
+
+
+def _on_deadline(signum, frame) -> None:
+    raise EngineTimeout("yt-dlp engine call timed out")
+
+
+def _worker_call(timeout: float, fn, *args):
+    """Run fn with a deadline enforced in this worker; other workers are untouched."""
+    deadline = time.monotonic() + timeout
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    except Exception:
+        # yt-dlp may wrap the interruption in its own error type
+        if time.monotonic() >= deadline:
+            raise EngineTimeout(f"yt-dlp engine call timed out after {timeout}s")
+        raise
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _set_user_agent(user_agent: Optional[str]) -> None:
+    if user_agent:
+        _ydl.params.setdefault('http_headers', {})['User-Agent'] = user_agent
+
+
+def _worker_extract(video_id: str, user_agent: Optional[str]) -> Dict[str, Any]:
+    """Extract (but do not process/download) the info JSON for a video."""
+    _set_user_agent(user_agent)
+    info = _ydl.extract_info(f'https://www.youtube.com/watch?v={video_id}', download=False, process=False)
+    return _ydl.sanitize_info(info)
+
+
+def _worker_download(info: Dict[str, Any], output_path: str, plan: Dict[str, Any], user_agent: Optional[str]) -> None:
+    """Select formats per plan and download from an already-extracted info JSON."""
+    from yt_dlp.utils import download_range_func
+
+    _set_user_agent(user_agent)
+    _ydl.params['outtmpl'] = {'default': output_path}
+    _ydl.params['format_sort'] = [f.strip() for f in plan['format_sort'].split(',') if f.strip()]
+    _ydl.params['merge_output_format'] = 'mp4'
+    _ydl.params['download_ranges'] = None
+    if plan.get('sections'):
+        end = float(plan['sections'].rsplit('-', 1)[1])
+        _ydl.params['download_ranges'] = download_range_func(None, [(0, end)])
+    _ydl.format_selector = _ydl.build_format_selector(plan['format'])
+    _ydl.process_ie_result(info, download=True)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=max(1, settings.ytdlp_engine_workers),
+            initializer=_init_worker,
+            initargs=(build_engine_options(),),
+        )
+    return _pool
+
+
+def _reset_pool(expected: Optional[ProcessPoolExecutor] = None) -> None:
+    """
+    Kill the workers and start fresh ones on the next call. With `expected`, only
+    if that pool is still the current one (another task may have replaced it).
+    """
+    global _pool
+    if expected is not None and _pool is not expected:
+        return
+    pool, _pool = _pool, None
+    if pool is None:
+        return
+    for process in list(getattr(pool, '_processes', {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_engine() -> None:
+    _reset_pool()
+
+
+async def _run_in_worker(timeout: float, fn, *args):
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(pool, _worker_call, timeout, fn, *args),
+            timeout=timeout + WORKER_GRACE_SECONDS
+        )
+    except EngineTimeout:
+        raise subprocess.TimeoutExpired(['yt-dlp-engine', fn.__name__], timeout)
+    except asyncio.TimeoutError:
+        # The worker ignored its own deadline (stuck outside Python code): last resort
+        print(f"⚠️ Warning: yt-dlp engine worker stuck in {fn.__name__}, restarting the pool")
+        _reset_pool(pool)
+        raise subprocess.TimeoutExpired(['yt-dlp-engine', fn.__name__], timeout)
+    except BrokenProcessPool:
+        # A worker died (OOM, crash); start fresh workers on the next call
+        _reset_pool(pool)
+        raise
+
+
+async def get_info(video_id: str, user_agent: Optional[str] = None) -> Dict[str, Any]:
+    """Info JSON for a video, from the TTL cache or a fresh extraction."""
+    cached = _info_cache.get(video_id)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    info = await _run_in_worker(120, _worker_extract, video_id, user_agent)
+    _info_cache[video_id] = (time.time() + settings.ytdlp_info_cache_ttl, info)
+    # Keep the cache from growing without bound
+    for key in [k for k, (expires, _) in _info_cache.items() if expires <= time.time()]:
+        _info_cache.pop(key, None)
+    return info
+
+
+def invalidate_info(video_id: str) -> None:
+    _info_cache.pop(video_id, None)
+
+
+def is_stale_info_error(message: str) -> bool:
+    message = message.lower()
+    return any(marker in message for marker in STALE_INFO_MARKERS)
+
+
+async def engine_download(
+    video_id: str,
+    output_path: str,
+    plan: Dict[str, Any],
+    user_agent: Optional[str] = None,
+    timeout: float = 300
+) -> subprocess.CompletedProcess:
+    """
+    Download through the engine. Returns a CompletedProcess whose stderr holds the
+    yt-dlp error text, so callers classify failures exactly like the binary's.
+    """
+    cmd = ['yt-dlp-engine', video_id]
+    try:
+        info = await get_info(video_id, user_agent)
+        await _run_in_worker(timeout, _worker_download, info, output_path, plan, user_agent)
+    except Exception as e:
+        if is_stale_info_error(str(e)):
+            # Stream URLs in the cached info expired; extract again next time
+            invalidate_info(video_id)
+        if isinstance(e, subprocess.TimeoutExpired):
+            raise
+        return subprocess.CompletedProcess(cmd, 1, '', str(e))
+    if not os.path.exists(output_path):
+        return subprocess.CompletedProcess(cmd, 1, '', f"Downloaded file not found: {output_path}")
+    return subprocess.CompletedProcess(cmd, 0, '', '')
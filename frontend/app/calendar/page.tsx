@@ -98,6 +98,7 @@ export default function CalendarPage() {
     switch (status) {
       case 'done': return 'bg-green-500'
       case 'scheduled': return 'bg-blue-500'
+      case 'prepared': return 'bg-indigo-500'
       case 'uploading': return 'bg-yellow-500'
       case 'failed': return 'bg-red-500'
       case 'retry': return 'bg-orange-500'
@@ -53,6 +53,7 @@ function DashboardContent() {
     switch (status) {
       case 'done': return 'bg-green-100 text-green-800'
       case 'scheduled': return 'bg-blue-100 text-blue-800'
+      case 'prepared': return 'bg-indigo-100 text-indigo-800'
       case 'uploading': return 'bg-yellow-100 text-yellow-800'
       case 'failed': return 'bg-red-100 text-red-800'
       case 'retry': return 'bg-orange-100 text-orange-800'
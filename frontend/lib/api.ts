@@ -50,7 +50,7 @@ export interface Upload {
   id: string
   account_id: string
   video_id: string
-  status: 'scheduled' | 'uploading' | 'done' | 'failed' | 'retry' | 'paused'
+  status: 'scheduled' | 'prepared' | 'uploading' | 'done' | 'failed' | 'retry' | 'paused'
   scheduled_for: string
   run_id?: string
   youtube_video_id?: string
@@ -58,6 +58,7 @@ export interface Upload {
   description: string
   tags: string[]
   retry_count: number
+  next_attempt_at?: string
   error?: string
   created_at: string
   updated_at: string
@@ -83,6 +84,19 @@ export interface DashboardMetrics {
   }
 }
 
+export interface BackgroundJob<R = unknown> {
+  id: string
+  kind: string
+  status: 'queued' | 'running' | 'succeeded' | 'failed'
+  progress: Record<string, unknown>
+  result?: R
+  error?: string
+  attempts: number
+  created_at: string
+  started_at?: string
+  finished_at?: string
+}
+
 class APIClient {
   private baseUrl: string
 
@@ -154,16 +168,31 @@ class APIClient {
     return this.request<{ themes: Theme[] }>('/themes')
   }
 
+  async getJob<R = unknown>(jobId: string) {
+    return this.request<BackgroundJob<R>>(`/jobs/${jobId}`)
+  }
+
+  // Long operations run as background jobs on the worker; poll until they finish
+  async waitForJob<R = unknown>(jobId: string, intervalMs = 2000): Promise<R> {
+    for (;;) {
+      const job = await this.getJob<R>(jobId)
+      if (job.status === 'succeeded') return job.result as R
+      if (job.status === 'failed') throw new Error(job.error || 'Job failed')
+      await new Promise(resolve => setTimeout(resolve, intervalMs))
+    }
+  }
+
   async scanTheme(theme_slug: string, account_id: string, search_query?: string) {
-    return this.request<{
+    const { job_id } = await this.request<{ job_id: string }>('/themes/scan', {
+      method: 'POST',
+      body: JSON.stringify({ theme_slug, account_id, search_query }),
+    })
+    return this.waitForJob<{
       theme: string
       channels_found: number
       videos_found: number
       videos_inserted: number
-    }>('/themes/scan', {
-      method: 'POST',
-      body: JSON.stringify({ theme_slug, account_id, search_query }),
-    })
+    }>(job_id)
   }
 
   async listVideos(theme: string, state: 'new' | 'picked' | 'all' = 'new', limit = 50) {
@@ -238,30 +267,53 @@ class APIClient {
     return this.request<DashboardMetrics['quota']>('/quota/status')
   }
 
-  async uploadUserVideo(params: { theme_slug: string; title?: string; file: File }) {
-    const url = `${this.baseUrl}/user-videos/upload`
-    const form = new FormData()
-    form.append('theme_slug', params.theme_slug)
-    if (params.title) form.append('title', params.title)
-    form.append('file', params.file)
-    const resp = await fetch(url, { method: 'POST', body: form })
-    if (!resp.ok) {
-      const text = await resp.text()
-      throw new Error(`API error: ${resp.status} - ${text}`)
+  async uploadUserVideo(params: { theme_slug?: string; title?: string; file: File }) {
+    // Direct to storage: the API only signs the upload and registers the result
+    const target = await this.request<{ storage_path: string; upload_url: string; method: string }>(
+      '/user-videos/upload-url',
+      { method: 'POST' }
+    )
+    const put = await fetch(target.upload_url, {
+      method: target.method,
+      headers: { 'Content-Type': params.file.type || 'video/mp4' },
+      body: params.file,
+    })
+    if (!put.ok) {
+      const text = await put.text()
+      throw new Error(`Storage upload error: ${put.status} - ${text}`)
     }
-    return resp.json() as Promise<{ video: Video }>
+    return this.request<{ video: Video; preview_url?: string }>('/user-videos/upload-complete', {
+      method: 'POST',
+      body: JSON.stringify({
+        storage_path: target.storage_path,
+        title: params.title || params.file.name,
+        theme_slug: params.theme_slug,
+      }),
+    })
   }
 
   async uploadUserVideosBatch(files: File[]) {
-    const url = `${this.baseUrl}/user-videos/upload-batch`
-    const form = new FormData()
-    for (const f of files) form.append('files', f)
-    const resp = await fetch(url, { method: 'POST', body: form })
-    if (!resp.ok) {
-      const text = await resp.text()
-      throw new Error(`API error: ${resp.status} - ${text}`)
+    const items: Array<{ video: Video; preview_url?: string }> = []
+    for (const f of files.filter(f => !f.name.toLowerCase().endsWith('.zip'))) {
+      items.push(await this.uploadUserVideo({ file: f }))
+    }
+    const zips = files.filter(f => f.name.toLowerCase().endsWith('.zip'))
+    if (zips.length) {
+      const form = new FormData()
+      for (const f of zips) form.append('files', f)
+      const resp = await fetch(`${this.baseUrl}/user-videos/upload-batch`, { method: 'POST', body: form })
+      if (!resp.ok) {
+        const text = await resp.text()
+        throw new Error(`API error: ${resp.status} - ${text}`)
+      }
+      const data = await resp.json() as { items: Array<{ video: Video; preview_url?: string }>; jobs: Array<{ job_id: string }> }
+      items.push(...data.items)
+      for (const job of data.jobs) {
+        const result = await this.waitForJob<{ items: Array<{ video: Video; preview_url?: string }> }>(job.job_id)
+        items.push(...result.items)
+      }
     }
-    return resp.json() as Promise<{ items: Array<{ video: Video; preview_url?: string }>; count: number }>
+    return { items, count: items.length }
   }
 
   async scheduleUserBulk(params: {
@@ -34,7 +34,7 @@ export interface Upload {
   id: string;
   account_id: string;
   video_id: string;
-  status: 'scheduled' | 'uploading' | 'done' | 'failed' | 'retry' | 'paused';
+  status: 'scheduled' | 'prepared' | 'uploading' | 'done' | 'failed' | 'retry' | 'paused';
   scheduled_for: string;
   run_id?: string;
   youtube_video_id?: string;
@@ -42,6 +42,7 @@ export interface Upload {
   description: string;
   tags: string[];
   retry_count: number;
+  next_attempt_at?: string;
   error?: string;
   created_at: string;
   updated_at: string;
@@ -22,6 +22,7 @@ CREATE TABLE themes (
   title TEXT NOT NULL,
   search_keywords TEXT[] DEFAULT '{}',
   default_hashtags TEXT[] DEFAULT '{}',
+  encode_profile TEXT,
   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
@@ -41,6 +42,7 @@ CREATE TABLE accounts (
   oauth_error_code TEXT,
   oauth_error_message TEXT,
   oauth_last_error_at TIMESTAMPTZ,
+  encode_profile TEXT,
   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
   updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
@@ -67,6 +69,29 @@ CREATE TABLE videos (
 CREATE INDEX idx_videos_theme ON videos(theme_slug, created_at DESC);
 CREATE INDEX idx_videos_picked ON videos(picked, theme_slug);
 
+-- Video media info (ffprobe metadata, probed once at ingest)
+CREATE TABLE video_media_info (
+  video_id UUID PRIMARY KEY REFERENCES videos(id) ON DELETE CASCADE,
+  format_name TEXT,
+  duration DOUBLE PRECISION,
+  size_bytes BIGINT,
+  bit_rate BIGINT,
+  video_codec TEXT,
+  width INT,
+  height INT,
+  pix_fmt TEXT,
+  fps DOUBLE PRECISION,
+  video_bit_rate BIGINT,
+  rotation INT NOT NULL DEFAULT 0,
+  has_audio BOOLEAN NOT NULL DEFAULT false,
+  audio_codec TEXT,
+  audio_bit_rate BIGINT,
+  audio_channels INT,
+  audio_sample_rate INT,
+  probe JSONB NOT NULL DEFAULT '{}'::jsonb,
+  probed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
 -- Roblox generator projects (tracks generated content assignments)
 -- Uploads (the job queue)
 CREATE TABLE uploads (
@@ -83,6 +108,12 @@ CREATE TABLE uploads (
   retry_count INT NOT NULL DEFAULT 0,
   max_retries INT NOT NULL DEFAULT 3,
   error TEXT,
+  prepare_started_at TIMESTAMPTZ,
+  prepared_at TIMESTAMPTZ,
+  claimed_by TEXT,
+  claimed_at TIMESTAMPTZ,
+  lease_expires_at TIMESTAMPTZ,
+  next_attempt_at TIMESTAMPTZ,
   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
   updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
@@ -90,6 +121,8 @@ CREATE TABLE uploads (
 CREATE INDEX idx_uploads_status ON uploads(status, scheduled_for);
 CREATE INDEX idx_uploads_account ON uploads(account_id, scheduled_for DESC);
 CREATE INDEX idx_uploads_run ON uploads(run_id);
+CREATE INDEX idx_uploads_lease ON uploads(lease_expires_at) WHERE status = 'uploading';
+CREATE INDEX idx_uploads_next_attempt ON uploads(next_attempt_at) WHERE status = 'retry';
 
 -- Upload History
 CREATE TABLE upload_history (
@@ -103,6 +136,18 @@ CREATE TABLE upload_history (
 
 CREATE INDEX idx_upload_history_upload ON upload_history(upload_id, created_at DESC);
 
+-- Resumable YouTube upload sessions (survive worker restarts and retries)
+CREATE TABLE upload_sessions (
+  upload_id UUID PRIMARY KEY REFERENCES uploads(id) ON DELETE CASCADE,
+  session_uri TEXT NOT NULL,
+  offset_bytes BIGINT NOT NULL DEFAULT 0,
+  total_bytes BIGINT NOT NULL,
+  content_sha256 TEXT NOT NULL,
+  chunk_size INT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
 -- Quota History
 CREATE TABLE quota_history (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -116,6 +161,67 @@ CREATE TABLE quota_history (
 
 CREATE INDEX idx_quota_history_project ON quota_history(api_project_id, created_at DESC);
 
+-- Pipeline telemetry (one row per stage of each run)
+CREATE TABLE pipeline_runs (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  run_id TEXT NOT NULL,
+  upload_id UUID REFERENCES uploads(id) ON DELETE SET NULL,
+  account_id UUID,
+  source_platform TEXT NOT NULL,
+  stage TEXT NOT NULL,
+  status TEXT NOT NULL,
+  wall_seconds DOUBLE PRECISION NOT NULL,
+  cpu_seconds DOUBLE PRECISION,
+  bytes_in BIGINT,
+  bytes_out BIGINT,
+  ffmpeg_speed DOUBLE PRECISION,
+  ytdlp_attempts INT,
+  upload_bytes_per_second DOUBLE PRECISION,
+  details JSONB NOT NULL DEFAULT '{}'::jsonb,
+  error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX idx_pipeline_runs_created ON pipeline_runs(created_at DESC, stage);
+CREATE INDEX idx_pipeline_runs_run ON pipeline_runs(run_id);
+
+-- Rate limit buckets (token buckets shared by all worker replicas)
+CREATE TABLE rate_limit_buckets (
+  name TEXT PRIMARY KEY,
+  tokens DOUBLE PRECISION NOT NULL,
+  capacity DOUBLE PRECISION NOT NULL,
+  refill_per_second DOUBLE PRECISION NOT NULL,
+  penalty_until TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Single-flight claims: the replica producing a transform (TTL, heartbeated)
+CREATE TABLE transform_claims (
+  key TEXT PRIMARY KEY,
+  holder TEXT NOT NULL,
+  expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Background jobs (long-running API operations run by the worker)
+CREATE TABLE background_jobs (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  kind TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'queued',
+  payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+  progress JSONB NOT NULL DEFAULT '{}'::jsonb,
+  result JSONB,
+  error TEXT,
+  attempts INT NOT NULL DEFAULT 0,
+  max_attempts INT NOT NULL DEFAULT 3,
+  worker_id TEXT,
+  heartbeat_at TIMESTAMPTZ,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  started_at TIMESTAMPTZ,
+  finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX idx_background_jobs_status ON background_jobs(status, created_at);
+
 -- Roblox generator projects (tracks generated content assignments)
 CREATE TABLE roblox_projects (
   generator_project_id UUID PRIMARY KEY,
@@ -156,3 +262,18 @@ CREATE TRIGGER update_uploads_updated_at BEFORE UPDATE ON uploads
 CREATE TRIGGER update_roblox_projects_updated_at BEFORE UPDATE ON roblox_projects
   FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Wake the worker when an upload is added, rescheduled or backed off (LISTEN uploads_changed)
+CREATE OR REPLACE FUNCTION notify_uploads_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('uploads_changed', json_build_object(
+    'id', NEW.id, 'status', NEW.status, 'scheduled_for', NEW.scheduled_for,
+    'due_at', GREATEST(NEW.scheduled_for, NEW.next_attempt_at)
+  )::text);
+  RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER uploads_notify_changed AFTER INSERT OR UPDATE OF status, scheduled_for, next_attempt_at ON uploads
+  FOR EACH ROW EXECUTE FUNCTION notify_uploads_changed();
+
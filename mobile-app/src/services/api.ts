@@ -42,7 +42,7 @@ export interface Account {
 export interface Upload {
   id: string;
   account_id: string;
-  status: 'scheduled' | 'uploading' | 'done' | 'failed' | 'retry' | 'paused';
+  status: 'scheduled' | 'prepared' | 'uploading' | 'done' | 'failed' | 'retry' | 'paused';
   scheduled_for: string;
   title: string;
   youtube_video_id?: string;